@@ -0,0 +1,6 @@
+"""
+LawLens 引擎公共组件 (server.py 与 scripts/ 共用)
+"""
+from engine.embedding_cache import EmbeddingCache, get_embedding_cache
+
+__all__ = ["EmbeddingCache", "get_embedding_cache"]
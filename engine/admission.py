@@ -0,0 +1,185 @@
+"""
+/api/analyze 准入控制
+
+- 全局并发上限：同时进行中的 LLM 调用 (流式 / 风险评分) 不超过 max_inflight；
+  一个请求并发发起多路上游调用 (长文档分段润色、分批风险评分) 时按扇出宽度 (weight) 计入
+- 每用户并发上限：单个 user_id 最多占用 per_user 个名额，其余请求排队
+- 令牌桶限速：每个用户每秒补充 rate 个令牌，桶容量 burst，耗尽直接拒绝 (429)
+- 公平队列：按用户轮转放行 (而非全局先来先服务)，重度用户排再多请求也不会饿死其他人
+- 排队总数超过 max_queue 时拒绝 (503)，不无限堆积
+
+单事件循环内使用，无需加锁。
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+from engine.metrics import Counter, Histogram, REGISTRY
+
+ADMISSION_REJECTED = Counter("lawlens_admission_rejected_total", "准入控制拒绝的请求数", ("reason",))
+QUEUE_WAIT_SECONDS = Histogram("lawlens_queue_wait_seconds", "排队等待时长 (秒)")
+REGISTRY.extend([ADMISSION_REJECTED, QUEUE_WAIT_SECONDS])
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, status_code: int, retry_after: float = 1.0):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """取一个令牌；成功返回 0，否则返回需等待的秒数"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Ticket:
+    def __init__(self, controller: "AdmissionController", user: str, weight: int = 1):
+        self.controller = controller
+        self.user = user
+        self.weight = weight
+        self.granted = asyncio.get_running_loop().create_future()
+        self.created = time.monotonic()
+        self.released = False
+
+    def position(self) -> int:
+        return self.controller.position(self)
+
+    async def wait(self, interval: float = 1.0) -> AsyncIterator[int]:
+        """等待放行；排队期间每当位置变化时产出当前位置 (从 1 开始)，已放行则不产出"""
+        last = None
+        while not self.granted.done():
+            pos = self.position()
+            if pos != last:
+                last = pos
+                yield pos
+            try:
+                await asyncio.wait_for(asyncio.shield(self.granted), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self):
+        """归还名额 / 退出队列；可重复调用"""
+        if self.released: return
+        self.released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, max_inflight: int = 32, per_user: int = 2, rate: float = 0.5, burst: float = 10,
+                 max_queue: int = 200):
+        self.max_inflight = max_inflight
+        self.per_user = per_user
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.inflight = 0
+        self._user_inflight: Dict[str, int] = {}
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()  # 按轮转顺序排列的用户队列
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def check_rate(self, user: str):
+        """入口处调用：令牌桶限速 + 队列长度保护"""
+        bucket = self._buckets.pop(user, None) or TokenBucket(self.rate, self.burst)
+        self._buckets[user] = bucket
+        while len(self._buckets) > 10000:
+            self._buckets.popitem(last=False)
+        wait = bucket.take()
+        if wait > 0:
+            ADMISSION_REJECTED.inc(reason="rate_limit")
+            raise AdmissionRejected(f"请求过于频繁，请 {wait:.0f} 秒后重试", 429, wait)
+        if self.waiting >= self.max_queue:
+            ADMISSION_REJECTED.inc(reason="queue_full")
+            raise AdmissionRejected("服务繁忙，请稍后重试", 503)
+
+    def _eligible(self, user: str, weight: int = 1) -> bool:
+        return self.inflight + weight <= self.max_inflight and self._user_inflight.get(user, 0) < self.per_user
+
+    def _grant(self, ticket: Ticket):
+        self.inflight += ticket.weight
+        self._user_inflight[ticket.user] = self._user_inflight.get(ticket.user, 0) + 1
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - ticket.created)
+        ticket.granted.set_result(True)
+
+    def enqueue(self, user: str, weight: int = 1) -> Ticket:
+        """weight：该请求同时占用的上游调用数 (每用户上限仍按请求计 1)；超过 max_inflight 时按 max_inflight 计"""
+        ticket = Ticket(self, user, max(1, min(weight, self.max_inflight)))
+        if not self._queues.get(user) and self._eligible(user, ticket.weight):
+            self._grant(ticket)
+        else:
+            self._queues.setdefault(user, deque()).append(ticket)
+        return ticket
+
+    def _dispatch(self):
+        """按用户轮转放行：每轮每个可放行的用户最多一个请求，被放行的用户移到队尾"""
+        progressed = True
+        while progressed and self.inflight < self.max_inflight:
+            progressed = False
+            for user in list(self._queues):
+                if self.inflight >= self.max_inflight: return
+                if not self._eligible(user, self._queues[user][0].weight): continue
+                queue = self._queues.pop(user)
+                self._grant(queue.popleft())
+                if queue: self._queues[user] = queue
+                progressed = True
+
+    def _release(self, ticket: Ticket):
+        if ticket.granted.done():
+            self.inflight -= ticket.weight
+            left = self._user_inflight.get(ticket.user, 1) - 1
+            if left > 0: self._user_inflight[ticket.user] = left
+            else: self._user_inflight.pop(ticket.user, None)
+        else:
+            queue = self._queues.get(ticket.user)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue: del self._queues[ticket.user]
+            ticket.granted.cancel()
+        self._dispatch()
+
+    def position(self, ticket: Ticket) -> int:
+        """按轮转顺序估算排在前面的请求数 + 1 (忽略每用户上限造成的跳过)"""
+        queue = self._queues.get(ticket.user)
+        if not queue or ticket not in queue: return 0
+        users = list(self._queues)
+        me, index = users.index(ticket.user), queue.index(ticket)
+        ahead = index
+        for i, user in enumerate(users):
+            if i == me: continue
+            # 轮转顺序在前的用户，在本请求所在的那一轮也会先被放行
+            ahead += min(len(self._queues[user]), index + 1 if i < me else index)
+        return ahead + 1
+
+    @asynccontextmanager
+    async def slot(self, user: str, weight: int = 1):
+        """非流式调用使用：排队直到获得名额，退出时归还"""
+        ticket = self.enqueue(user, weight)
+        try:
+            async for _ in ticket.wait():
+                pass
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict:
+        return {"inflight": self.inflight, "max_inflight": self.max_inflight, "waiting": self.waiting,
+                "users_waiting": len(self._queues), "per_user": self.per_user}
@@ -0,0 +1,98 @@
+"""
+批量 Embedding：一次 embeddings.create 发送多条输入
+
+- 自适应批大小：连续成功则翻倍 (不超过 max_batch)，请求体过大 (400/413) 则减半并下调上限
+- 限流 (429) / 网络抖动 / 5xx：指数退避 + 随机抖动重试
+- 先查 EmbeddingCache，只为未命中的文本发请求；同批内重复文本只算一次
+"""
+import random
+import threading
+import time
+from typing import List, Optional
+
+import openai
+
+from engine.embedding_cache import EmbeddingCache
+
+_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+class BatchEmbedder:
+    def __init__(self, client, model: str, cache: Optional[EmbeddingCache] = None,
+                 batch_size: int = 32, max_batch: int = 64, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self.client = client
+        self.model = model
+        self.cache = cache
+        self.batch_size = max(1, min(batch_size, max_batch))
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._streak = 0
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    # ---------- 批大小自适应 ----------
+    def _grow(self):
+        with self._lock:
+            self._streak += 1
+            if self._streak >= 3 and self.batch_size < self.max_batch:
+                self.batch_size = min(self.max_batch, self.batch_size * 2)
+                self._streak = 0
+
+    def _shrink(self, size: int) -> int:
+        with self._lock:
+            self._streak = 0
+            self.batch_size = max(1, min(self.batch_size, size // 2))
+            self.max_batch = max(self.batch_size, min(self.max_batch, size - 1))
+            return self.batch_size
+
+    def _backoff(self, attempt: int):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        time.sleep(delay * (0.5 + random.random() / 2))
+
+    # ---------- 请求 ----------
+    def _request(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """发送一批；遇到请求体过大时拆半递归，最终单条仍失败则返回 None"""
+        for attempt in range(self.max_retries):
+            try:
+                self.requests += 1
+                resp = self.client.embeddings.create(model=self.model, input=texts)
+                self._grow()
+                return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+            except _RETRYABLE as e:
+                self.retries += 1
+                print(f"   ⚠️ API 波动 ({type(e).__name__})，{attempt + 1}/{self.max_retries} 次退避重试...")
+                self._backoff(attempt)
+            except openai.APIStatusError as e:
+                if e.status_code not in (400, 413) or len(texts) == 1:
+                    print(f"   ❌ Embedding 失败，跳过 {len(texts)} 条: {e}")
+                    return [None] * len(texts)
+                half = self._shrink(len(texts))
+                return self._request(texts[:half]) + self._request(texts[half:])
+        print(f"   ❌ 重试耗尽，跳过 {len(texts)} 条")
+        return [None] * len(texts)
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending = {}  # 文本 -> 结果下标列表
+        cached_vecs = self.cache.get_many(texts, self.model) if self.cache else [None] * len(texts)
+        for i, (text, cached) in enumerate(zip(texts, cached_vecs)):
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.setdefault(text, []).append(i)
+
+        todo = list(pending)
+        start = 0
+        while start < len(todo):
+            batch = todo[start:start + self.batch_size]
+            vecs = self._request(batch)
+            if self.cache: self.cache.put_many(batch, self.model, vecs)  # 整批一次提交
+            for text, vec in zip(batch, vecs):
+                if vec is None: continue
+                for i in pending[text]: results[i] = vec
+            start += len(batch)
+        return results
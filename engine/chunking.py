@@ -0,0 +1,285 @@
+"""
+流式读取与切片：按块读取大文件，以生成器惰性产出切片，内存占用与文件大小无关
+
+- iter_text_blocks：按固定字节/字符块读取文本 (可选 mmap)，UTF-8 多字节字符跨块安全
+- iter_chunks：定长滑动窗口切片 (与旧版 chunk_text 输出一致)
+- iter_clauses：按「第X条」拆分法条，条号跨块边界时同样能正确识别
+- iter_statute_chunks / iter_case_chunks：结构化切片 (见下文)
+- html_to_text / split_clauses / split_sections：编辑器中的文书 (HTML) 按条款切分 (体检) 或打包成段 (长文档模式)
+"""
+import codecs
+import html
+import mmap
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+CLAUSE_PATTERN = r"(第[零一二三四五六七八九十百千]+条\s+)"
+BLOCK_SIZE = 1 << 20  # 1 MiB
+
+
+def iter_text_blocks(path: str, block_size: int = BLOCK_SIZE, use_mmap: bool = False,
+                     encoding: str = "utf-8") -> Iterator[str]:
+    if not use_mmap:
+        with open(path, "r", encoding=encoding) as f:
+            while True:
+                block = f.read(block_size)
+                if not block: return
+                yield block
+
+    if os.path.getsize(path) == 0: return
+    decoder = codecs.getincrementaldecoder(encoding)()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in range(0, len(mm), block_size):
+            block = decoder.decode(mm[start:start + block_size])
+            if block: yield block
+        tail = decoder.decode(b"", final=True)
+        if tail: yield tail
+
+
+def iter_chunks(blocks: Iterable[str], chunk_size: int = 500, overlap: int = 50) -> Iterator[str]:
+    step = chunk_size - overlap
+    buf, pos = "", 0
+    for block in blocks:
+        buf, pos = buf[pos:] + block, 0
+        while len(buf) - pos >= chunk_size:
+            yield buf[pos:pos + chunk_size]
+            pos += step
+    buf = buf[pos:]
+    for start in range(0, len(buf), step):
+        yield buf[start:start + chunk_size]
+
+
+def iter_clauses(blocks: Iterable[str], pattern: str = CLAUSE_PATTERN) -> Iterator[Tuple[str, str]]:
+    """产出 (条号, 正文)；首个条号之前的内容 (标题、目录等) 被丢弃"""
+    regex = re.compile(pattern)
+    buf = ""
+    header = None
+    for block in blocks:
+        buf += block
+        body_start = None
+        for m in regex.finditer(buf):
+            if header is not None:
+                body = buf[body_start if body_start is not None else 0:m.start()].strip()
+                if body: yield header, body
+            header, body_start = m.group(1).strip(), m.end()
+        if body_start is not None:
+            buf = buf[body_start:]
+        elif header is None:
+            buf = buf[-64:]  # 尚未遇到条号：只保留可能被截断的条号前缀
+    if header is not None and buf.strip():
+        yield header, buf.strip()
+
+
+# ===========================
+# 结构化切片：编/分编/章/节/条/款 + Token 预算打包
+# ===========================
+_NUM = "零〇一二三四五六七八九十百千"
+HEADING_LEVELS = ["编", "分编", "章", "节"]
+_HEADING_RES = [(level, re.compile(rf"^第[{_NUM}]+{level}(?:\s+|$)")) for level in HEADING_LEVELS]
+_ARTICLE_RE = re.compile(rf"^(第[{_NUM}]+条)(?:\s+|$)")
+_SENTENCE_RE = re.compile(r"(?<=[。；！？!?;])")
+_CJK_RE = re.compile(r"[　-〿㐀-鿿＀-￯]")
+
+LECARD_SECTIONS = {"ajjbqk": "案件基本情况", "pjjg": "判决结果", "qw": "全文"}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 Token 数：中日韩字符约 1 字 1 Token，其余约 4 字符 1 Token"""
+    cjk = len(_CJK_RE.findall(text))
+    rest = len(text) - cjk - text.count(" ") - text.count("\n")
+    return cjk + (max(rest, 0) + 3) // 4
+
+
+def iter_lines(blocks: Iterable[str]) -> Iterator[str]:
+    buf = ""
+    for block in blocks:
+        buf += block
+        *lines, buf = buf.split("\n")
+        yield from lines
+    if buf: yield buf
+
+
+def split_to_budget(text: str, budget: int) -> Iterator[str]:
+    """超长段落按句切分并打包；单句仍超预算则按字符硬切"""
+    if estimate_tokens(text) <= budget:
+        yield text
+        return
+    piece = ""
+    for sentence in filter(None, _SENTENCE_RE.split(text)):
+        while estimate_tokens(sentence) > budget:
+            if piece: yield piece
+            piece = ""
+            yield sentence[:budget]
+            sentence = sentence[budget:]
+        if piece and estimate_tokens(piece + sentence) > budget:
+            yield piece
+            piece = ""
+        piece += sentence
+    if piece: yield piece
+
+
+class _Packer:
+    """把同一层级下相邻的小单元 (条 / 段落) 拼成不超过预算的切片"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.units = []  # (名称, 正文)
+        self.tokens = 0
+        self.meta = {}
+
+    def add(self, name: Optional[str], paragraphs: List[str], meta: Dict) -> Iterator[Tuple[str, Dict]]:
+        if not paragraphs: return
+        text = "\n".join(paragraphs)
+        body = f"{name} {text}" if name else text
+        tokens = estimate_tokens(body)
+        if tokens > self.budget:
+            # 超长条文：先输出已打包内容，再按款 (段落) 拆分，每片都带条号
+            yield from self.flush()
+            yield from self._split_article(name, paragraphs, meta)
+            return
+        if self.units and self.tokens + tokens > self.budget:
+            yield from self.flush()
+        self.units.append((name, body))
+        self.tokens += tokens
+        self.meta = meta
+
+    def _split_article(self, name, paragraphs, meta):
+        budget = self.budget - (estimate_tokens(name) + 1 if name else 0)
+        pieces, start, last, buf = [], 1, 1, []
+        for idx, para in enumerate(paragraphs, 1):
+            for part in split_to_budget(para, budget):
+                if buf and estimate_tokens("\n".join(buf + [part])) > budget:
+                    pieces.append((start, last, buf))
+                    start, buf = idx, []
+                buf.append(part)
+                last = idx
+        if buf: pieces.append((start, last, buf))
+        for first, end, parts in pieces:
+            text = "\n".join(parts)
+            extra = {"articles": [name]} if name else {}
+            yield (f"{name} {text}" if name else text), dict(meta, paragraphs=[first, end], **extra)
+
+    def flush(self) -> Iterator[Tuple[str, Dict]]:
+        if not self.units: return
+        names = [n for n, _ in self.units if n]
+        content = "\n".join(body for _, body in self.units)
+        yield content, dict(self.meta, articles=names) if names else dict(self.meta)
+        self.units, self.tokens, self.meta = [], 0, {}
+
+
+def _breadcrumb(path: Dict[str, str]) -> str:
+    return " > ".join(path[level] for level in HEADING_LEVELS if path.get(level))
+
+
+def _content_budget(budget: int, prefix: str) -> int:
+    """切片首行附加的「【...】」也计入预算；层级路径过长时至少保留 1/4 预算给正文"""
+    return max(budget - estimate_tokens(prefix), budget // 4) if prefix else budget
+
+
+def iter_statute_chunks(lines: Iterable[str], budget: int = 512) -> Iterator[Tuple[str, Dict]]:
+    """
+    法律法规结构化切片，产出 (正文, 元数据)。
+    - 编/分编/章/节 标题更新层级路径，并作为切片边界 (不跨节打包)
+    - 同一节内相邻的短条文打包到预算内；超长条文按款、再按句拆分
+    - 无条文结构的文本按段落打包，退化为通用段落切片
+    - 正文首行附「【层级路径】」，便于检索与展示 (计入预算)
+    """
+    path: Dict[str, str] = {}
+    packer = _Packer(budget)
+    article, paragraphs = None, []
+
+    def emit(chunks):
+        for text, meta in chunks:
+            crumb = meta.get("path")
+            yield (f"【{crumb}】\n{text}" if crumb else text), meta
+
+    def close_article():
+        meta = {"path": _breadcrumb(path)} if path else {}
+        meta.update({level: path[level] for level in HEADING_LEVELS if path.get(level)})
+        return packer.add(article, paragraphs, meta)
+
+    for raw in lines:
+        line = raw.strip()
+        if not line: continue
+
+        level = next((lv for lv, regex in _HEADING_RES if regex.match(line)), None)
+        if level:
+            yield from emit(close_article())
+            yield from emit(packer.flush())
+            article, paragraphs = None, []
+            path[level] = line
+            for lower in HEADING_LEVELS[HEADING_LEVELS.index(level) + 1:]:
+                path.pop(lower, None)
+            packer.budget = _content_budget(budget, f"【{_breadcrumb(path)}】\n")  # packer 刚清空，可安全调整
+            continue
+
+        m = _ARTICLE_RE.match(line)
+        if m:
+            yield from emit(close_article())
+            article = m.group(1)
+            rest = line[m.end():].strip()
+            paragraphs = [rest] if rest else []
+        elif article is None:
+            # 条文之前 / 无结构文本：每段作为独立单元参与打包
+            yield from emit(packer.add(None, [line], {"path": _breadcrumb(path)} if path else {}))
+        else:
+            paragraphs.append(line)
+
+    yield from emit(close_article())
+    yield from emit(packer.flush())
+
+
+def iter_case_chunks(case: Dict, budget: int = 512) -> Iterator[Tuple[str, Dict]]:
+    """
+    LeCaRD 判决书切片：优先使用 ajjbqk (案件基本情况) 与 pjjg (判决结果) 分节切片，
+    缺失时回退到 qw (全文)；段落打包到预算内，不跨节。
+    """
+    keys = [k for k in ("ajjbqk", "pjjg") if (case.get(k) or "").strip()] or ["qw"]
+    for key in keys:
+        label = LECARD_SECTIONS[key]
+        packer = _Packer(_content_budget(budget, f"【{label}】\n"))
+        paragraphs = [p.strip() for p in (case.get(key) or "").split("\n") if p.strip()]
+        for para in paragraphs:
+            for text, meta in packer.add(None, [para], {"section": key}):
+                yield f"【{label}】\n{text}", meta
+        for text, meta in packer.flush():
+            yield f"【{label}】\n{text}", meta
+
+
+# ===========================
+# 编辑器文书切段 (HTML → 条款段落)
+# ===========================
+_BLOCK_TAG_RE = re.compile(r"</(p|div|h[1-6]|li|tr|blockquote)>|<br\s*/?>", re.IGNORECASE)
+_TAG_RE = re.compile(r"<[^>]+>")
+# 合同常见条款标题：第X条 (中文或阿拉伯数字) / 一、 / 1. / 1、 / （一）
+_CLAUSE_HEAD_RE = re.compile(r"^(第[0-9０-９零〇一二三四五六七八九十百千]+条|[一二三四五六七八九十]+、|\d+[.、．]|（[一二三四五六七八九十]+）)")
+
+
+def html_to_text(content: str) -> str:
+    text = _BLOCK_TAG_RE.sub("\n", content or "")
+    return html.unescape(_TAG_RE.sub("", text))
+
+
+def split_clauses(text: str, budget: int = 1200) -> List[str]:
+    """按条款标题切分 (每条一段)；超长条款按句拆分到预算内"""
+    clauses: List[List[str]] = []
+    for line in (l.strip() for l in text.split("\n")):
+        if not line: continue
+        if not clauses or _CLAUSE_HEAD_RE.match(line):
+            clauses.append([line])
+        else:
+            clauses[-1].append(line)
+    return [piece for clause in ("\n".join(c) for c in clauses) for piece in split_to_budget(clause, budget)]
+
+
+def split_sections(text: str, budget: int = 1200) -> List[str]:
+    """按条款标题切段；相邻短段打包到预算内，超长段按句拆分"""
+    sections, current = [], ""
+    for piece in split_clauses(text, budget):
+        if current and estimate_tokens(current) + estimate_tokens(piece) > budget:
+            sections.append(current)
+            current = ""
+        current = f"{current}\n{piece}" if current else piece
+    if current: sections.append(current)
+    return sections
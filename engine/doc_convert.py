@@ -0,0 +1,146 @@
+"""
+上传文档转换 (/api/upload)
+
+- 上传内容分块写入磁盘临时文件 (边写边算 sha256，超出大小上限立即中止)，不在内存中保留整份 bytes
+- 转换在有界进程池中执行：mammoth 解析大合同 (含图片) 不再阻塞事件循环
+- 按文件哈希缓存转换结果：重复上传直接返回；同一文件并发上传只转换一次
+- 支持 .docx / .pdf (需安装 pypdf) / .txt
+"""
+import asyncio
+import hashlib
+import html
+import os
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+CHUNK = 1024 * 1024
+
+
+class ConvertError(Exception):
+    pass
+
+
+def detect_kind(filename: str, head: bytes) -> str:
+    if head.startswith(b"PK\x03\x04"): return "docx"
+    if head.startswith(b"%PDF"): return "pdf"
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".txt", ".md"): return "txt"
+    raise ConvertError("不支持的文件格式，请上传 .docx / .pdf / .txt 文件")
+
+
+def _paragraphs_to_html(text: str) -> str:
+    return "".join(f"<p>{html.escape(line.strip())}</p>" for line in text.splitlines() if line.strip())
+
+
+def convert_file(path: str, kind: str) -> str:
+    """在子进程中执行：返回 HTML"""
+    if kind == "docx":
+        import mammoth
+        with open(path, "rb") as f:
+            return mammoth.convert_to_html(f).value
+    if kind == "pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise ConvertError("服务器未安装 pypdf，暂不支持 PDF")
+        reader = PdfReader(path)
+        return "".join(_paragraphs_to_html(page.extract_text() or "") for page in reader.pages)
+    with open(path, "rb") as f:
+        raw = f.read()
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            return _paragraphs_to_html(raw.decode(encoding))
+        except UnicodeDecodeError:
+            continue
+    raise ConvertError("无法识别文本编码")
+
+
+class UploadConverter:
+    def __init__(self, workers: int = 2, max_bytes: int = 20 * 1024 * 1024, cache_size: int = 64,
+                 timeout: float = 60.0, spool_dir: Optional[str] = None):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.spool_dir = spool_dir
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.conversions = 0
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._sem = asyncio.Semaphore(self.workers * 2)  # 排队中的转换任务上限，超出的请求在此等待
+        return self._pool
+
+    async def spool(self, upload) -> Tuple[str, str, bytes]:
+        """分块落盘，返回 (临时文件路径, sha256, 文件头)"""
+        h = hashlib.sha256()
+        size, head = 0, b""
+        fd, path = tempfile.mkstemp(prefix="lawlens-upload-", dir=self.spool_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = await upload.read(CHUNK)
+                    if not chunk: break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ConvertError(f"文件过大 (上限 {self.max_bytes // (1024 * 1024)}MB)")
+                    if not head: head = chunk[:8]
+                    h.update(chunk)
+                    out.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        if size == 0:
+            os.remove(path)
+            raise ConvertError("文件为空")
+        return path, h.hexdigest(), head
+
+    async def convert(self, upload) -> str:
+        path, digest, head = await self.spool(upload)
+        try:
+            kind = detect_kind(upload.filename, head)
+            key = f"{kind}:{digest}"
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            if key in self._inflight:  # 同一文件正在转换
+                self.hits += 1
+                return await asyncio.shield(self._inflight[key])
+
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                pool = self._executor()
+                async with self._sem:
+                    result = await asyncio.wait_for(
+                        asyncio.get_running_loop().run_in_executor(pool, convert_file, path, kind), self.timeout)
+                self.conversions += 1
+                self._cache[key] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                future.set_result(result)
+                return result
+            except BaseException as e:
+                future.set_exception(e if isinstance(e, Exception) else ConvertError("转换被取消"))
+                future.exception()  # 无并发等待者时避免 "exception was never retrieved" 警告
+                raise
+            finally:
+                del self._inflight[key]
+        finally:
+            os.remove(path)
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "conversions": self.conversions, "size": len(self._cache),
+                "max_size": self.cache_size, "workers": self.workers}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
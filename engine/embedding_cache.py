@@ -0,0 +1,147 @@
+"""
+Embedding 缓存：内存 LRU + TTL，可选 sqlite 落盘
+
+- 键：sha256(模型名 + 规范化文本)，规范化 = NFKC + 去首尾空白 + 折叠连续空白
+- 内存层：OrderedDict 实现的定长 LRU，过期条目在读取时淘汰
+- 磁盘层：可选 sqlite，向量以 float32 二进制存储，进程重启/脚本之间共享
+- get_many / put_many：一次查询 / 一次提交处理整批；启用磁盘层时异步调用方应放到线程池执行 (见 has_disk)
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+_WS = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "")
+    return _WS.sub(" ", text).strip()
+
+
+class EmbeddingCache:
+    def __init__(self, max_size: int = 4096, ttl: float = 7 * 24 * 3600, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._mem: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, created REAL, vec BLOB)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remember(self, key: str, vec: List[float], created: float):
+        self._mem[key] = (created, vec)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_size:
+            self._mem.popitem(last=False)
+
+    @property
+    def has_disk(self) -> bool:
+        """启用 sqlite 层时 get / put 会做磁盘 I/O，异步代码中不应直接在事件循环里调用"""
+        return self._db is not None
+
+    def _mem_get(self, key: str) -> Optional[List[float]]:
+        item = self._mem.get(key)
+        if item is None: return None
+        if self._expired(item[0]):
+            del self._mem[key]
+            return None
+        self._mem.move_to_end(key)
+        return item[1]
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        return self.get_many([text], model)[0]
+
+    def get_many(self, texts: List[str], model: str) -> List[Optional[List[float]]]:
+        keys = [self.make_key(t, model) for t in texts]
+        out: List[Optional[List[float]]] = [None] * len(keys)
+        with self._lock:
+            missing: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                out[i] = self._mem_get(key)
+                if out[i] is None: missing.setdefault(key, []).append(i)
+
+            if self._db is not None and missing:
+                found = {}
+                key_list = list(missing)
+                for start in range(0, len(key_list), 500):  # sqlite 参数个数上限
+                    part = key_list[start:start + 500]
+                    found.update((row[0], row[1:]) for row in self._db.execute(
+                        f"SELECT key, created, vec FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part))
+                for key, (created, blob) in found.items():
+                    if self._expired(created): continue
+                    vec = array("f", blob).tolist()
+                    self._remember(key, vec, created)
+                    idx = missing.pop(key)
+                    for i in idx: out[i] = vec
+                    self.disk_hits += len(idx)
+
+            self.hits += len(keys) - sum(len(v) for v in missing.values())
+            self.misses += sum(len(v) for v in missing.values())
+        return out
+
+    def put(self, text: str, model: str, vec: List[float]):
+        self.put_many([text], model, [vec])
+
+    def put_many(self, texts: List[str], model: str, vecs: List[List[float]]):
+        now = time.time()
+        rows = [(self.make_key(t, model), now, v) for t, v in zip(texts, vecs) if v is not None]
+        with self._lock:
+            for key, created, vec in rows:
+                self._remember(key, vec, created)
+            if self._db is not None and rows:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, created, vec) VALUES (?, ?, ?)",
+                    [(key, created, array("f", vec).tobytes()) for key, created, vec in rows],
+                )
+                self._db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._mem),
+                "max_size": self.max_size,
+                "disk": self._db is not None,
+            }
+
+
+_default_cache: Optional[EmbeddingCache] = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """进程级共享缓存，参数来自环境变量 (LAWLENS_EMBED_CACHE_SIZE / _TTL / _DB)"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EmbeddingCache(
+            max_size=int(os.getenv("LAWLENS_EMBED_CACHE_SIZE", "4096")),
+            ttl=float(os.getenv("LAWLENS_EMBED_CACHE_TTL", str(7 * 24 * 3600))),
+            db_path=os.getenv("LAWLENS_EMBED_CACHE_DB") or None,
+        )
+    return _default_cache
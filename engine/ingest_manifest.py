@@ -0,0 +1,53 @@
+"""
+增量入库清单：记录每个切片的内容哈希与对应的 documents.id
+
+- source：数据源相对路径 (如 minfadian.txt、lecard_cases/123.json)
+- hash：sha256(title + content)，内容不变则哈希不变
+- 只有写库成功的切片才会登记，因此中途崩溃后重跑会从断点继续
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+
+def chunk_hash(title: str, content: str) -> str:
+    return hashlib.sha256(f"{title}\x00{content}".encode("utf-8")).hexdigest()
+
+
+class IngestManifest:
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " source TEXT NOT NULL, hash TEXT NOT NULL, doc_id INTEGER,"
+            " PRIMARY KEY (source, hash))"
+        )
+        self._db.commit()
+
+    def known(self, source: str) -> Dict[str, int]:
+        """该数据源已入库的 {hash: doc_id}"""
+        with self._lock:
+            rows = self._db.execute("SELECT hash, doc_id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return dict(rows)
+
+    def sources(self) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._db.execute("SELECT DISTINCT source FROM chunks")]
+
+    def add(self, entries: Iterable[Tuple[str, str, int]]):
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO chunks (source, hash, doc_id) VALUES (?, ?, ?)", entries)
+            self._db.commit()
+
+    def remove(self, source: str, hashes: Iterable[str]):
+        with self._lock:
+            self._db.executemany("DELETE FROM chunks WHERE source = ? AND hash = ?", [(source, h) for h in hashes])
+            self._db.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
@@ -0,0 +1,95 @@
+"""
+入库流水线：解析/切片 → N 个 Embedding 工作线程 → 批量写库
+
+三个阶段由有界队列串联，生产速度超过消费时 put() 阻塞，内存占用保持平稳。
+每个阶段各有一条进度条 (解析 / 向量化 / 写入)。
+"""
+import queue
+import threading
+from typing import Callable, Dict, Iterable, List
+
+from tqdm import tqdm
+
+_DONE = object()
+
+
+class IngestPipeline:
+    def __init__(self, embed_fn: Callable[[List[Dict]], List[Dict]], write_fn: Callable[[List[Dict]], None],
+                 workers: int = 4, batch_size: int = 64, insert_size: int = 100, queue_size: int = 8):
+        """
+        embed_fn: 接收一批 record，返回填好 embedding 的 record (失败条目可丢弃)
+        write_fn: 接收一批 record 写入数据库
+        """
+        self.embed_fn = embed_fn
+        self.write_fn = write_fn
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.insert_size = insert_size
+        self.queue_size = queue_size
+
+    def _embed_worker(self, in_q: queue.Queue, out_q: queue.Queue, bar: tqdm):
+        while True:
+            batch = in_q.get()
+            if batch is _DONE:
+                out_q.put(_DONE)
+                return
+            try:
+                done = self.embed_fn(batch)
+            except Exception as e:
+                print(f"   ⚠️ 向量化失败，丢弃 {len(batch)} 条: {e}")
+                done = []
+            bar.update(len(batch))
+            if done: out_q.put(done)
+
+    def _writer(self, in_q: queue.Queue, bar: tqdm, stats: Dict):
+        finished = 0
+        buffer: List[Dict] = []
+        while finished < self.workers:
+            batch = in_q.get()
+            if batch is _DONE:
+                finished += 1
+                continue
+            buffer.extend(batch)
+            while len(buffer) >= self.insert_size:
+                self._write(buffer[:self.insert_size], bar, stats)
+                buffer = buffer[self.insert_size:]
+        if buffer: self._write(buffer, bar, stats)
+
+    def _write(self, rows: List[Dict], bar: tqdm, stats: Dict):
+        try:
+            self.write_fn(rows)
+            stats["written"] += len(rows)
+        except Exception as e:
+            print(f"   ⚠️ 数据库写入失败: {e}")
+        bar.update(len(rows))
+
+    def run(self, records: Iterable[Dict], desc: str = "") -> Dict:
+        """消费 records 迭代器直至耗尽，返回各阶段计数"""
+        embed_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        write_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stats = {"parsed": 0, "written": 0}
+
+        parse_bar = tqdm(desc=f"{desc} 解析", unit="条", position=0)
+        embed_bar = tqdm(desc=f"{desc} 向量化", unit="条", position=1)
+        write_bar = tqdm(desc=f"{desc} 写入", unit="条", position=2)
+
+        threads = [threading.Thread(target=self._embed_worker, args=(embed_q, write_q, embed_bar), daemon=True)
+                   for _ in range(self.workers)]
+        threads.append(threading.Thread(target=self._writer, args=(write_q, write_bar, stats), daemon=True))
+        for t in threads: t.start()
+
+        try:
+            batch: List[Dict] = []
+            for record in records:
+                batch.append(record)
+                stats["parsed"] += 1
+                parse_bar.update(1)
+                if len(batch) >= self.batch_size:
+                    embed_q.put(batch)
+                    batch = []
+            if batch: embed_q.put(batch)
+        finally:
+            for _ in range(self.workers): embed_q.put(_DONE)
+            for t in threads: t.join()
+            for bar in (parse_bar, embed_bar, write_bar): bar.close()
+        return stats
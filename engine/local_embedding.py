@@ -0,0 +1,203 @@
+"""
+本地 CPU Embedding：int8 量化的 bge-m3 (ONNX Runtime)，与 OpenAI 的 embeddings.create 接口一致
+
+- OnnxEmbeddingEngine：加载 scripts/export_local_embedder.py 导出的模型目录 (model_quantized.onnx + tokenizer.json)，
+  CLS 池化 + L2 归一化，与 SiliconFlow 的 BAAI/bge-m3 稠密向量处于同一向量空间 (量化误差很小)
+- 一批补齐到批内最长文本 (tokenizer 动态 padding)，不做跨批长度分桶
+- MicroBatcher：并发请求汇入同一队列，workers 个工作协程各自攒批 (最多 max_batch 条，首条到达后最多等 max_wait 秒)
+  交给线程池推理；ONNX Runtime 推理时释放 GIL。并发推理的会话数 × 每会话算子线程数不应超过核数，
+  见 load_engine(workers=...)
+- LocalEmbeddingClient.sync / .batched：替代 OpenAI / AsyncOpenAI 客户端，供 BatchEmbedder (ingest) 与 server.py 使用
+
+依赖 onnxruntime / tokenizers (仅本地模式需要，按需导入)。
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import List, Optional, Union
+
+import numpy as np
+
+from engine.metrics import Histogram, REGISTRY
+
+LOCAL_EMBED_BATCH = Histogram("lawlens_local_embed_batch_size", "本地 Embedding 每批条数",
+                              buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+LOCAL_EMBED_SECONDS = Histogram("lawlens_local_embed_seconds", "本地 Embedding 每批推理耗时 (秒)")
+REGISTRY.extend([LOCAL_EMBED_BATCH, LOCAL_EMBED_SECONDS])
+
+MODEL_FILES = ("model_quantized.onnx", "model_int8.onnx", "model.onnx")
+
+
+class OnnxEmbeddingEngine:
+    def __init__(self, model_dir: str, threads: int = 0, max_length: int = 512):
+        """threads：单次推理的算子内线程数 (0 = ONNX Runtime 默认，即全部物理核；多线程并发调用时应按核数均分)"""
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise RuntimeError("本地 Embedding 需要安装 onnxruntime 与 tokenizers (pip install onnxruntime tokenizers)")
+        path = next((os.path.join(model_dir, f) for f in MODEL_FILES if os.path.exists(os.path.join(model_dir, f))), None)
+        if path is None:
+            raise RuntimeError(f"{model_dir} 下未找到 ONNX 模型，请先运行 scripts/export_local_embedder.py")
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        pad_id = self.tokenizer.token_to_id("<pad>")
+        self.tokenizer.enable_padding(pad_id=1 if pad_id is None else pad_id, pad_token="<pad>")
+        self.path = path
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        if not texts: return []
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {"input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                 "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64)}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(feeds["input_ids"])
+        hidden = self.session.run(None, feeds)[0]
+        vecs = hidden[:, 0] if hidden.ndim == 3 else hidden  # bge-m3 稠密向量取 CLS
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vecs / norms).astype(np.float32).tolist()
+
+
+class MicroBatcher:
+    def __init__(self, engine: OnnxEmbeddingEngine, max_batch: int = 32, max_wait: float = 0.005, workers: int = 2):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self.batches = 0
+        self.texts = 0
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        self._start()
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in texts]
+        for text, future in zip(texts, futures):
+            self._queue.put_nowait((text, future))
+        return list(await asyncio.gather(*futures))
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0: break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return [(text, future) for text, future in batch if not future.done()]  # 调用方已取消的不再推理
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch: continue
+            start = time.perf_counter()
+            try:
+                vecs = await loop.run_in_executor(self._pool, self.engine.encode, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done(): future.set_exception(e)
+                continue
+            LOCAL_EMBED_BATCH.observe(len(batch))
+            LOCAL_EMBED_SECONDS.observe(time.perf_counter() - start)
+            self.batches += 1
+            self.texts += len(batch)
+            for (_, future), vec in zip(batch, vecs):
+                if not future.done(): future.set_result(vec)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "texts": self.texts, "workers": self.workers,
+                "avg_batch": round(self.texts / self.batches, 2) if self.batches else 0}
+
+    def close(self):
+        for task in self._tasks: task.cancel()
+        self._pool.shutdown(wait=False)
+
+
+def _response(model: str, vecs: List[List[float]]) -> SimpleNamespace:
+    return SimpleNamespace(model=model, data=[SimpleNamespace(index=i, embedding=v) for i, v in enumerate(vecs)])
+
+
+class _SyncEmbeddings:
+    def __init__(self, engine: OnnxEmbeddingEngine):
+        self.engine = engine
+
+    def create(self, model: str, input: Union[str, List[str]], **kwargs) -> SimpleNamespace:
+        texts = [input] if isinstance(input, str) else list(input)
+        return _response(model, self.engine.encode(texts))
+
+
+class _AsyncEmbeddings:
+    def __init__(self, batcher: MicroBatcher):
+        self.batcher = batcher
+
+    async def create(self, model: str, input: Union[str, List[str]], **kwargs) -> SimpleNamespace:
+        texts = [input] if isinstance(input, str) else list(input)
+        return _response(model, await self.batcher.embed(texts))
+
+
+class LocalEmbeddingClient:
+    """只实现 client.embeddings.create；model 参数仅回显，实际使用加载的本地模型"""
+
+    def __init__(self, embeddings, batcher: Optional[MicroBatcher] = None):
+        self.embeddings = embeddings
+        self.batcher = batcher
+
+    @classmethod
+    def sync(cls, engine: OnnxEmbeddingEngine) -> "LocalEmbeddingClient":
+        """同步版：调用方自行并发 (如 ingest 的多个 Embedding 线程)"""
+        return cls(_SyncEmbeddings(engine))
+
+    @classmethod
+    def batched(cls, engine: OnnxEmbeddingEngine, max_batch: int = 32, max_wait: float = 0.005,
+                workers: int = 2) -> "LocalEmbeddingClient":
+        """异步版：并发请求经 MicroBatcher 合批"""
+        batcher = MicroBatcher(engine, max_batch=max_batch, max_wait=max_wait, workers=workers)
+        return cls(_AsyncEmbeddings(batcher), batcher)
+
+    def stats(self) -> Optional[dict]:
+        return self.batcher.stats() if self.batcher else None
+
+    def close(self):
+        if self.batcher: self.batcher.close()
+
+
+def load_engine(model_dir: Optional[str] = None, workers: int = 1) -> OnnxEmbeddingEngine:
+    """
+    按环境变量加载：LAWLENS_LOCAL_EMBED_DIR (默认 .cache/bge-m3-int8) / LAWLENS_LOCAL_EMBED_THREADS
+    workers：会同时调用 encode 的线程数；未指定 LAWLENS_LOCAL_EMBED_THREADS 时每个会话分到 核数 // workers 个线程，避免超订
+    """
+    model_dir = model_dir or os.getenv("LAWLENS_LOCAL_EMBED_DIR", ".cache/bge-m3-int8")
+    threads = int(os.getenv("LAWLENS_LOCAL_EMBED_THREADS", "0")) or max(1, (os.cpu_count() or 1) // max(1, workers))
+    engine = OnnxEmbeddingEngine(model_dir, threads=threads)
+    print(f"🧩 [Embedding] 本地模型已加载: {engine.path} ({threads} 线程 × {workers} 并发)")
+    return engine
+
+
+def sync_embedding_client():
+    """脚本用：LAWLENS_EMBED_BACKEND=local 时返回本地客户端，否则返回 SiliconFlow (OpenAI 兼容) 客户端"""
+    if os.getenv("LAWLENS_EMBED_BACKEND", "remote") == "local":
+        return LocalEmbeddingClient.sync(load_engine())
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("SILICONFLOW_API_KEY"),
+                  base_url=os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1"))
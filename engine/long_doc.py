@@ -0,0 +1,91 @@
+"""
+长文档模式
+
+- map_sections：各段并发调用 LLM (有界并发)，按原文顺序合并输出流；
+  第一段实时流式输出，后续段在轮到时直接吐出已缓冲的内容
+- DocSectionIndex：按文书内容哈希缓存的段落向量索引 (进程内，归一化后的 numpy 矩阵)，
+  chat_doc 只把与问题最相关的段落放进 Prompt；每次查询只做一次矩阵乘
+"""
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Callable, List, Tuple
+
+import numpy as np
+
+from engine.chunking import estimate_tokens, html_to_text, split_sections
+
+_END = object()
+
+
+async def map_sections(sections: List[str], run: Callable[[int, str], AsyncIterator[str]],
+                       concurrency: int = 4) -> AsyncIterator[str]:
+    sem = asyncio.Semaphore(concurrency)
+    queues = [asyncio.Queue() for _ in sections]
+
+    async def worker(i: int, section: str):
+        async with sem:
+            try:
+                async for piece in run(i, section):
+                    await queues[i].put(piece)
+            except Exception as e:
+                await queues[i].put(e)
+            finally:
+                await queues[i].put(_END)
+
+    tasks = [asyncio.create_task(worker(i, s)) for i, s in enumerate(sections)]
+    try:
+        for q in queues:
+            while True:
+                item = await q.get()
+                if item is _END: break
+                if isinstance(item, Exception): raise item
+                yield item
+    finally:
+        for t in tasks: t.cancel()
+
+
+def _unit(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+class DocSectionIndex:
+    def __init__(self, embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 section_budget: int = 400, max_docs: int = 64):
+        self.embed_many = embed_many
+        self.section_budget = section_budget
+        self.max_docs = max_docs
+        self._docs: "OrderedDict[str, Tuple[List[str], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def _index(self, document: str) -> Tuple[List[str], np.ndarray]:
+        key = hashlib.sha256(document.encode("utf-8")).hexdigest()
+        with self._lock:
+            hit = self._docs.get(key)
+            if hit is not None:
+                self._docs.move_to_end(key)
+                return hit
+        sections = split_sections(html_to_text(document), self.section_budget)
+        vectors = _unit(np.asarray(await self.embed_many(sections), dtype=np.float32)) if sections \
+            else np.zeros((0, 0), dtype=np.float32)
+        with self._lock:
+            self._docs[key] = (sections, vectors)
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+        return sections, vectors
+
+    async def relevant(self, document: str, query_vec: List[float], budget: int = 6000) -> str:
+        """按相关度选段直到填满预算，再按原文顺序拼接 (保持上下文连贯)"""
+        sections, vectors = await self._index(document)
+        if not sections: return ""
+        scores = vectors @ _unit(np.asarray(query_vec, dtype=np.float32))
+        chosen, used = [], 0
+        for i in np.argsort(-scores).tolist():
+            tokens = estimate_tokens(sections[i])
+            if used + tokens > budget: continue
+            chosen.append(i)
+            used += tokens
+        return "\n……\n".join(sections[i] for i in sorted(chosen))
@@ -0,0 +1,238 @@
+"""
+用户记忆写入 (agent_memories)：后台 write-behind 队列
+
+- submit 只入队即返回，不在请求内做 Embedding / 写库
+- 后台任务攒批 (batch_size 条或 flush_interval 秒)：一次批量 Embedding，一次批量插入
+- 写入前按 user_id 去重：与批内及该用户已有记忆的余弦相似度 ≥ dup_threshold 视为同一偏好，
+  用新表述覆盖旧行 (update)，不再新增
+- 定期压缩：对近期有写入的用户重新去重，并只保留最新 max_per_user 条，match_memories 扫描量保持有界
+- 写入失败的条目最多重试 max_attempts 次；关闭时排空队列
+"""
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from engine.metrics import Counter, REGISTRY
+
+MEMORY_WRITES = Counter("lawlens_memory_writes_total", "记忆写入结果", ("outcome",))
+REGISTRY.append(MEMORY_WRITES)
+
+_SPACES = re.compile(r"[\s，。、,.!！?？;；:：\"'“”‘’]+")
+
+
+def _norm_text(text: str) -> str:
+    return _SPACES.sub("", text).lower()
+
+
+def _unit(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _parse_vec(emb) -> List[float]:
+    return json.loads(emb) if isinstance(emb, str) else emb  # pgvector 经 REST 返回 "[...]" 字符串
+
+
+class MemoryWriter:
+    TABLE = "agent_memories"
+
+    def __init__(self, supabase, run_db: Callable[..., Awaitable],
+                 embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 batch_size: int = 32, flush_interval: float = 1.0, max_queue: int = 1000,
+                 dup_threshold: float = 0.92, max_per_user: int = 200, compact_interval: float = 3600.0,
+                 cache_users: int = 512, max_attempts: int = 3):
+        self.supabase = supabase
+        self.run_db = run_db
+        self.embed_many = embed_many
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dup_threshold = dup_threshold
+        self.max_per_user = max_per_user
+        self.compact_interval = compact_interval
+        self.cache_users = cache_users
+        self.max_attempts = max_attempts
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._known: "OrderedDict[str, Dict]" = OrderedDict()  # user_id → {"ids": [...], "vecs": 单位向量矩阵}
+        self._dirty: set = set()
+        self._last_compact = time.monotonic()
+        self._closing = False
+
+    def _table(self):
+        return self.supabase.table(self.TABLE)
+
+    def submit(self, user_id: str, content: str, m_type: str = "preference") -> bool:
+        """入队；队列已满返回 False"""
+        content = content.strip()
+        if not content or self._closing: return False
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue(self.max_queue)
+            self._task = asyncio.ensure_future(self._run())
+        try:
+            self._queue.put_nowait({"user_id": user_id, "content": content, "memory_type": m_type, "attempts": 0})
+        except asyncio.QueueFull:
+            MEMORY_WRITES.inc(outcome="rejected")
+            return False
+        return True
+
+    async def _next_batch(self) -> List[Dict]:
+        try:
+            first = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0: break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty()):
+            batch = await self._next_batch()
+            if batch:
+                try:
+                    await self._write_batch(batch)
+                except Exception as e:
+                    print(f"❌ [Memory] 批量写入失败 ({len(batch)} 条): {e}")
+                    self._retry(batch)
+            if self.compact_interval and time.monotonic() - self._last_compact >= self.compact_interval:
+                self._last_compact = time.monotonic()
+                await self.compact_dirty()
+
+    def _retry(self, batch: List[Dict]):
+        for item in batch:
+            item["attempts"] += 1
+            if item["attempts"] >= self.max_attempts:
+                MEMORY_WRITES.inc(outcome="failed")
+                continue
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                MEMORY_WRITES.inc(outcome="failed")
+
+    async def _user_memories(self, user_id: str) -> Dict:
+        known = self._known.get(user_id)
+        if known is None:
+            resp = await self.run_db(self._table().select("id, embedding").eq("user_id", user_id)
+                                     .order("id", desc=True).limit(self.max_per_user).execute)
+            rows = [r for r in resp.data if r.get("embedding") is not None]
+            known = {"ids": [r["id"] for r in rows],
+                     "vecs": _unit(np.asarray([_parse_vec(r["embedding"]) for r in rows], dtype=np.float32))}
+            self._known[user_id] = known
+        self._known.move_to_end(user_id)
+        while len(self._known) > self.cache_users:
+            self._known.popitem(last=False)
+        return known
+
+    async def _write_batch(self, batch: List[Dict]):
+        # 批内规范化后完全相同的只保留最后一条
+        items = list({(it["user_id"], _norm_text(it["content"])): it for it in batch}.values())
+        MEMORY_WRITES.inc(len(batch) - len(items), outcome="merged")
+        raw = await self.embed_many([it["content"] for it in items])
+        vecs = _unit(np.asarray(raw, dtype=np.float32))
+
+        inserts, updates = [], {}  # updates: 已有行 id → 条目下标
+        for user_id in dict.fromkeys(it["user_id"] for it in items):
+            known = await self._user_memories(user_id)
+            fresh: List[int] = []  # 本批该用户待新增的条目下标
+            for i, it in enumerate(items):
+                if it["user_id"] != user_id: continue
+                sims = vecs[fresh] @ vecs[i] if fresh else np.empty(0)
+                if len(sims) and sims.max() >= self.dup_threshold:
+                    fresh[int(sims.argmax())] = i  # 新表述覆盖批内旧表述
+                    MEMORY_WRITES.inc(outcome="merged")
+                    continue
+                sims = known["vecs"] @ vecs[i] if len(known["ids"]) else np.empty(0)
+                if len(sims) and sims.max() >= self.dup_threshold:
+                    k = int(sims.argmax())
+                    updates[known["ids"][k]] = i
+                    known["vecs"][k] = vecs[i]
+                    MEMORY_WRITES.inc(outcome="merged")
+                    continue
+                fresh.append(i)
+            inserts.extend(fresh)
+
+        for row_id, i in updates.items():
+            it = items[i]
+            await self.run_db(self._table().update({"content": it["content"], "memory_type": it["memory_type"],
+                                                    "embedding": raw[i]}).eq("id", row_id).execute)
+        if inserts:
+            resp = await self.run_db(self._table().insert([
+                {"user_id": items[i]["user_id"], "content": items[i]["content"],
+                 "memory_type": items[i]["memory_type"], "embedding": raw[i]} for i in inserts
+            ]).execute, idempotent=False)
+            for row, i in zip(resp.data, inserts):
+                known = self._known.get(items[i]["user_id"])
+                if known is not None:
+                    known["ids"].insert(0, row["id"])
+                    known["vecs"] = np.vstack([vecs[i][None, :], known["vecs"].reshape(-1, vecs.shape[1])])
+                self._dirty.add(items[i]["user_id"])
+            MEMORY_WRITES.inc(len(inserts), outcome="inserted")
+        print(f"🧠 [Memory] 批量写入 {len(batch)} 条：新增 {len(inserts)}，合并 {len(batch) - len(inserts)}")
+
+    async def compact(self, user_id: str, page: int = 500) -> int:
+        """重新去重并截断到最新 max_per_user 条，返回删除条数；按 id 键集分页扫描该用户的全部记忆"""
+        kept = np.empty((0, 0), dtype=np.float32)  # 已保留记忆的单位向量 (最多 max_per_user 行)
+        drop: List[int] = []
+        before = None
+        while True:
+            full = len(kept) >= self.max_per_user  # 名额已满：更旧的全部删除，无需再取向量
+            query = self._table().select("id" if full else "id, embedding").eq("user_id", user_id)
+            if before is not None: query = query.lt("id", before)
+            rows = (await self.run_db(query.order("id", desc=True).limit(page).execute)).data or []
+            with_vec = [] if full else [r for r in rows if r.get("embedding") is not None]
+            unit = dict(zip((r["id"] for r in with_vec),
+                            _unit(np.asarray([_parse_vec(r["embedding"]) for r in with_vec], dtype=np.float32)))) \
+                if with_vec else {}
+            for row in rows:  # 从新到旧：与已保留的 (更新的) 记忆重复则删除
+                if len(kept) >= self.max_per_user:
+                    drop.append(row["id"])
+                    continue
+                vec = unit.get(row["id"])
+                if vec is None: continue  # 无向量的记忆不参与去重
+                if len(kept) and (kept @ vec).max() >= self.dup_threshold:
+                    drop.append(row["id"])
+                else:
+                    kept = np.vstack([kept, vec]) if len(kept) else vec[None, :]
+            if len(rows) < page: break
+            before = rows[-1]["id"]
+        for start in range(0, len(drop), 100):
+            await self.run_db(self._table().delete().in_("id", drop[start:start + 100]).execute)
+        self._known.pop(user_id, None)
+        MEMORY_WRITES.inc(len(drop), outcome="compacted")
+        return len(drop)
+
+    async def compact_dirty(self):
+        users, self._dirty = self._dirty, set()
+        removed = 0
+        for user_id in users:
+            try:
+                removed += await self.compact(user_id)
+            except Exception as e:
+                print(f"⚠️ [Memory] 压缩 {user_id} 失败: {e}")
+        if removed: print(f"🧹 [Memory] 压缩 {len(users)} 个用户的记忆，删除 {removed} 条")
+
+    async def close(self, timeout: float = 10.0):
+        """停止接收新记忆，等待后台任务排空队列"""
+        self._closing = True
+        if self._task is None or self._task.done(): return
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ [Memory] 关闭超时，丢弃 {self._queue.qsize()} 条未写入的记忆")
+
+    def stats(self) -> Dict:
+        return {"queued": self._queue.qsize() if self._queue else 0, "max_queue": self.max_queue,
+                "cached_users": len(self._known), "dirty_users": len(self._dirty)}
@@ -0,0 +1,177 @@
+"""
+分阶段耗时埋点 + Prometheus 文本格式导出 (无需 prometheus_client)
+
+- span("rag")：记录阶段耗时 (lawlens_stage_seconds)，异常时计入上游错误计数
+- RequestTrace：每个请求一份，汇总各阶段耗时 / 首 Token 时延 / 输出速率，
+  设置 LAWLENS_REQUEST_LOG=1 时请求结束输出一行 JSON 结构化日志
+- 当前请求的 Trace 通过 contextvars 传递，embed_text / MemoryManager 等无需改签名
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200)
+
+
+def _escape(value) -> str:
+    """exposition format 要求转义反斜杠、双引号与换行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra: pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], Dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            s = self._series.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0})
+            s["counts"][bisect_left(self.buckets, value)] += 1
+            s["sum"] += value
+            s["count"] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            for key, s in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), s["counts"]):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+                yield f"{self.name}_sum{_labels(self.labelnames, key)} {s['sum']}"
+                yield f"{self.name}_count{_labels(self.labelnames, key)} {s['count']}"
+
+
+STAGE_SECONDS = Histogram("lawlens_stage_seconds", "各阶段耗时 (秒)", ("stage",))
+TTFT_SECONDS = Histogram("lawlens_ttft_seconds", "LLM 首 Token 时延 (秒)", ("mode",))
+TOKENS_PER_SECOND = Histogram("lawlens_tokens_per_second", "LLM 输出速率 (Token/秒)", ("mode",), RATE_BUCKETS)
+UPSTREAM_ERRORS = Counter("lawlens_upstream_errors_total", "上游调用失败次数", ("stage",))
+UPSTREAM_RETRIES = Counter("lawlens_upstream_retries_total", "上游调用重试次数", ("upstream",))
+REQUESTS = Counter("lawlens_requests_total", "/api/analyze 请求数", ("mode", "cached"))
+STREAMS_CANCELLED = Counter("lawlens_streams_cancelled_total", "客户端断开而中止的上游生成", ("mode",))
+TOKENS_SAVED = Counter("lawlens_tokens_saved_total", "中止生成节省的输出 Token (估算)", ("mode",))
+
+REGISTRY = [STAGE_SECONDS, TTFT_SECONDS, TOKENS_PER_SECOND, UPSTREAM_ERRORS, UPSTREAM_RETRIES, REQUESTS,
+            STREAMS_CANCELLED, TOKENS_SAVED]
+
+_avg_output: Dict[str, float] = {}  # 各模式完整回答的输出 Token 数 (EWMA)
+
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class RequestTrace:
+    def __init__(self, mode: str, user_id: Optional[str] = None):
+        self.mode = mode
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.fields: Dict = {}
+
+    def add(self, stage: str, seconds: float):
+        self.spans[stage] = round(self.spans.get(stage, 0) + seconds, 4)
+
+    def finish(self, **fields):
+        self.fields.update(fields)
+        REQUESTS.inc(mode=self.mode, cached=str(bool(self.fields.get("cached"))).lower())
+        if os.getenv("LAWLENS_REQUEST_LOG") == "1":
+            record = {"event": "analyze", "mode": self.mode, "user_id": self.user_id,
+                      "total": round(time.perf_counter() - self.started, 4), "spans": self.spans, **self.fields}
+            print(json.dumps(record, ensure_ascii=False))
+
+
+_current: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("lawlens_trace", default=None)
+
+
+def start_trace(mode: str, user_id: Optional[str] = None) -> RequestTrace:
+    trace = RequestTrace(mode, user_id)
+    _current.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current.get()
+
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current.get()
+    if trace is not None: trace.add(stage, seconds)
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        UPSTREAM_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_stream(mode: str, ttft: Optional[float], tokens: int, stream_seconds: float):
+    """一次流式补全结束：首 Token 时延 + 输出速率 (从首 Token 起算)"""
+    if ttft is not None: TTFT_SECONDS.observe(ttft, mode=mode)
+    if tokens and stream_seconds > 0: TOKENS_PER_SECOND.observe(tokens / stream_seconds, mode=mode)
+    trace = _current.get()
+    if trace is not None:
+        if ttft is not None: trace.fields.setdefault("ttft", round(ttft, 4))
+        trace.fields["tokens"] = trace.fields.get("tokens", 0) + tokens
+
+
+def record_output(mode: str, tokens: int, alpha: float = 0.2):
+    """一次完整生成 (未被中止) 的输出长度，用于估算中止节省的 Token"""
+    avg = _avg_output.get(mode)
+    _avg_output[mode] = tokens if avg is None else (1 - alpha) * avg + alpha * tokens
+
+
+def record_cancel(mode: str, tokens: int, max_tokens: int) -> int:
+    """上游生成被中止：节省量 = 该模式平均输出长度 (无样本时取 max_tokens) - 已生成，返回估算值"""
+    saved = int(max(0, min(max_tokens, _avg_output.get(mode, max_tokens)) - tokens))
+    STREAMS_CANCELLED.inc(mode=mode)
+    TOKENS_SAVED.inc(saved, mode=mode)
+    trace = _current.get()
+    if trace is not None:
+        trace.fields["cancelled"] = True
+        trace.fields["tokens_saved"] = trace.fields.get("tokens_saved", 0) + saved
+    return saved
+
@@ -0,0 +1,108 @@
+"""
+模型路由：按 模式 / 输入长度 / 延迟预算 选择模型
+
+路由表按顺序匹配，第一条满足条件的生效；都不满足时使用默认模型 (72B)。
+每条路由：
+    name               路由名 (指标标签)
+    model              模型名
+    modes              适用模式列表
+    max_input_tokens   输入 Token 上限 (可选)
+    latency_budget     延迟预算 (秒，可选)：该路由近期延迟 (EWMA) 超出预算时跳过
+    price              每百万 Token 价格 (元，可选，用于成本统计)
+
+通过 LAWLENS_ROUTES 配置 (JSON 字符串或 JSON 文件路径)；调用方在出错 / 输出不合格时回退默认模型。
+"""
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from engine.metrics import Counter, Histogram, REGISTRY
+
+DEFAULT_ROUTES = [
+    {"name": "selection-fast", "model": "Qwen/Qwen2.5-7B-Instruct", "modes": ["selection_polish"],
+     "max_input_tokens": 800, "latency_budget": 5, "price": 0.0},
+    {"name": "risk-json", "model": "Qwen/Qwen2.5-32B-Instruct", "modes": ["risk_score"],
+     "max_input_tokens": 2000, "latency_budget": 20, "price": 1.26},
+]
+DEFAULT_PRICE = 4.13  # Qwen2.5-72B-Instruct，元 / 百万 Token
+PROBE_INTERVAL = 30.0  # 超出延迟预算的路由每隔多久放行一次探测
+
+ROUTE_SECONDS = Histogram("lawlens_route_seconds", "各路由延迟 (流式为首 Token，非流式为总耗时)", ("route",))
+ROUTE_CALLS = Counter("lawlens_route_calls_total", "各路由调用次数", ("route", "outcome"))
+ROUTE_TOKENS = Counter("lawlens_route_tokens_total", "各路由 Token 用量", ("route", "kind"))
+ROUTE_COST = Counter("lawlens_route_cost_yuan_total", "各路由估算成本 (元)", ("route",))
+REGISTRY.extend([ROUTE_SECONDS, ROUTE_CALLS, ROUTE_TOKENS, ROUTE_COST])
+
+
+class Route:
+    def __init__(self, name: str, model: str, modes: Optional[List[str]] = None, max_input_tokens: int = 0,
+                 latency_budget: float = 0, price: float = DEFAULT_PRICE):
+        self.name = name
+        self.model = model
+        self.modes = modes or []
+        self.max_input_tokens = max_input_tokens
+        self.latency_budget = latency_budget
+        self.price = price
+        self.latency: Optional[float] = None  # EWMA
+        self._probed = 0.0
+
+    def matches(self, mode: str, input_tokens: int) -> bool:
+        if self.modes and mode not in self.modes: return False
+        if self.max_input_tokens and input_tokens > self.max_input_tokens: return False
+        if self.latency_budget and self.latency is not None and self.latency > self.latency_budget:
+            # 超预算后定期放行一次探测，延迟恢复后自动重新启用
+            now = time.monotonic()
+            if now - self._probed < PROBE_INTERVAL: return False
+            self._probed = now
+        return True
+
+
+class ModelRouter:
+    def __init__(self, default_model: str, routes: Optional[List[Dict]] = None, default_price: float = DEFAULT_PRICE,
+                 alpha: float = 0.2):
+        self.default = Route("default", default_model, price=default_price)
+        self.routes = [Route(**r) for r in (DEFAULT_ROUTES if routes is None else routes)]
+        self.alpha = alpha
+        self._stats: Dict[str, Dict] = {}
+
+    def pick(self, mode: str, input_tokens: int) -> Route:
+        return next((r for r in self.routes if r.matches(mode, input_tokens)), self.default)
+
+    def record(self, route: Route, seconds: Optional[float], input_tokens: int = 0, output_tokens: int = 0,
+               outcome: str = "ok"):
+        """outcome: ok / error / fallback (输出不合格)"""
+        if seconds is not None:
+            ROUTE_SECONDS.observe(seconds, route=route.name)
+            route.latency = seconds if route.latency is None else (1 - self.alpha) * route.latency + self.alpha * seconds
+        cost = (input_tokens + output_tokens) * route.price / 1e6
+        ROUTE_CALLS.inc(route=route.name, outcome=outcome)
+        ROUTE_TOKENS.inc(input_tokens, route=route.name, kind="input")
+        ROUTE_TOKENS.inc(output_tokens, route=route.name, kind="output")
+        ROUTE_COST.inc(cost, route=route.name)
+        s = self._stats.setdefault(route.name, {"model": route.model, "calls": 0, "errors": 0, "fallbacks": 0,
+                                                "tokens": 0, "cost": 0.0})
+        s["calls"] += 1
+        s["errors"] += outcome == "error"
+        s["fallbacks"] += outcome == "fallback"
+        s["tokens"] += input_tokens + output_tokens
+        s["cost"] += cost
+
+    def stats(self) -> Dict:
+        out = {}
+        for route in self.routes + [self.default]:
+            s = dict(self._stats.get(route.name, {"model": route.model, "calls": 0}))
+            s["latency_ewma"] = round(route.latency, 3) if route.latency is not None else None
+            if "cost" in s: s["cost"] = round(s["cost"], 4)
+            out[route.name] = s
+        return out
+
+
+def load_routes() -> Optional[List[Dict]]:
+    """LAWLENS_ROUTES 未设置时返回 None (使用 DEFAULT_ROUTES)；设置为 [] 则全部走默认模型"""
+    raw = os.getenv("LAWLENS_ROUTES")
+    if not raw: return None
+    if os.path.exists(raw):
+        with open(raw, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(raw)
@@ -0,0 +1,104 @@
+"""
+Token 预算内的 Prompt 组装
+
+按优先级填充固定预算：系统指令 + 最新一轮提问 (必选) → 选区 → RAG → 记忆 → 近期对话 (由新到旧)。
+放不下的内容按行截断；被挤出的早期对话压缩成一段摘要 (每轮只保留开头)，预算仍不足则直接丢弃。
+Token 数为估算值 (engine.chunking.estimate_tokens × 模型系数)，足以做预算控制。
+"""
+from typing import Callable, Dict, List, Tuple
+
+from engine.chunking import estimate_tokens
+
+# 模型上下文窗口 (Token)；未列出的模型按 DEFAULT_CONTEXT_WINDOW 处理
+CONTEXT_WINDOWS = {
+    "Qwen/Qwen2.5-72B-Instruct": 32768,
+    "Qwen/Qwen2.5-7B-Instruct": 32768,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# 分词器系数：估算值 × 系数 ≈ 该模型实际 Token 数 (Qwen 对中文的压缩率略优于 1 字 1 Token)
+TOKEN_FACTORS = {"Qwen": 0.8}
+MESSAGE_OVERHEAD = 4  # 每条消息的角色 / 分隔符开销
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    factor = next((f for prefix, f in TOKEN_FACTORS.items() if prefix in model), 1.0)
+    return int(estimate_tokens(text or "") * factor) + 1
+
+
+def truncate_lines(text: str, budget: int, model: str = "") -> str:
+    """保留开头的若干整行使其不超过预算 (RAG / 记忆按条目分行，截断后仍是完整条目)"""
+    if count_tokens(text, model) <= budget: return text
+    kept, used = [], 0
+    for line in text.split("\n"):
+        cost = count_tokens(line, model)
+        if used + cost > budget: break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+class PromptAssembler:
+    def __init__(self, model: str, max_output_tokens: int = 4000, budget: int = 8000, summary_tokens: int = 300):
+        """budget：输入 Prompt 的固定预算，不超过 上下文窗口 - 输出预留 (0 = 直接取该上限)"""
+        self.model = model
+        limit = CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW) - max_output_tokens
+        self.budget = min(budget, limit) if budget > 0 else limit
+        self.summary_tokens = summary_tokens
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def _message_cost(self, message: Dict) -> int:
+        return self.count(message["content"]) + MESSAGE_OVERHEAD
+
+    def _summarize(self, turns: List[Dict], budget: int) -> str:
+        """抽取式压缩：每轮只保留开头若干字，从最近的早期对话开始填充"""
+        lines = []
+        for m in reversed(turns):
+            speaker = "用户" if m["role"] == "user" else "助手"
+            line = f"- {speaker}：{m['content'][:60].strip()}…"
+            if self.count("\n".join([line] + lines)) > budget: break
+            lines.insert(0, line)
+        return "【早前对话摘要】\n" + "\n".join(lines) if lines else ""
+
+    def assemble(self, template: Callable[[Dict[str, str]], str], sections: List[Tuple[str, str]],
+                 history: List[Dict]) -> Tuple[List[Dict], Dict[str, str], Dict]:
+        """
+        template: 接收 {名称: 文本} 生成系统指令 (缺省的段落传空串)
+        sections: [(名称, 文本)]，按优先级排列
+        history:  对话消息 (最后一条为本轮提问，始终保留)
+        返回 (messages, 截断后的各段落, 用量报告)
+        """
+        latest, earlier = history[-1:], history[:-1]
+        fitted = {name: "" for name, _ in sections}
+        used = self.count(template(fitted)) + MESSAGE_OVERHEAD + sum(self._message_cost(m) for m in latest)
+        usage = {"system": used}
+
+        for name, text in sections:
+            if not text: continue
+            kept = truncate_lines(text, max(0, self.budget - used), self.model)
+            fitted[name] = kept
+            usage[name] = self.count(kept) if kept else 0
+            used += usage[name]
+
+        # 近期对话由新到旧填充，其余压缩为摘要
+        kept_turns: List[Dict] = []
+        for i in range(len(earlier) - 1, -1, -1):
+            cost = self._message_cost(earlier[i])
+            if used + cost > self.budget: break
+            kept_turns.insert(0, earlier[i])
+            used += cost
+        dropped = earlier[:len(earlier) - len(kept_turns)]
+
+        messages = [{"role": "system", "content": template(fitted)}]
+        if dropped:
+            summary = self._summarize(dropped, min(self.summary_tokens, self.budget - used))
+            if summary:
+                messages.append({"role": "system", "content": summary})
+                used += self.count(summary) + MESSAGE_OVERHEAD
+        messages += kept_turns + latest
+
+        usage.update({"history": sum(self._message_cost(m) for m in kept_turns)})
+        report = {"budget": self.budget, "used": used, "sections": usage,
+                  "history_kept": len(kept_turns), "history_dropped": len(dropped)}
+        return messages, fitted, report
@@ -0,0 +1,108 @@
+"""
+/api/analyze 响应缓存
+
+- 精确层：键 = sha256(mode, model, prompt, 检索上下文)，LRU + TTL
+- 近似层 (可选)：同一作用域 (mode + model + 上下文 + 文档 + 选区 + 此前对话) 内，查询向量余弦相似度 ≥ 阈值即视为命中；
+  向量预先归一化并按作用域索引，查找只在该作用域内做一次 numpy 矩阵乘
+- 流式回答以「分片列表」存储，命中后按原分片回放，前端行为不变
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def hash_parts(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _unit(vec: List[float]) -> Optional[np.ndarray]:
+    arr = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm else None
+
+
+class ResponseCache:
+    def __init__(self, max_size: int = 512, ttl: float = 3600, semantic_threshold: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._items: "OrderedDict[str, Dict]" = OrderedDict()
+        self._scopes: Dict[str, Dict[str, np.ndarray]] = {}  # scope → {key: 单位向量}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(mode: str, model: str, prompt: str, context: str = "") -> str:
+        return hash_parts(mode, model, prompt, context)
+
+    def _drop(self, key: str):
+        item = self._items.pop(key)
+        members = self._scopes.get(item["scope"])
+        if members is not None:
+            members.pop(key, None)
+            if not members: del self._scopes[item["scope"]]
+
+    def _alive(self, key: str, item: Dict) -> bool:
+        if self.ttl > 0 and time.time() - item["created"] > self.ttl:
+            self._drop(key)
+            return False
+        return True
+
+    def get(self, key: str, vec: Optional[List[float]] = None, scope: Optional[str] = None) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and self._alive(key, item):
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item["value"]
+
+            members = self._scopes.get(scope) if self.semantic_threshold and vec is not None else None
+            query = _unit(vec) if members else None
+            if query is not None:
+                keys = list(members)
+                scores = np.stack([members[k] for k in keys]) @ query
+                best_key = None
+                for i in np.argsort(-scores):
+                    if scores[i] < self.semantic_threshold: break
+                    if self._alive(keys[i], self._items[keys[i]]):
+                        best_key = keys[i]
+                        break
+                if best_key is not None:
+                    self._items.move_to_end(best_key)
+                    self.hits += 1
+                    self.semantic_hits += 1
+                    return self._items[best_key]["value"]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, vec: Optional[List[float]] = None, scope: Optional[str] = None):
+        with self._lock:
+            if key in self._items: self._drop(key)
+            self._items[key] = {"value": value, "created": time.time(), "scope": scope}
+            unit = _unit(vec) if self.semantic_threshold and vec is not None and scope is not None else None
+            if unit is not None: self._scopes.setdefault(scope, {})[key] = unit
+            while len(self._items) > self.max_size:
+                self._drop(next(iter(self._items)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._items),
+                "max_size": self.max_size,
+            }
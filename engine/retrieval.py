@@ -0,0 +1,95 @@
+"""
+可插拔检索后端：统一的 Retriever 接口
+
+- SupabaseRetriever：调用 match_documents RPC (默认)
+- LocalRetriever：进程内 IVF 索引 (engine/vector_index.py)，由 scripts/build_index.py 构建
+- HybridRetriever：本地 BM25 倒排索引 + 向量检索，倒数排名融合 (RRF)
+
+通过环境变量 LAWLENS_RETRIEVER=hybrid|local|supabase 选择 (默认 hybrid，本地索引缺失时回退 supabase)。
+"""
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class Retriever:
+    name = "base"
+
+    async def search(self, query: str, vec: List[float], k: int = 3, threshold: float = 0.45) -> List[Dict]:
+        """返回 [{id, title, content, similarity, ...}]，按相关度降序"""
+        raise NotImplementedError
+
+
+class SupabaseRetriever(Retriever):
+    name = "supabase"
+
+    def __init__(self, supabase, run_blocking: Callable[..., Awaitable]):
+        self.supabase = supabase
+        self.run_blocking = run_blocking
+
+    async def search(self, query: str, vec: List[float], k: int = 3, threshold: float = 0.45) -> List[Dict]:
+        rpc_resp = await self.run_blocking(self.supabase.rpc("match_documents", {
+            "query_embedding": vec, "match_threshold": threshold, "match_count": k
+        }).execute)
+        return rpc_resp.data or []
+
+
+class LocalRetriever(Retriever):
+    name = "local"
+
+    def __init__(self, index):
+        self.index = index
+
+    async def search(self, query: str, vec: List[float], k: int = 3, threshold: float = 0.45) -> List[Dict]:
+        # 进程内检索耗时亚毫秒级，直接在事件循环中执行
+        return self.index.search(vec, k=k, threshold=threshold)
+
+
+class HybridRetriever(Retriever):
+    """
+    两路召回各取 candidates 条，按倒数排名融合：score = Σ 1 / (rrf_k + rank)。
+    精确条号 / 当事人名称由 BM25 命中，语义近似由向量命中，融合后只取 Top-K 进入 Prompt。
+    """
+    name = "hybrid"
+
+    def __init__(self, vector: Retriever, text_index, candidates: int = 20, rrf_k: int = 60):
+        self.vector = vector
+        self.text_index = text_index
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    async def search(self, query: str, vec: List[float], k: int = 3, threshold: float = 0.45) -> List[Dict]:
+        vec_hits = await self.vector.search(query, vec, k=self.candidates, threshold=threshold)
+        text_hits = self.text_index.search(query, k=self.candidates)
+
+        fused: Dict = {}
+        for hits in (vec_hits, text_hits):
+            for rank, doc in enumerate(hits):
+                key = doc.get("id", doc["content"])
+                entry = fused.setdefault(key, dict(doc, rrf=0.0))
+                entry.update({f: doc[f] for f in ("similarity", "bm25") if f in doc})
+                entry["rrf"] += 1.0 / (self.rrf_k + rank + 1)
+        return sorted(fused.values(), key=lambda d: d["rrf"], reverse=True)[:k]
+
+
+def _load_local_index():
+    from engine.vector_index import LocalVectorIndex  # numpy 仅在本地后端时需要
+    index = LocalVectorIndex(
+        os.getenv("LAWLENS_INDEX_DIR", ".cache/doc_index"),
+        nprobe=int(os.getenv("LAWLENS_INDEX_NPROBE", "8")),
+    )
+    print(f"📦 [Retriever] 本地索引已加载: {len(index)} 条")
+    return index
+
+
+def create_retriever(supabase, run_blocking, backend: Optional[str] = None) -> Retriever:
+    backend = backend or os.getenv("LAWLENS_RETRIEVER", "hybrid")
+    try:
+        if backend == "local":
+            return LocalRetriever(_load_local_index())
+        if backend == "hybrid":
+            from engine.text_index import BM25Index
+            index = _load_local_index()
+            return HybridRetriever(LocalRetriever(index), BM25Index(index.path))
+    except Exception as e:
+        print(f"⚠️ [Retriever] 本地索引不可用 ({e})，回退到 Supabase")
+    return SupabaseRetriever(supabase, run_blocking)
@@ -0,0 +1,149 @@
+"""
+按条款增量风险评分
+
+全文 → 按条款切分 → 每条内容哈希 → 仅对新增 / 修改过的条款调用 LLM 评分，
+其余条款复用缓存分数 → 按条款长度 (Token 数) 加权合成雷达图需要的四个维度。
+覆盖完整文书 (不再只看前 4000 字)；在某一条中插入文字不会影响其他条款的缓存。
+待评分的条款按预算合并进同一个 Prompt 以减少调用次数，缓存的读写仍以单条为单位。
+"""
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from engine.chunking import estimate_tokens, html_to_text, split_clauses
+
+DIMENSIONS = ["合规性", "权益保护", "完整性", "文本规范"]
+
+BATCH_PROMPT = """
+你是一名资深的法律合规专家。以下是一份法律文书中的 {count} 个条款片段 (按编号给出)，请对每个片段分别从四个维度评分（0-100分）。
+
+{clauses}
+
+【任务要求】
+请直接返回一个标准的 JSON 对象，不要包含任何 Markdown 格式，不要包含任何额外的解释文字。
+clauses 数组按编号顺序、每个片段一项，JSON 数据结构必须严格如下：
+{{"clauses": [{{"id": 1, "合规性": 90, "权益保护": 75, "完整性": 85, "文本规范": 95, "summary": "一句话指出该片段的主要风险或优点"}}]}}
+"""
+
+
+def section_hash(section: str) -> str:
+    return hashlib.sha256(section.encode("utf-8")).hexdigest()
+
+
+def _clause_score(data) -> Optional[Dict]:
+    try:
+        score = {d: max(0, min(100, float(data[d]))) for d in DIMENSIONS}
+    except (KeyError, TypeError, ValueError):
+        return None
+    score["summary"] = str(data.get("summary", ""))
+    return score
+
+
+class RiskScorer:
+    def __init__(self, complete: Callable[[str], Awaitable[str]], parse: Callable[[str], Optional[Dict]],
+                 budget: int = 1200, concurrency: int = 4, cache_size: int = 4096, max_batch: int = 8):
+        """
+        complete:  异步调用 LLM，输入 Prompt 返回原始文本
+        parse:     把原始文本解析为 dict，失败返回 None
+        budget:    单条条款的 Token 上限，同时也是一次 Prompt 中合并条款的总预算
+        max_batch: 一次 Prompt 最多合并的条款数
+        """
+        self.complete = complete
+        self.parse = parse
+        self.budget = budget
+        self.concurrency = concurrency
+        self.cache_size = cache_size
+        self.max_batch = max_batch
+        self._scores: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._scores.get(key)
+            if item is not None: self._scores.move_to_end(key)
+            return item
+
+    def _remember(self, key: str, score: Dict):
+        with self._lock:
+            self._scores[key] = score
+            while len(self._scores) > self.cache_size:
+                self._scores.popitem(last=False)
+
+    def _batches(self, todo: Dict[str, str]) -> List[List[Tuple[str, str]]]:
+        batches, current, tokens = [], [], 0
+        for key, clause in todo.items():
+            size = estimate_tokens(clause)
+            if current and (tokens + size > self.budget or len(current) >= self.max_batch):
+                batches.append(current)
+                current, tokens = [], 0
+            current.append((key, clause))
+            tokens += size
+        if current: batches.append(current)
+        return batches
+
+    async def _score_batch(self, batch: List[Tuple[str, str]], sem: asyncio.Semaphore) -> List[Optional[Dict]]:
+        clauses = "\n\n".join(f"【片段 {i}】\n{clause}" for i, (_, clause) in enumerate(batch, 1))
+        async with sem:
+            raw = await self.complete(BATCH_PROMPT.format(count=len(batch), clauses=clauses))
+        data = self.parse(raw) or {}
+        items = data.get("clauses") if isinstance(data, dict) else None
+        if not isinstance(items, list): return [None] * len(batch)
+        items = [item for item in items if isinstance(item, dict)]
+        if len(items) == len(batch) and not any("id" in item for item in items):
+            return [_clause_score(item) for item in items]  # 条数一致且完全未给编号：按顺序对应
+        by_id = {}
+        for item in items:
+            try:
+                by_id.setdefault(int(item.get("id")), item)
+            except (TypeError, ValueError):
+                continue
+        matched = [by_id.get(i) for i in range(1, len(batch) + 1)]
+        if len(items) != len(batch) or None in matched:
+            # 条数 / 编号对不上时不按位置硬凑 (会把分数记到错误的条款上)，未对应的条款视为评分失败
+            print(f"⚠️ [Risk Scan] 模型返回 {len(items)} 条评分，提交 {len(batch)} 条，"
+                  f"丢弃未对应编号的结果 (匹配 {len(batch) - matched.count(None)} 条)")
+        return [_clause_score(item) for item in matched]
+
+    async def score(self, document: str,
+                    acquire: Optional[Callable[[int], AsyncContextManager]] = None) -> Dict:
+        """acquire(n)：并发调用 LLM 前获取 n 个上游名额 (准入控制)；全部命中缓存时不获取"""
+        clauses = split_clauses(html_to_text(document), self.budget)
+        if not clauses:
+            return {"total_score": 0, "summary": "文书内容为空。", "dimensions": []}
+
+        keys = [section_hash(c) for c in clauses]
+        scores = {k: self._cached(k) for k in set(keys)}
+        todo = {k: c for k, c in zip(keys, clauses) if scores[k] is None}
+
+        sem = asyncio.Semaphore(self.concurrency)
+        batches = self._batches(todo)
+        width = min(self.concurrency, len(batches))
+        run = lambda: asyncio.gather(*[self._score_batch(b, sem) for b in batches], return_exceptions=True)
+        if acquire and width:
+            async with acquire(width):
+                results = await run()
+        else:
+            results = await run()
+        for batch, result in zip(batches, results):
+            if not isinstance(result, list): continue
+            for (key, _), score in zip(batch, result):
+                if score is None: continue
+                scores[key] = score
+                self._remember(key, score)
+
+        # 按条款长度加权合成；评分失败的条款不参与
+        weighted = [(scores[k], estimate_tokens(c)) for k, c in zip(keys, clauses) if scores[k]]
+        if not weighted:
+            return {"total_score": 0, "summary": "AI 返回格式异常，请重试。", "dimensions": []}
+        total_weight = sum(w for _, w in weighted) or 1
+        dims = {d: round(sum(s[d] * w for s, w in weighted) / total_weight) for d in DIMENSIONS}
+        worst = min((s for s, _ in weighted), key=lambda s: sum(s[d] for d in DIMENSIONS))
+        return {
+            "total_score": round(sum(dims.values()) / len(DIMENSIONS)),
+            "summary": worst["summary"] or "已完成全文体检。",
+            "dimensions": [{"subject": d, "A": dims[d], "fullMark": 100} for d in DIMENSIONS],
+            "sections": {"total": len(clauses), "rescored": len(todo), "batches": len(batches),
+                         "failed": len(clauses) - len(weighted)},
+        }
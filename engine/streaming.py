@@ -0,0 +1,229 @@
+"""
+流式响应与客户端连接
+
+- cancel_on_disconnect：转发流式生成器，同时轮询客户端连接；断开 (关闭页面 / 前端中止) 时立即取消生成器，
+  CancelledError 沿调用链传到上游流 (关闭 HTTP 连接，停止计费)，各层 finally 归还准入名额
+- 不依赖 Starlette 自身的断开检测：部分版本只在下一次写出失败时才察觉，排队 / 长时间无输出期间会一直占用名额
+- StreamRegistry / StreamSession：生成在后台任务中进行，输出按 flush_interval / batch_chars 合并为 SSE 事件
+  (id 单调递增) 写入有界回放缓冲；响应只是订阅者。连接中断后客户端带 Last-Event-ID 重连即可从断点续传，
+  无需重新生成；所有订阅者断开超过 grace 秒 (或显式取消) 才取消生成
+- 回放缓冲在进程内：多 worker 部署时续传请求需路由到同一进程 (按 stream_id 粘性路由)
+"""
+import asyncio
+import json
+import re
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from engine.metrics import Counter, Histogram, REGISTRY
+
+CLIENT_DISCONNECTS = Counter("lawlens_client_disconnects_total", "流式响应中途客户端断开次数", ("mode",))
+SSE_EVENTS = Counter("lawlens_sse_events_total", "写出的 SSE 事件数", ("event",))
+SSE_BATCH_CHARS = Histogram("lawlens_sse_batch_chars", "每个 SSE 事件合并的字符数", buckets=(1, 4, 16, 64, 256, 1024, 4096))
+STREAM_RESUMES = Counter("lawlens_stream_resumes_total", "带 Last-Event-ID 的续传请求", ("outcome",))
+REGISTRY.extend([CLIENT_DISCONNECTS, SSE_EVENTS, SSE_BATCH_CHARS, STREAM_RESUMES])
+
+_NEWLINE = re.compile(r"\r\n|\r|\n")
+
+
+def format_sse(data: str = "", event: Optional[str] = None, event_id: Optional[int] = None,
+               retry: Optional[int] = None) -> str:
+    """一个 SSE 事件；data 中的换行拆成多行 data: (客户端按 \\n 拼回)"""
+    lines = []
+    if retry is not None: lines.append(f"retry: {retry}")
+    if event_id is not None: lines.append(f"id: {event_id}")
+    if event: lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in _NEWLINE.split(data))
+    return "\n".join(lines) + "\n\n"
+
+
+class ReplayGap(Exception):
+    """Last-Event-ID 之后的事件已滑出回放缓冲，无法续传"""
+
+
+async def _wait_disconnect(request, interval: float):
+    while not await request.is_disconnected():
+        await asyncio.sleep(interval)
+
+
+async def cancel_on_disconnect(request, chunks: AsyncIterator, mode: str = "-", interval: float = 0.5) -> AsyncIterator:
+    """request：Starlette Request；interval：无输出期间的连接检测间隔 (秒)"""
+    iterator = chunks.__aiter__()
+    watcher = asyncio.ensure_future(_wait_disconnect(request, interval))
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({step, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                CLIENT_DISCONNECTS.inc(mode=mode)
+                print(f"🔌 [Stream] 客户端已断开 ({mode})")
+                return
+            try:
+                chunk = step.result()
+            except StopAsyncIteration:
+                return
+            yield chunk
+    finally:
+        watcher.cancel()
+        if step is not None and not step.done():
+            step.cancel()
+            try:
+                await step
+            except BaseException:
+                pass
+        close = getattr(iterator, "aclose", None)
+        if close is not None:
+            await close()
+
+
+class StreamSession:
+    def __init__(self, stream_id: str, max_events: int, batch_chars: int, flush_interval: float):
+        self.id = stream_id
+        self.batch_chars = batch_chars
+        self.flush_interval = flush_interval
+        self.events: Deque[Tuple[int, str, str]] = deque(maxlen=max_events)  # (id, event, data)
+        self.seq = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.detached_at: Optional[float] = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self._wake = asyncio.get_running_loop().create_future()
+
+    def _publish(self, event: str, data: str):
+        self.seq += 1
+        self.events.append((self.seq, event, data))
+        SSE_EVENTS.inc(event=event)
+        if not self._wake.done(): self._wake.set_result(None)
+        self._wake = asyncio.get_running_loop().create_future()
+
+    def check_resume(self, last_id: int):
+        if last_id > self.seq or (self.events and last_id < self.events[0][0] - 1): raise ReplayGap(self.id)
+
+    def flush(self):
+        if not self._pending: return
+        SSE_BATCH_CHARS.observe(self._pending_chars)
+        self._publish("message", "".join(self._pending))
+        self._pending, self._pending_chars = [], 0
+
+    def push(self, piece: str):
+        self._pending.append(piece)
+        self._pending_chars += len(piece)
+        if self._pending_chars >= self.batch_chars: self.flush()
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    async def run(self, source: AsyncIterator[str]):
+        ticker = asyncio.ensure_future(self._tick())
+        try:
+            async for piece in source:
+                self.push(piece)
+        finally:
+            ticker.cancel()
+            self.flush()
+            self._publish("done", "")
+            self.done = True
+            self.finished_at = time.monotonic()
+
+    async def subscribe(self, last_id: int = 0, keepalive: float = 15.0) -> AsyncIterator[str]:
+        """回放 last_id 之后的事件，再跟随新事件直到结束；长时间无事件时发送注释行保活"""
+        while True:
+            # 先取唤醒信号再追赶：追赶期间 (yield 处挂起) 发布的事件会完成这个 future，等待时立即返回，不会丢失唤醒
+            wake = self._wake
+            while last_id < self.seq:
+                if self.events and last_id < self.events[0][0] - 1:  # 订阅者过慢，缓冲已覆盖未读事件
+                    yield format_sse("replay buffer overflow", event="gap")
+                    return
+                # 每次按当前 seq 定位下一条：yield 期间缓冲可能已追加 / 滑动，不能沿用旧下标
+                event_id, event, data = self.events[len(self.events) - (self.seq - last_id)]
+                yield format_sse(data, event=None if event == "message" else event, event_id=event_id)
+                last_id = event_id
+            if self.done: return
+            try:
+                await asyncio.wait_for(asyncio.shield(wake), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+
+class StreamRegistry:
+    def __init__(self, max_sessions: int = 256, max_events: int = 2048, ttl: float = 120.0, grace: float = 10.0,
+                 batch_chars: int = 512, flush_interval: float = 0.05):
+        """
+        max_events:     每个会话回放缓冲的事件数上限
+        ttl:            生成结束后会话保留多久 (供续传)
+        grace:          所有订阅者断开后等待重连的秒数，超时取消生成 (0 = 立即取消)
+        batch_chars / flush_interval: 合并输出的字符数 / 时间窗口
+        """
+        self.max_sessions = max_sessions
+        self.max_events = max_events
+        self.ttl = ttl
+        self.grace = grace
+        self.batch_chars = batch_chars
+        self.flush_interval = flush_interval
+        self._sessions: "OrderedDict[str, StreamSession]" = OrderedDict()
+
+    def _prune(self):
+        now = time.monotonic()
+        for sid in [sid for sid, s in self._sessions.items() if s.done and now - s.finished_at > self.ttl]:
+            del self._sessions[sid]
+        # 超出上限：先淘汰已结束的会话，再淘汰无人订阅的进行中会话
+        for removable in (lambda s: s.done, lambda s: s.subscribers == 0):
+            for sid in [sid for sid, s in self._sessions.items() if removable(s)]:
+                if len(self._sessions) <= self.max_sessions: return
+                session = self._sessions.pop(sid)
+                if session.task and not session.done: session.task.cancel()
+
+    def start(self, source: AsyncIterator[str]) -> StreamSession:
+        self._prune()
+        session = StreamSession(secrets.token_urlsafe(12), self.max_events, self.batch_chars, self.flush_interval)
+        session.task = asyncio.ensure_future(session.run(source))
+        self._sessions[session.id] = session
+        return session
+
+    def get(self, stream_id: str) -> Optional[StreamSession]:
+        self._prune()
+        return self._sessions.get(stream_id)
+
+    def cancel(self, stream_id: str) -> bool:
+        session = self._sessions.get(stream_id)
+        if session is None or session.done: return False
+        session.task.cancel()
+        return True
+
+    def _maybe_cancel(self, session: StreamSession):
+        if session.done or session.subscribers or session.detached_at is None: return
+        if time.monotonic() - session.detached_at >= self.grace * 0.99:
+            print(f"🔌 [Stream] {session.id} 断开超过 {self.grace:g}s 未重连，取消生成")
+            session.task.cancel()
+
+    async def attach(self, session: StreamSession, last_id: int = 0, meta: Optional[Dict] = None) -> AsyncIterator[str]:
+        """订阅会话：先发 meta 事件 (含 stream_id，无 id，不影响 Last-Event-ID)，再发回放 / 实时事件"""
+        subscription = session.subscribe(last_id)
+        session.subscribers += 1
+        session.detached_at = None
+        try:
+            yield format_sse(json.dumps(dict(meta or {}, stream_id=session.id)), event="meta",
+                             retry=int(self.grace * 1000 // 4) or None)
+            async for frame in subscription:
+                yield frame
+        finally:
+            session.subscribers -= 1
+            if session.subscribers == 0 and not session.done:
+                session.detached_at = time.monotonic()
+                if self.grace > 0:
+                    asyncio.get_running_loop().call_later(self.grace, self._maybe_cancel, session)
+                else:
+                    self._maybe_cancel(session)
+
+    def stats(self) -> Dict:
+        live = sum(1 for s in self._sessions.values() if not s.done)
+        return {"sessions": len(self._sessions), "live": live, "max_sessions": self.max_sessions,
+                "max_events": self.max_events, "grace": self.grace}
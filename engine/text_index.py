@@ -0,0 +1,161 @@
+"""
+本地倒排索引 + BM25，与向量索引放在同一目录 (共用 docs.sqlite 的行号)
+
+分词 (无需 jieba)：
+- 中文连续片段 → 字 bigram (单字片段保留单字)
+- 英文 / 数字 → 整词
+- 法条引用「第一千一百六十五条」「第1165条」→ 统一为精确词元「§1165」，保证条号精确命中
+
+文件：
+    bm25_vocab.sqlite   词元 → (起始偏移, 结束偏移)，df = 结束 - 起始
+    bm25_rows.i32       按词元分组的倒排行号
+    bm25_tfs.f32        对应词频
+    bm25_doclen.f32     每行文档长度 (词元数)
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from engine.vector_index import DocStore
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000, "万": 10000}
+_STATUTE_RE = re.compile(r"第([零〇一二两三四五六七八九十百千万]+|\d+)条")
+_CJK_RUN_RE = re.compile(r"[㐀-鿿]+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def cn_to_int(text: str) -> int:
+    """中文数字 → 整数 (一千一百六十五 → 1165，十三 → 13)"""
+    if text.isdigit(): return int(text)
+    total, section, digit = 0, 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        elif ch in _CN_UNITS:
+            unit = _CN_UNITS[ch]
+            if unit == 10000:
+                total += (section + digit) * unit
+                section = 0
+            else:
+                section += (digit or 1) * unit
+            digit = 0
+    return total + section + digit
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = [f"§{cn_to_int(m.group(1))}" for m in _STATUTE_RE.finditer(text)]
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD_RE.findall(text))
+    return tokens
+
+
+def build_text_index(docs: Iterable[Tuple[int, str, str]], out_dir: str):
+    """docs: (行号, 标题, 正文)，行号需从 0 连续递增"""
+    vocab: Dict[str, int] = {}
+    term_ids, rows, tfs = array("i"), array("i"), array("f")
+    doclen = array("f")
+    for row, title, content in docs:
+        counts = Counter(tokenize(f"{title}\n{content}"))
+        doclen.append(sum(counts.values()))
+        for term, tf in counts.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            rows.append(row)
+            tfs.append(tf)
+
+    term_ids_np = np.frombuffer(term_ids, dtype=np.int32)
+    order = np.argsort(term_ids_np, kind="stable")
+    np.frombuffer(rows, dtype=np.int32)[order].tofile(os.path.join(out_dir, "bm25_rows.i32"))
+    np.frombuffer(tfs, dtype=np.float32)[order].tofile(os.path.join(out_dir, "bm25_tfs.f32"))
+    np.frombuffer(doclen, dtype=np.float32).tofile(os.path.join(out_dir, "bm25_doclen.f32"))
+    offsets = np.searchsorted(term_ids_np[order], np.arange(len(vocab) + 1))
+
+    db = sqlite3.connect(os.path.join(out_dir, "bm25_vocab.sqlite"))
+    db.execute("CREATE TABLE vocab (term TEXT PRIMARY KEY, start INTEGER, end INTEGER)")
+    db.executemany("INSERT INTO vocab VALUES (?, ?, ?)",
+                   ((term, int(offsets[i]), int(offsets[i + 1])) for term, i in vocab.items()))
+    db.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("INSERT INTO info VALUES ('stats', ?)", (json.dumps({"docs": len(doclen), "terms": len(vocab)}),))
+    db.commit()
+    db.close()
+
+
+class BM25Index:
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, reload_interval: float = 30.0):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.reload_interval = reload_interval
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        self.doclen = np.fromfile(os.path.join(self.path, "bm25_doclen.f32"), dtype=np.float32)
+        self.rows = self._map("bm25_rows.i32", np.int32)
+        self.tfs = self._map("bm25_tfs.f32", np.float32)
+        self.avgdl = float(self.doclen.mean()) if len(self.doclen) else 1.0
+        self._vocab = sqlite3.connect(os.path.join(self.path, "bm25_vocab.sqlite"), check_same_thread=False)
+        self.docs = DocStore(os.path.join(self.path, "docs.sqlite"))
+        self._mtime = os.path.getmtime(os.path.join(self.path, "bm25_doclen.f32"))
+
+    def _map(self, name: str, dtype):
+        path = os.path.join(self.path, name)
+        # 空文件无法 mmap (语料为空时)
+        return np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.zeros(0, dtype=dtype)
+
+    def maybe_reload(self):
+        now = time.time()
+        if now - self._checked < self.reload_interval: return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, "bm25_doclen.f32"))
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                self._load()
+
+    def __len__(self):
+        return len(self.doclen)
+
+    def search_rows(self, query: str, k: int = 20) -> List[Tuple[int, float]]:
+        terms = set(tokenize(query))
+        if not terms or not len(self.doclen): return []
+        n = len(self.doclen)
+        with self._lock:
+            marks = ",".join("?" * len(terms))
+            spans = self._vocab.execute(f"SELECT start, end FROM vocab WHERE term IN ({marks})", list(terms)).fetchall()
+            scores = np.zeros(n, dtype=np.float32)
+            for start, end in spans:
+                df = end - start
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                rows = self.rows[start:end]
+                tf = self.tfs[start:end]
+                norm = self.k1 * (1 - self.b + self.b * self.doclen[rows] / self.avgdl)
+                scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm)
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(r), float(scores[r])) for r in top if scores[r] > 0]
+
+    def search(self, query: str, k: int = 20) -> List[Dict]:
+        self.maybe_reload()
+        hits = self.search_rows(query, k)
+        docs = self.docs.fetch([r for r, _ in hits])
+        return [dict(docs[r], bm25=s) for r, s in hits if r in docs]
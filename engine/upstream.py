@@ -0,0 +1,146 @@
+"""
+上游调用治理 (SiliconFlow / Supabase)
+
+- build_http_client：共享连接池 (HTTP/2 + keep-alive)，连接 / 取连接超时单独设置；
+  连接池占满时快速失败 (PoolTimeout)，而不是无限堆积 socket
+- Upstream.call：熔断 + 幂等调用的指数退避抖动重试
+- Upstream.stream：流式响应的首 Token 超时 / 空闲超时
+- CircuitBreaker：连续失败达到阈值后熔断 reset_timeout 秒，期间直接拒绝；
+  之后放行一个探测请求 (半开)，成功则恢复
+"""
+import asyncio
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple, Type
+
+import httpx
+
+from engine.metrics import UPSTREAM_RETRIES
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class UpstreamTimeout(UpstreamError):
+    pass
+
+
+def build_http_client(max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+                      connect_timeout: float = 5.0, read_timeout: float = 120.0,
+                      pool_timeout: float = 5.0) -> httpx.AsyncClient:
+    try:
+        import h2  # noqa: F401  (httpx 的 HTTP/2 支持依赖 h2)
+        http2 = True
+    except ImportError:
+        http2 = False
+        print("⚠️ [Upstream] 未安装 h2，使用 HTTP/1.1 keep-alive")
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                            keepalive_expiry=keepalive_expiry),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout),
+        follow_redirects=True,
+    )
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self):
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise CircuitOpenError(f"上游服务 {self.name} 暂时不可用 (熔断中)，请稍后重试")
+        if state == "half_open": self._probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+            print(f"⚡ [Upstream] {self.name} 连续失败 {self.failures} 次，熔断 {self.reset_timeout:.0f}s")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """调用以非上游故障结束 (参数错误 / 取消)：不计入熔断，释放半开探测名额"""
+        self._probing = False
+
+
+class Upstream:
+    def __init__(self, name: str, retryable: Tuple[Type[BaseException], ...], retries: int = 3,
+                 base_delay: float = 0.2, max_delay: float = 5.0, breaker: Optional[CircuitBreaker] = None):
+        """retryable：计入熔断并可重试的异常 (超时 / 连接错误 / 429 / 5xx)；其余异常 (如 400) 直接抛出"""
+        self.name = name
+        self.retryable = retryable + (UpstreamTimeout,)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(name)
+
+    async def call(self, fn: Callable[[], Awaitable], retry: bool = True,
+                   retry_on: Optional[Tuple[Type[BaseException], ...]] = None):
+        """
+        retry:    仅幂等调用 (Embedding / 查询 / RPC) 应开启
+        retry_on: 收窄可重试的异常 (如 Chat 只在 429 时重试，此时请求未被处理)
+        """
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            self.breaker.before_call()
+            try:
+                result = await fn()
+            except self.retryable as e:
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts or (retry_on and not isinstance(e, retry_on)): raise
+                UPSTREAM_RETRIES.inc(upstream=self.name)
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                await asyncio.sleep(delay * (0.5 + random.random() / 2))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def stream(self, chunks: AsyncIterator, first_timeout: float, idle_timeout: float,
+                     is_token: Callable = bool) -> AsyncIterator:
+        """逐片转发；首个有效 Token 前最多等 first_timeout 秒，之后相邻两片最多间隔 idle_timeout 秒"""
+        iterator = chunks.__aiter__()
+        got_token = False
+        try:
+            while True:
+                timeout = idle_timeout if got_token else first_timeout
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.breaker.record_failure()
+                    phase = "空闲" if got_token else "首 Token"
+                    raise UpstreamTimeout(f"{self.name} {phase}超时 ({timeout:g}s)") from None
+                if not got_token and is_token(chunk):
+                    got_token = True
+                yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                result = close()
+                if asyncio.iscoroutine(result): await result
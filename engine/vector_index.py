@@ -0,0 +1,190 @@
+"""
+本地向量索引 (IVF，倒排文件)：float32 向量按簇连续存放在磁盘，查询时 mmap 读取
+
+目录结构 (LAWLENS_INDEX_DIR，默认 .cache/doc_index)：
+    index.json     维度、条数、各簇偏移、最大 documents.id
+    centroids.f32  nlist × dim 簇中心 (已归一化)
+    vectors.f32    count × dim 文档向量 (已归一化，按簇排序)
+    ids.i64        与 vectors 行对应的 documents.id
+    docs.sqlite    行号 → (id, title, content, metadata)，命中后按需读取正文
+    bm25_*         同一批文档的 BM25 倒排索引 (engine/text_index.py)
+
+查询：与簇中心做内积取 nprobe 个最近簇 → 只扫描这些簇的向量 → 余弦相似度 Top-K。
+"""
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+def _normalize(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, iters: int = 12, sample: int = 50000, seed: int = 0) -> np.ndarray:
+    """球面 k-means (内积)，在采样子集上训练簇中心"""
+    rng = np.random.default_rng(seed)
+    train = vectors if len(vectors) <= sample else vectors[rng.choice(len(vectors), sample, replace=False)]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = train[assign == c]
+            # 空簇重新随机取一个点，避免退化
+            centroids[c] = members.sum(axis=0) if len(members) else train[rng.integers(len(train))]
+        centroids = _normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+def build_index(rows: Iterable[Dict], out_dir: str, nlist: Optional[int] = None) -> Dict:
+    """
+    rows: 含 id / title / content / embedding (/ metadata) 的文档行
+    先写入临时目录，完成后整体替换 out_dir，查询方不会读到半成品。
+    """
+    ids, vecs, docs = [], [], []
+    for row in rows:
+        emb = row["embedding"]
+        if isinstance(emb, str): emb = json.loads(emb)  # pgvector 经 REST 返回 "[...]" 字符串
+        ids.append(int(row["id"]))
+        vecs.append(np.asarray(emb, dtype=np.float32))
+        docs.append((row.get("title") or "", row.get("content") or "", json.dumps(row.get("metadata"), ensure_ascii=False)))
+    if not vecs: raise ValueError("没有可索引的向量")
+
+    vectors = _normalize(np.vstack(vecs))
+    count, dim = vectors.shape
+    nlist = nlist or max(1, min(4096, int(np.sqrt(count))))
+    centroids = _kmeans(vectors, nlist) if nlist > 1 else _normalize(vectors.mean(axis=0, keepdims=True)).astype(np.float32)
+    assign = np.argmax(vectors @ centroids.T, axis=1) if nlist > 1 else np.zeros(count, dtype=np.int64)
+    order = np.argsort(assign, kind="stable")
+    offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).tolist()
+
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    vectors[order].astype(np.float32).tofile(os.path.join(tmp_dir, "vectors.f32"))
+    np.asarray(ids, dtype=np.int64)[order].tofile(os.path.join(tmp_dir, "ids.i64"))
+    centroids.tofile(os.path.join(tmp_dir, "centroids.f32"))
+
+    db = sqlite3.connect(os.path.join(tmp_dir, "docs.sqlite"))
+    db.execute("CREATE TABLE docs (row INTEGER PRIMARY KEY, id INTEGER, title TEXT, content TEXT, metadata TEXT)")
+    db.executemany("INSERT INTO docs VALUES (?, ?, ?, ?, ?)",
+                   ((r, ids[i], *docs[i]) for r, i in enumerate(order.tolist())))
+    db.commit()
+    db.close()
+
+    from engine.text_index import build_text_index  # 同目录下的 BM25 倒排索引，行号与向量一致
+    build_text_index(((r, *docs[i][:2]) for r, i in enumerate(order.tolist())), tmp_dir)
+
+    info = {"dim": dim, "count": count, "nlist": nlist, "offsets": offsets,
+            "max_id": max(ids), "built_at": time.time()}
+    with open(os.path.join(tmp_dir, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir): os.rename(out_dir, old_dir)
+    os.rename(tmp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return info
+
+
+class DocStore:
+    """docs.sqlite：按行号读取文档正文 (向量索引与倒排索引共用)"""
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def fetch(self, rows: List[int]) -> Dict[int, Dict]:
+        if not rows: return {}
+        marks = ",".join("?" * len(rows))
+        with self._lock:
+            found = self._db.execute(
+                f"SELECT row, id, title, content, metadata FROM docs WHERE row IN ({marks})", rows
+            ).fetchall()
+        return {r: {"id": i, "title": t, "content": c, "metadata": json.loads(m) if m else None}
+                for r, i, t, c, m in found}
+
+    def iter_docs(self) -> Iterable[Tuple[int, int, str, str, Optional[Dict]]]:
+        with self._lock:
+            rows = self._db.execute("SELECT row, id, title, content, metadata FROM docs ORDER BY row").fetchall()
+        for row, doc_id, title, content, metadata in rows:
+            yield row, doc_id, title, content, json.loads(metadata) if metadata else None
+
+
+class LocalVectorIndex:
+    def __init__(self, path: str, nprobe: int = 8, reload_interval: float = 30.0):
+        self.path = path
+        self.nprobe = nprobe
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._checked = 0.0
+        self._mtime = 0.0
+        self._load()
+
+    def _load(self):
+        meta_path = os.path.join(self.path, "index.json")
+        with open(meta_path, encoding="utf-8") as f:
+            info = json.load(f)
+        dim, count, nlist = info["dim"], info["count"], info["nlist"]
+        self.info = info
+        self.offsets = info["offsets"]
+        self.centroids = np.fromfile(os.path.join(self.path, "centroids.f32"), dtype=np.float32).reshape(nlist, dim)
+        self.vectors = np.memmap(os.path.join(self.path, "vectors.f32"), dtype=np.float32, mode="r", shape=(count, dim))
+        self.ids = np.memmap(os.path.join(self.path, "ids.i64"), dtype=np.int64, mode="r", shape=(count,))
+        self.docs = DocStore(os.path.join(self.path, "docs.sqlite"))
+        self._mtime = os.path.getmtime(meta_path)
+
+    def maybe_reload(self):
+        """build_index.py 刷新索引后，运行中的服务在 reload_interval 内自动加载新版本"""
+        now = time.time()
+        if now - self._checked < self.reload_interval: return
+        self._checked = now
+        try:
+            mtime = os.path.getmtime(os.path.join(self.path, "index.json"))
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                self._load()
+            print(f"🔄 [Index] 已加载新索引: {self.info['count']} 条")
+
+    def __len__(self):
+        return self.info["count"]
+
+    def search_rows(self, vec: List[float], k: int = 3, threshold: float = 0.0) -> List[Tuple[int, float]]:
+        """返回 [(行号, 相似度)]，按相似度降序"""
+        q = np.array(vec, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0: return []
+        q /= norm
+        with self._lock:
+            nlist = len(self.centroids)
+            probes = np.argsort(-(self.centroids @ q))[:min(self.nprobe, nlist)]
+            # 每个簇在磁盘上是连续的一段，按切片扫描，无需随机读
+            spans = [(self.offsets[c], self.offsets[c + 1]) for c in probes if self.offsets[c + 1] > self.offsets[c]]
+            if not spans: return []
+            rows = np.concatenate([np.arange(a, b) for a, b in spans])
+            scores = np.concatenate([self.vectors[a:b] @ q for a, b in spans])
+        top = np.argsort(-scores)[:k]
+        return [(int(rows[i]), float(scores[i])) for i in top if scores[i] > threshold]
+
+    def search(self, vec: List[float], k: int = 3, threshold: float = 0.0) -> List[Dict]:
+        """与 match_documents RPC 返回结构一致：id / title / content / similarity"""
+        self.maybe_reload()
+        hits = self.search_rows(vec, k, threshold)
+        docs = self.docs.fetch([r for r, _ in hits])
+        return [dict(docs[r], similarity=s) for r, s in hits if r in docs]
+
+    def iter_rows(self, keep_ids: Optional[set] = None) -> Iterable[Dict]:
+        """导出现有索引中的行 (刷新索引时复用，避免重新下载向量)"""
+        for row, doc_id, title, content, metadata in self.docs.iter_docs():
+            if keep_ids is not None and doc_id not in keep_ids: continue
+            yield {"id": doc_id, "title": title, "content": content,
+                   "metadata": metadata, "embedding": np.array(self.vectors[row])}
@@ -0,0 +1,189 @@
+"""
+文书版本库：快照 + 增量 (表 document_versions，建表 SQL 见 README 5.2)
+
+- 每个文书 (doc_id = 首个版本的 id) 的版本线性递增；新版本与上一版本做 token 级 diff，只存增量
+- 每 snapshot_every 个版本或增量超过全文一半时存一次完整快照，重建任一版本最多回放 snapshot_every 个增量
+- 内容未变化的自动保存直接跳过；各文书最新内容缓存在内存中，保存时无需回库重建
+- 每个增量记录其基准版本 (base_id)，重建时沿 base_id 回溯到快照：多 worker 下某进程缓存过期、
+  基于旧版本写入增量时，重建结果仍然正确；回溯链断裂则报错，不会静默还原出错误正文
+- token diff (difflib，耗时随文书长度近似平方增长) 在线程池中计算，不阻塞事件循环
+- 历史列表只返回元数据 (id / doc_id / title / size / created_at)，按 id 键集分页；正文按需加载
+
+增量格式 (JSON 数组)：正整数 n = 复制上一版本的 n 个 token；负整数 -n = 跳过 n 个 token；字符串 = 插入文本
+"""
+import asyncio
+import difflib
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Union
+
+# HTML 标签 / 按中文句读切分的文本片段 (保证 "".join(tokens) == 原文)
+_TOKEN_RE = re.compile(r"<[^<>]*>|[^<。；！？\n]+[。；！？\n]?|[。；！？\n]|<")
+
+Delta = List[Union[int, str]]
+
+
+def tokenize_html(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text)
+
+
+def make_delta(old: str, new: str) -> Delta:
+    a, b = tokenize_html(old), tokenize_html(new)
+    ops: Delta = []
+
+    def push(op):
+        if ops and type(op) is type(ops[-1]) and (isinstance(op, str) or (op > 0) == (ops[-1] > 0)):
+            ops[-1] += op
+        else:
+            ops.append(op)
+
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "equal":
+            push(i2 - i1)
+            continue
+        if i2 > i1: push(-(i2 - i1))
+        if j2 > j1: push("".join(b[j1:j2]))
+    return ops
+
+
+def apply_delta(old: str, delta: Delta) -> str:
+    tokens, pos, out = tokenize_html(old), 0, []
+    for op in delta:
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(tokens[pos:pos + op])
+            pos += op
+        else:
+            pos -= op
+    return "".join(out)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class VersionStore:
+    TABLE = "document_versions"
+
+    def __init__(self, supabase, run_db: Callable[..., Awaitable], snapshot_every: int = 20, cache_size: int = 256,
+                 run_blocking: Optional[Callable[..., Awaitable]] = None):
+        """
+        run_db(fn, idempotent=...)：在线程池中执行 supabase 的 .execute
+        run_blocking(fn, *args)：在线程池中执行 CPU 密集的 diff (缺省 asyncio.to_thread)
+        """
+        self.supabase = supabase
+        self.run_db = run_db
+        self.run_blocking = run_blocking or asyncio.to_thread
+        self.snapshot_every = snapshot_every
+        self.cache_size = cache_size
+        self._latest: "OrderedDict[int, Dict]" = OrderedDict()
+        self._locks: "OrderedDict[int, asyncio.Lock]" = OrderedDict()
+
+    def _table(self):
+        return self.supabase.table(self.TABLE)
+
+    def _owned(self, query, user_id: Optional[str]):
+        return query.eq("user_id", user_id) if user_id else query.is_("user_id", "null")
+
+    def _lock(self, doc_id: int) -> asyncio.Lock:
+        lock = self._locks.pop(doc_id, None) or asyncio.Lock()
+        self._locks[doc_id] = lock
+        while len(self._locks) > 10000:
+            self._locks.popitem(last=False)
+        return lock
+
+    def _remember(self, doc_id: int, state: Dict):
+        self._latest[doc_id] = state
+        self._latest.move_to_end(doc_id)
+        while len(self._latest) > self.cache_size:
+            self._latest.popitem(last=False)
+
+    async def _reconstruct(self, row: Dict) -> Dict:
+        """row: 含 id / doc_id / kind / snapshot_id / base_id / body；返回 {content, chain}"""
+        if row["kind"] == "snapshot":
+            return {"content": row["body"], "chain": 0}
+        snap = (await self.run_db(self._table().select("body").eq("id", row["snapshot_id"]).execute)).data[0]
+        rows = (await self.run_db(self._table().select("id, kind, base_id, body").eq("doc_id", row["doc_id"])
+                                  .gt("id", row["snapshot_id"]).lt("id", row["id"]).order("id").execute)).data
+        by_id = {r["id"]: r for r in rows}
+        # 从目标版本沿 base_id 回溯到快照；base_id 为空时按前一行处理 (兼容未记录基准的增量)
+        path, cur = [], row
+        while True:
+            path.append(cur)
+            base = cur.get("base_id") or max((i for i in by_id if i < cur["id"]), default=row["snapshot_id"])
+            if base == row["snapshot_id"]: break
+            cur = by_id.get(base)
+            if cur is None or cur["kind"] != "delta":
+                raise ValueError(f"版本 {row['id']} 的增量链断裂：基准版本 {base} 不存在或不是增量")
+        content = snap["body"]
+        for d in reversed(path):
+            content = apply_delta(content, json.loads(d["body"]))
+        return {"content": content, "chain": len(path)}
+
+    async def _get_latest(self, doc_id: int, user_id: Optional[str]) -> Optional[Dict]:
+        state = self._latest.get(doc_id)
+        if state is not None and state["user_id"] == user_id:
+            self._latest.move_to_end(doc_id)
+            return state
+        resp = await self.run_db(self._owned(self._table().select("id, doc_id, kind, snapshot_id, base_id, body, content_hash")
+                                             .eq("doc_id", doc_id), user_id).order("id", desc=True).limit(1).execute)
+        if not resp.data: return None
+        row = resp.data[0]
+        state = dict(await self._reconstruct(row), id=row["id"], hash=row["content_hash"], user_id=user_id,
+                     snapshot_id=row["snapshot_id"] or row["id"])
+        self._remember(doc_id, state)
+        return state
+
+    async def _insert(self, row: Dict) -> Dict:
+        return (await self.run_db(self._table().insert(row).execute, idempotent=False)).data[0]
+
+    async def save(self, user_id: Optional[str], title: str, content: str, doc_id: Optional[int] = None) -> Dict:
+        digest = content_hash(content)
+        if doc_id is not None:
+            async with self._lock(doc_id):
+                latest = await self._get_latest(doc_id, user_id)
+                if latest is not None:
+                    return await self._append(doc_id, latest, user_id, title, content, digest)
+
+        # 新文书：首个版本为快照，doc_id 指向自身
+        row = await self._insert({"user_id": user_id, "title": title, "kind": "snapshot", "body": content,
+                                  "size": len(content), "content_hash": digest})
+        await self.run_db(self._table().update({"doc_id": row["id"]}).eq("id", row["id"]).execute)
+        self._remember(row["id"], {"id": row["id"], "hash": digest, "content": content, "chain": 0,
+                                   "user_id": user_id, "snapshot_id": row["id"]})
+        return {"doc_id": row["id"], "version_id": row["id"], "kind": "snapshot", "stored": len(content)}
+
+    async def _append(self, doc_id: int, latest: Dict, user_id: Optional[str], title: str, content: str,
+                      digest: str) -> Dict:
+        if latest["hash"] == digest:
+            return {"doc_id": doc_id, "version_id": latest["id"], "kind": "unchanged", "stored": 0}
+        delta = await self.run_blocking(make_delta, latest["content"], content)
+        body = json.dumps(delta, ensure_ascii=False, separators=(",", ":"))
+        snapshot = latest["chain"] + 1 >= self.snapshot_every or len(body) > len(content) // 2
+        row = await self._insert({
+            "doc_id": doc_id, "user_id": user_id, "title": title, "size": len(content), "content_hash": digest,
+            "kind": "snapshot" if snapshot else "delta", "body": content if snapshot else body,
+            "snapshot_id": None if snapshot else latest["snapshot_id"],
+            "base_id": None if snapshot else latest["id"],
+        })
+        self._remember(doc_id, {"id": row["id"], "hash": digest, "content": content, "user_id": user_id,
+                                "chain": 0 if snapshot else latest["chain"] + 1,
+                                "snapshot_id": row["id"] if snapshot else latest["snapshot_id"]})
+        return {"doc_id": doc_id, "version_id": row["id"], "kind": row["kind"],
+                "stored": len(content) if snapshot else len(body)}
+
+    async def list(self, user_id: Optional[str], before: Optional[int] = None, limit: int = 20) -> List[Dict]:
+        query = self._owned(self._table().select("id, doc_id, title, size, created_at"), user_id)
+        if before: query = query.lt("id", before)
+        return (await self.run_db(query.order("id", desc=True).limit(limit).execute)).data
+
+    async def load(self, version_id: int, user_id: Optional[str]) -> Optional[Dict]:
+        resp = await self.run_db(self._owned(self._table().select(
+            "id, doc_id, title, size, created_at, kind, snapshot_id, base_id, body").eq("id", version_id), user_id).execute)
+        if not resp.data: return None
+        row = resp.data[0]
+        content = (await self._reconstruct(row))["content"]
+        return {k: row[k] for k in ("id", "doc_id", "title", "size", "created_at")} | {"content": content}
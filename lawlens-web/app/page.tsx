@@ -11,7 +11,8 @@ import {
   ArrowUp, BookOpen, LayoutDashboard, Settings, 
   User as UserIcon, BrainCircuit, ChevronLeft,
   CheckCircle2, Loader2, Share2, AlertCircle, X, Lock, Palette, UploadCloud, Activity,
-  FileText, Maximize2, Minimize2, GripVertical // ✨ P8: 拖拽图标
+  FileText, Maximize2, Minimize2, GripVertical, // ✨ P8: 拖拽图标
+  Square
 } from 'lucide-react'
 
 import { exportToWord } from '@/lib/export'
@@ -21,10 +22,12 @@ import { Button } from '@/components/ui/button'
 import { LEGAL_TEMPLATES } from '@/lib/templates' 
 import Link from 'next/link'
 import { cn } from '@/lib/utils'
+import { readSSE, isBusy, busyMessage, type SSEEvent } from '@/lib/sse'
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL
 
-interface HistoryItem { id: number; title: string; content: string; created_at: string; }
+interface HistoryItem { id: number; doc_id: number; title: string; size: number; created_at: string; }
+const HISTORY_PAGE_SIZE = 20
 interface Message { role: 'user' | 'assistant'; content: string; }
 
 // --- 完整的中文 Settings Modal ---
@@ -123,10 +126,14 @@ function MainContent() {
 
   const [input, setInput] = useState('')
   const [isAnalyzing, setIsAnalyzing] = useState(false)
+  const abortRef = useRef<AbortController | null>(null) // 中止生成：断开连接 + 通知服务端立即停止上游生成
+  const streamIdRef = useRef<string | null>(null) // 当前生成会话 id：断线后凭它和 Last-Event-ID 续传
   const chatEndRef = useRef<HTMLDivElement>(null)
   
   const [showHistory, setShowHistory] = useState(false)
   const [historyList, setHistoryList] = useState<HistoryItem[]>([])
+  const [hasMoreHistory, setHasMoreHistory] = useState(false)
+  const docIdRef = useRef<number | null>(null) // 当前文书在版本库中的 id，后续保存以增量追加
   const [user, setUser] = useState<User | null>(null)
   
   const [showSettings, setShowSettings] = useState(false)
@@ -217,13 +224,19 @@ function MainContent() {
 
   const switchMode = (newMode: 'draft' | 'polish') => { setMode(newMode) }
 
-  const fetchHistory = async () => {
+  // 历史列表只含元数据，按 id 键集分页：before = 已加载的最后一条
+  const fetchHistory = async (before?: number) => {
     if (!user) return
     try {
       const url = new URL(`${API_BASE_URL}/api/history`)
       url.searchParams.append('user_id', user.id)
+      url.searchParams.append('limit', String(HISTORY_PAGE_SIZE))
+      if (before) url.searchParams.append('before', String(before))
       const res = await fetch(url.toString())
-      if (res.ok) setHistoryList(await res.json())
+      if (!res.ok) return
+      const page: HistoryItem[] = await res.json()
+      setHistoryList(prev => before ? [...prev, ...page] : page)
+      setHasMoreHistory(page.length === HISTORY_PAGE_SIZE)
     } catch (error) { console.error(error) }
   }
 
@@ -233,11 +246,13 @@ function MainContent() {
     if (!currentContent || currentContent.trim() === '<p></p>') return 
     try {
       const title = currentContent.replace(/<[^>]+>/g, '').slice(0, 20) || "未命名文档"
-      await fetch(`${API_BASE_URL}/api/save`, {
+      const res = await fetch(`${API_BASE_URL}/api/save`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ title, content: currentContent, user_id: user?.id || null }),
+        body: JSON.stringify({ title, content: currentContent, user_id: user?.id || null, doc_id: docIdRef.current }),
       })
+      const data = await res.json()
+      if (data.status === 'success') docIdRef.current = data.doc_id
     } catch (e) { console.error(e); setSaveStatus('unsaved') }
   }
 
@@ -262,6 +277,7 @@ function MainContent() {
   const fillTemplate = (id: string) => {
     const template = LEGAL_TEMPLATES.find(t => t.id === id)
     if (template) {
+      docIdRef.current = null
       handleEditorChange(template.content)
       setSaveStatus('saved')
       setMode('polish') 
@@ -270,8 +286,16 @@ function MainContent() {
     }
   }
 
-  const loadHistoryItem = (item: HistoryItem) => {
-    handleEditorChange(item.content)
+  const loadHistoryItem = async (item: HistoryItem) => {
+    try {
+      const url = new URL(`${API_BASE_URL}/api/history/${item.id}`)
+      if (user) url.searchParams.append('user_id', user.id)
+      const res = await fetch(url.toString())
+      const data = await res.json()
+      if (typeof data.content !== 'string') { showToast("加载历史版本失败", "error"); return }
+      docIdRef.current = item.doc_id
+      handleEditorChange(data.content)
+    } catch (e) { showToast("加载历史版本失败", "error"); return }
     setSaveStatus('saved')
     setShowHistory(false)
     setMode('polish')
@@ -295,6 +319,7 @@ function MainContent() {
       const data = await res.json()
       
       if (data.status === 'success') {
+        docIdRef.current = null
         handleEditorChange(data.content)
         setSaveStatus('saved')
         setMode('polish')
@@ -315,7 +340,8 @@ function MainContent() {
     accept: { 
         'application/vnd.openxmlformats-officedocument.wordprocessingml.document': ['.docx'],
         'image/*': ['.png', '.jpg', '.jpeg'],
-        'application/pdf': ['.pdf']
+        'application/pdf': ['.pdf'],
+        'text/plain': ['.txt']
     },
     maxFiles: 1
   })
@@ -329,6 +355,7 @@ function MainContent() {
             method: 'POST', headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ current_doc: content, mode: 'risk_score', messages: [] })
         })
+        if (isBusy(res)) { showToast(busyMessage(res), "error"); return }
         const data = await res.json()
         setRiskData(data) 
         setPolishMessages(prev => [...prev, { role: 'assistant', content: "✅ 风险体检已完成，结果如上图所示。" }])
@@ -347,10 +374,30 @@ function MainContent() {
     setCurrentMessages(prev => [...prev, { role: 'assistant', content: '' }])
 
     const requestMode = chatWithDoc ? 'chat_doc' : mode
+    const controller = new AbortController()
+    abortRef.current = controller
+    streamIdRef.current = null
+    let fullText = ''
+    let lastEventId = ''
+    let finished = false
+    const onEvent = (ev: SSEEvent) => {
+      if (ev.id) lastEventId = ev.id
+      if (ev.event === 'meta') streamIdRef.current = JSON.parse(ev.data).stream_id
+      else if (ev.event === 'done') finished = true
+      else if (ev.event === 'message') {
+        fullText += ev.data
+        setCurrentMessages(prev => {
+            const newArr = [...prev]
+            newArr[newArr.length - 1] = { role: 'assistant', content: fullText }
+            return newArr
+        })
+      }
+    }
 
     try {
-      const response = await fetch(`${API_BASE_URL}/api/analyze`, {
+      let response = await fetch(`${API_BASE_URL}/api/analyze`, {
         method: 'POST',
+        signal: controller.signal,
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ 
             messages: [...currentMessages, newMsg], 
@@ -360,29 +407,51 @@ function MainContent() {
         }),
       })
 
-      if (!response.ok) throw new Error("API Error")
-      const reader = response.body!.getReader()
-      const decoder = new TextDecoder()
-      let done = false
-      let fullText = ''
-
-      while (!done) {
-        const { value, done: doneReading } = await reader.read()
-        done = doneReading
-        const chunkValue = decoder.decode(value, { stream: true })
-        fullText += chunkValue
+      if (isBusy(response)) {
+        const message = busyMessage(response)
         setCurrentMessages(prev => {
             const newArr = [...prev]
-            newArr[newArr.length - 1] = { role: 'assistant', content: fullText }
+            newArr[newArr.length - 1] = { role: 'assistant', content: `⏳ ${message}` }
             return newArr
         })
+        return
+      }
+      if (!response.ok) throw new Error("API Error")
+
+      // 断线续传：连接中断但未收到 done 时，带 Last-Event-ID 重连 (最多 3 次)，服务端从断点继续推送，不重新生成
+      for (let attempt = 0; ; attempt++) {
+        try { await readSSE(response, onEvent) } catch (e) { if (controller.signal.aborted) throw e }
+        if (finished || !streamIdRef.current || attempt >= 3) break
+        await new Promise(r => setTimeout(r, 1000 * (attempt + 1)))
+        try {
+          response = await fetch(`${API_BASE_URL}/api/analyze/stream/${streamIdRef.current}`, {
+            headers: { 'Last-Event-ID': lastEventId },
+            signal: controller.signal,
+          })
+          if (!response.ok) break // 会话已过期 / 断点超出回放范围
+        } catch (e) { if (controller.signal.aborted) throw e }
       }
+      if (!finished) throw new Error("Stream interrupted")
       if (mode === 'draft') handleEditorChange(fullText) 
     } catch (error) {
-        setCurrentMessages(prev => [...prev, { role: 'assistant', content: "⚠️ 网络请求失败。" }])
-    } finally { setIsAnalyzing(false) }
+        if (controller.signal.aborted) {
+          if (!fullText) setCurrentMessages(prev => prev.slice(0, -1))
+        } else {
+          setCurrentMessages(prev => [...prev, { role: 'assistant', content: "⚠️ 网络请求失败。" }])
+        }
+    } finally {
+      if (abortRef.current === controller) abortRef.current = null
+      setIsAnalyzing(false)
+    }
   }
 
+  const stopGenerating = () => {
+    abortRef.current?.abort()
+    if (streamIdRef.current) fetch(`${API_BASE_URL}/api/analyze/stream/${streamIdRef.current}`, { method: 'DELETE' }).catch(() => {})
+  }
+
+  useEffect(() => () => abortRef.current?.abort(), [])
+
   return (
     <div className="flex h-screen w-full bg-[#FAFAFA] text-slate-900 font-sans overflow-hidden select-none">
       
@@ -507,7 +576,11 @@ function MainContent() {
                     placeholder={chatWithDoc ? "针对本文档提问..." : (mode === 'draft' ? "描述案情以起草..." : "输入修改指令...")} 
                     className="w-full pl-4 pr-12 py-3.5 min-h-[52px] max-h-32 rounded-xl border border-slate-200 bg-slate-50 focus:bg-white focus:border-indigo-500 focus:ring-4 focus:ring-indigo-500/10 text-xs resize-none outline-none transition-all placeholder:text-slate-400 shadow-sm" 
                 />
-                <Button size="icon" onClick={handleSend} disabled={!input.trim() || isAnalyzing} className="absolute right-2 bottom-2 h-8 w-8 rounded-lg bg-indigo-600 hover:bg-indigo-700 text-white shadow-md disabled:opacity-50 disabled:grayscale transition-all"><ArrowUp className="w-4 h-4" /></Button>
+                {isAnalyzing ? (
+                  <Button size="icon" onClick={stopGenerating} title="停止生成" className="absolute right-2 bottom-2 h-8 w-8 rounded-lg bg-slate-700 hover:bg-slate-800 text-white shadow-md transition-all"><Square className="w-3.5 h-3.5 fill-current" /></Button>
+                ) : (
+                  <Button size="icon" onClick={handleSend} disabled={!input.trim()} className="absolute right-2 bottom-2 h-8 w-8 rounded-lg bg-indigo-600 hover:bg-indigo-700 text-white shadow-md disabled:opacity-50 disabled:grayscale transition-all"><ArrowUp className="w-4 h-4" /></Button>
+                )}
             </div>
          </div>
       </motion.div>
@@ -582,10 +655,13 @@ function MainContent() {
                     historyList.map((item) => (
                       <div key={item.id} onClick={() => loadHistoryItem(item)} className="p-3 rounded-lg border border-slate-100 hover:border-indigo-500/50 hover:bg-indigo-50/10 cursor-pointer transition-all">
                         <div className="font-medium text-slate-800 text-xs mb-1 truncate">{item.title}</div>
-                        <div className="text-[10px] text-slate-400">{new Date(item.created_at).toLocaleString()}</div>
+                        <div className="text-[10px] text-slate-400">{new Date(item.created_at).toLocaleString()} · {(item.size / 1024).toFixed(1)}KB</div>
                       </div>
                     ))
                 )}
+                {user && hasMoreHistory && (
+                    <button onClick={() => fetchHistory(historyList[historyList.length - 1]?.id)} className="w-full py-2 text-xs text-slate-500 hover:text-indigo-600 transition-colors">加载更多</button>
+                )}
               </div>
             </motion.div>
           </>
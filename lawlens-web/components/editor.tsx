@@ -24,6 +24,7 @@ import { diff_match_patch, DIFF_DELETE, DIFF_INSERT } from 'diff-match-patch'
 
 import { useEffect, useState, useImperativeHandle, forwardRef } from 'react'
 import { cn } from "@/lib/utils"
+import { readSSE, isBusy, busyMessage, type SSEEvent } from "@/lib/sse"
 import { 
   Bold, Italic, Underline as UnderlineIcon, Strikethrough,
   AlignLeft, AlignCenter, AlignRight, AlignJustify,
@@ -478,24 +479,20 @@ export default function Editor({ content, onChange, onStatsChange, className }:
         }),
       })
 
-      if (!response.ok) throw new Error("API Error")
-      
       // 删除占位符 (粗略估计长度)
       editor.commands.deleteRange({ from: editor.state.selection.from - 20, to: editor.state.selection.from }) 
 
-      const reader = response.body?.getReader()
-      const decoder = new TextDecoder()
-      
-      if(reader) {
-          while (true) {
-            const { value, done } = await reader.read()
-            if (done) break
-            const chunk = decoder.decode(value)
-            if (!chunk.includes('<blockquote>')) {
-                editor.commands.insertContent(chunk)
-            }
-          }
-      }
+      if (isBusy(response)) { alert(busyMessage(response)); return }
+      if (!response.ok) throw new Error("API Error")
+
+      // 只插入 message 事件的正文；meta (stream_id) 在此不需要续传，忽略
+      let finished = false
+      await readSSE(response, (ev: SSEEvent) => {
+        if (ev.event === 'done') finished = true
+        else if (ev.event === 'gap') throw new Error(ev.data)
+        else if (ev.event === 'message' && !ev.data.includes('<blockquote>')) editor.commands.insertContent(ev.data)
+      })
+      if (!finished) throw new Error("Stream interrupted")
     } catch (e) { alert("AI 服务异常") }
   }
 
@@ -520,20 +517,24 @@ export default function Editor({ content, onChange, onStatsChange, className }:
         body: JSON.stringify({ messages: [{ role: 'user', content: "润色" }], selection, mode: 'selection_polish' }),
       })
 
+      if (isBusy(response)) {
+        alert(busyMessage(response))
+        setIsStreaming(false)
+        return
+      }
       if (!response.ok) throw new Error("API Error")
-      const reader = response.body?.getReader()
-      const decoder = new TextDecoder()
-      
+
       let fullText = ''
-      if(reader) {
-          while (true) {
-            const { value, done } = await reader.read()
-            if (done) break
-            const chunk = decoder.decode(value)
-            fullText += chunk
-            setAiResult(prev => prev + chunk)
-          }
-      }
+      let finished = false
+      await readSSE(response, (ev: SSEEvent) => {
+        if (ev.event === 'done') finished = true
+        else if (ev.event === 'gap') throw new Error(ev.data)
+        else if (ev.event === 'message') {
+          fullText += ev.data
+          setAiResult(prev => prev + ev.data)
+        }
+      })
+      if (!finished) throw new Error("Stream interrupted")
       
       // ✨ P3: 生成 Diff HTML
       const diff = generateDiffHtml(selection, fullText)
@@ -0,0 +1,41 @@
+// /api/analyze 的响应处理：SSE 解析与准入限流提示 (page.tsx 对话与 editor.tsx 续写 / 润色共用)
+
+export interface SSEEvent { id?: string; event: string; data: string; }
+
+// 准入限流 (429) / 排队已满 (503)：按 Retry-After 提示等待时间
+export const isBusy = (response: Response) => response.status === 429 || response.status === 503
+export const busyMessage = (response: Response) => {
+  const wait = Number(response.headers.get('Retry-After'))
+  return `请求过于频繁/排队已满，请${wait > 0 ? ` ${wait} 秒后` : '稍后'}重试`
+}
+
+// SSE 解析：按空行分帧，多行 data 以 \n 拼接；注释行 (服务端保活) 忽略
+export const readSSE = async (response: Response, onEvent: (ev: SSEEvent) => void) => {
+  const reader = response.body!.getReader()
+  const decoder = new TextDecoder()
+  let buffer = ''
+  while (true) {
+    const { value, done } = await reader.read()
+    if (done) return
+    buffer += decoder.decode(value, { stream: true })
+    let sep
+    while ((sep = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, sep)
+      buffer = buffer.slice(sep + 2)
+      const ev: SSEEvent = { event: 'message', data: '' }
+      const data: string[] = []
+      for (const line of frame.split('\n')) {
+        if (!line || line.startsWith(':')) continue
+        const i = line.indexOf(':')
+        const field = i === -1 ? line : line.slice(0, i)
+        const value = i === -1 ? '' : line.slice(i + 1).replace(/^ /, '')
+        if (field === 'data') data.push(value)
+        else if (field === 'event') ev.event = value
+        else if (field === 'id') ev.id = value
+      }
+      if (!data.length && !ev.id) continue
+      ev.data = data.join('\n')
+      onEvent(ev)
+    }
+  }
+}
@@ -1,9 +1,12 @@
 import os
+import sys
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from sentence_transformers import SentenceTransformer
 from zhipuai import ZhipuAI
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.local_embedding import sync_embedding_client
+
 # 1. 加载配置
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -19,12 +22,12 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 zhipu_client = ZhipuAI(api_key=ZHIPU_API_KEY)
 
 print("⏳ 正在加载嵌入模型 (用于搜索)...")
-# 本地模型，用于把问题变成向量
-embed_model = SentenceTransformer('shibing624/text2vec-base-chinese')
+# 与入库 / server.py 相同的 bge-m3 向量空间 (LAWLENS_EMBED_BACKEND=local 时在本地推理)
+embed_client = sync_embedding_client()
 
 def get_relevant_laws(query: str):
     """ 去数据库搜索相关的法律条款 """
-    query_vector = embed_model.encode(query).tolist()
+    query_vector = embed_client.embeddings.create(model="BAAI/bge-m3", input=query).data[0].embedding
     
     response = supabase.rpc("match_documents", {
         "query_embedding": query_vector,
@@ -0,0 +1,289 @@
+"""
+离线基准测试：在压测替身 (scripts/bench_standins.py) 上运行固定场景，不消耗 SiliconFlow 额度
+
+    # 自动拉起替身 + server.py，跑全部场景
+    python scripts/bench.py --spawn --scenarios analyze,upload,ingest --concurrency 1,8,32
+
+    # 已手动启动替身与服务时
+    python scripts/bench.py --url http://127.0.0.1:8000 --standins http://127.0.0.1:9100
+
+每个 (场景, 并发数) 输出 p50/p95/p99 延迟与吞吐；--json 保存结果，便于前后版本对比。
+替身的时延参数固定时，同一版本多次运行结果稳定，可用于发现吞吐回退。
+"""
+import os
+import sys
+import argparse
+import asyncio
+import io
+import json
+import subprocess
+import tempfile
+import time
+import zipfile
+from typing import Dict, List, Tuple
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_test import percentile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ["draft", "polish", "chat_doc", "selection_polish", "risk_score"]
+CONTRACT = "".join(
+    f"<p>第{i}条 甲方应于每月{i}日前向乙方支付租金人民币{1000 + i * 10}元，逾期支付的，每日按应付金额的千分之一支付违约金。</p>"
+    for i in range(1, 41)
+)
+
+
+def make_docx(paragraphs: List[str]) -> bytes:
+    """生成最小可用的 .docx (mammoth 可解析)，避免依赖 python-docx"""
+    body = "".join(f"<w:p><w:r><w:t>{p}</w:t></w:r></w:p>" for p in paragraphs)
+    files = {
+        "[Content_Types].xml": '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                               '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                               '<Default Extension="xml" ContentType="application/xml"/>'
+                               '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>',
+        "_rels/.rels": '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                       '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/></Relationships>',
+        "word/document.xml": '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                             f"<w:body>{body}</w:body></w:document>",
+    }
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for name, data in files.items():
+            z.writestr(name, data)
+    return buf.getvalue()
+
+
+def analyze_payload(mode: str, i: int, allow_cache: bool) -> Dict:
+    # 默认让每个请求的问题不同并跳过响应缓存，测的是完整链路
+    suffix = "" if allow_cache else f" (#{i})"
+    question = {"draft": "帮我起草一份房屋租赁合同，租期一年。", "polish": "请审查这份合同。",
+                "chat_doc": "逾期支付租金的违约金如何计算？", "selection_polish": "改得更正式一些",
+                "risk_score": ""}[mode] + suffix
+    return {
+        "messages": [{"role": "user", "content": question}],
+        "mode": mode,
+        "current_doc": CONTRACT if mode in ("polish", "chat_doc", "risk_score") else "",
+        "selection": "甲方应按时交租，不然要赔钱。" + suffix if mode == "selection_polish" else "",
+        "user_id": f"bench-user-{i % 10}",
+        "no_cache": not allow_cache,
+    }
+
+
+def summarize(name: str, concurrency: int, samples: List[Dict], elapsed: float) -> Dict:
+    ok = [s for s in samples if s["ok"]]
+    totals = [s["total"] for s in ok]
+    ttfbs = [s["ttfb"] for s in ok if s.get("ttfb") is not None]
+    result = {
+        "scenario": name, "concurrency": concurrency, "requests": len(samples), "ok": len(ok),
+        "elapsed": round(elapsed, 3), "throughput": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "p50": percentile(totals, 50), "p95": percentile(totals, 95), "p99": percentile(totals, 99),
+    }
+    if ttfbs: result.update(ttfb_p50=percentile(ttfbs, 50), ttfb_p95=percentile(ttfbs, 95), ttfb_p99=percentile(ttfbs, 99))
+    line = (f"   {name:<24} 并发 {concurrency:>3} | 成功 {len(ok)}/{len(samples)} | {result['throughput']:.2f} 次/秒 | "
+            f"p50/p95/p99 {result['p50']:.2f}/{result['p95']:.2f}/{result['p99']:.2f}s")
+    if ttfbs: line += f" | 首包 p50/p95 {result['ttfb_p50']:.2f}/{result['ttfb_p95']:.2f}s"
+    print(line)
+    return result
+
+
+async def timed(fn) -> Dict:
+    start = time.perf_counter()
+    sample = {"ok": False, "ttfb": None}
+    try:
+        await fn(sample, start)
+    except Exception as e:
+        sample["error"] = str(e)
+    sample["total"] = time.perf_counter() - start
+    return sample
+
+
+async def run_concurrent(make_call, concurrency: int, requests: int) -> Tuple[List[Dict], float]:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def bounded(i: int):
+        async with sem:
+            return await timed(make_call(i))
+
+    start = time.perf_counter()
+    samples = await asyncio.gather(*[bounded(i) for i in range(requests)])
+    return list(samples), time.perf_counter() - start
+
+
+async def bench_analyze(http: httpx.AsyncClient, url: str, mode: str, concurrency: int, requests: int, allow_cache: bool):
+    def make_call(i: int):
+        async def call(sample: Dict, start: float):
+            payload = analyze_payload(mode, i, allow_cache)
+            if mode == "risk_score":
+                resp = await http.post(f"{url}/api/analyze", json=payload)
+                sample["ok"] = resp.status_code == 200 and bool(resp.json().get("dimensions"))
+                return
+            async with http.stream("POST", f"{url}/api/analyze", json=payload) as resp:
+                chars, failed, done, event = 0, False, False, "message"
+                async for line in resp.aiter_lines():  # SSE：event / id / data 行，空行分隔事件
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                        done = done or event == "done"
+                    elif line.startswith("data:") and event == "message":
+                        if sample["ttfb"] is None: sample["ttfb"] = time.perf_counter() - start
+                        chars += len(line) - 5
+                        failed = failed or "color:red" in line  # 服务端以红字提示上游错误
+                    elif not line:
+                        event = "message"
+                sample["ok"] = resp.status_code == 200 and chars > 0 and done and not failed
+        return call
+
+    samples, elapsed = await run_concurrent(make_call, concurrency, requests)
+    return summarize(f"analyze:{mode}", concurrency, samples, elapsed)
+
+
+async def bench_upload(http: httpx.AsyncClient, url: str, concurrency: int, requests: int):
+    docx = make_docx([f"第{i}条 甲方应当按照约定支付租金。" for i in range(1, 201)])
+
+    def make_call(i: int):
+        async def call(sample: Dict, start: float):
+            files = {"file": (f"bench-{i}.docx", docx,
+                              "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+            resp = await http.post(f"{url}/api/upload", files=files)
+            sample["ok"] = resp.status_code == 200 and resp.json().get("status") == "success"
+        return call
+
+    samples, elapsed = await run_concurrent(make_call, concurrency, requests)
+    return summarize("upload", concurrency, samples, elapsed)
+
+
+def write_corpus(data_dir: str, articles: int, cases: int):
+    with open(os.path.join(data_dir, "minfadian.txt"), "w", encoding="utf-8") as f:
+        f.write("第一编 总则\n第一章 基本规定\n")
+        for i in range(1, articles + 1):
+            f.write(f"第{i}条 民事主体从事民事活动，应当遵循诚信原则，秉持诚实，恪守承诺。（第 {i} 条测试正文）\n")
+    os.makedirs(os.path.join(data_dir, "lecard_cases"), exist_ok=True)
+    for i in range(cases):
+        case = {"ajName": f"测试案例{i}", "ajjbqk": "原告与被告因房屋租赁合同发生纠纷。" * 20, "pjjg": "判决被告支付租金。"}
+        with open(os.path.join(data_dir, "lecard_cases", f"{i}.json"), "w", encoding="utf-8") as f:
+            json.dump(case, f, ensure_ascii=False)
+
+
+def bench_ingest(env: Dict, standins: str, workers: int, articles: int, cases: int) -> Dict:
+    """ingest_v2.py 作为子进程运行 (与生产用法一致)，每轮使用全新语料目录与清单"""
+    with tempfile.TemporaryDirectory() as tmp:
+        write_corpus(tmp, articles, cases)
+        before = httpx.get(f"{standins}/bench/stats").json()["tables"].get("documents", 0)
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, os.path.join(ROOT, "scripts", "ingest_v2.py"), "--data-dir", tmp,
+             "--workers", str(workers), "--manifest", os.path.join(tmp, "manifest.sqlite3"), "--no-prune",
+             "--seed-from-db"],  # 替身库预置了知识库数据
+            env=env, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+        )
+        elapsed = time.perf_counter() - start
+        rows = httpx.get(f"{standins}/bench/stats").json()["tables"].get("documents", 0) - before
+    result = {"scenario": "ingest", "concurrency": workers, "rows": rows, "elapsed": round(elapsed, 3),
+              "throughput": round(rows / elapsed, 3) if elapsed else 0.0, "ok": proc.returncode == 0}
+    print(f"   {'ingest':<24} 并发 {workers:>3} | 写入 {rows} 行 | {elapsed:.2f}s | {result['throughput']:.1f} 行/秒"
+          + ("" if result["ok"] else f" | ❌ 退出码 {proc.returncode}: {proc.stderr[-300:]}"))
+    return result
+
+
+def wait_ready(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=2.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.3)
+    raise RuntimeError(f"等待 {url} 超时")
+
+
+def bench_env(standins: str, concurrency: int) -> Dict:
+    """
+    被测服务的环境变量。准入控制默认值 (每用户 2 路并发 / 0.5 请求每秒) 面向真实用户，
+    基准测试由少数几个 user_id 发出全部请求，按默认值运行测到的是限流而非服务本身，
+    因此放宽到足以容纳 concurrency (已在环境中显式设置的保持不变，便于专门测试限流)
+    """
+    env = dict(os.environ)
+    for key, value in {
+        "LAWLENS_MAX_STREAMS": concurrency * 4,  # 长文档分段润色按扇出宽度计入上限
+        "LAWLENS_USER_STREAMS": concurrency,
+        "LAWLENS_USER_RATE": 10000,
+        "LAWLENS_USER_BURST": 10000,
+        "LAWLENS_MAX_QUEUE": 10000,
+    }.items():
+        env.setdefault(key, str(value))
+    env.update({
+        "SUPABASE_URL": standins,
+        "SUPABASE_SERVICE_ROLE_KEY": "bench.bench.bench",  # 替身不校验，仅需满足 SDK 的 JWT 格式检查
+        "SILICONFLOW_API_KEY": "bench",
+        "SILICONFLOW_BASE_URL": f"{standins}/v1",
+        "LAWLENS_RETRIEVER": env.get("LAWLENS_RETRIEVER", "supabase"),
+        "LAWLENS_EMBED_CACHE_DB": "",
+    })
+    return env
+
+
+async def main(args):
+    procs = []
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+    env = bench_env(args.standins, max(concurrency))
+    try:
+        if args.spawn:
+            port = args.standins.rsplit(":", 1)[-1]
+            procs.append(subprocess.Popen(
+                [sys.executable, os.path.join(ROOT, "scripts", "bench_standins.py"), "--port", port,
+                 "--ttft", str(args.ttft), "--tokens-per-sec", str(args.tokens_per_sec),
+                 "--output-tokens", str(args.output_tokens), "--embed-latency", str(args.embed_latency),
+                 "--rpc-latency", str(args.rpc_latency), "--error-rate", str(args.error_rate)], cwd=ROOT))
+            wait_ready(f"{args.standins}/bench/stats")
+            procs.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "server:app", "--port", args.url.rsplit(":", 1)[-1], "--log-level", "warning"],
+                env=env, cwd=ROOT))
+            wait_ready(f"{args.url}/api/cache/stats")
+
+        scenarios = args.scenarios.split(",")
+        results = []
+        print(f"\n📊 基准测试 (TTFT {args.ttft}s | {args.tokens_per_sec} Token/s | 每组 {args.requests} 次请求)")
+        limits = httpx.Limits(max_connections=max(concurrency) + 4)
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as http:
+            for c in concurrency:
+                if "analyze" in scenarios:
+                    for mode in args.modes.split(","):
+                        results.append(await bench_analyze(http, args.url, mode, c, args.requests, args.allow_cache))
+                if "upload" in scenarios:
+                    results.append(await bench_upload(http, args.url, c, args.requests))
+                if "ingest" in scenarios:
+                    results.append(await asyncio.to_thread(bench_ingest, env, args.standins, c, args.articles, args.cases))
+
+        print(f"\n🧪 替身调用统计: {httpx.get(f'{args.standins}/bench/stats').json()['counters']}")
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"config": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+            print(f"💾 结果已保存: {args.json}")
+    finally:
+        for p in reversed(procs):
+            p.terminate()
+            p.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LawLens 离线基准测试")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--standins", default="http://127.0.0.1:9100")
+    parser.add_argument("--spawn", action="store_true", help="自动启动替身与 server.py (结束后关闭)")
+    parser.add_argument("--scenarios", default="analyze,upload,ingest")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--concurrency", default="1,8,32", help="逗号分隔的并发档位")
+    parser.add_argument("--requests", type=int, default=32, help="每组请求数")
+    parser.add_argument("--allow-cache", action="store_true", help="使用相同请求并允许命中响应缓存")
+    parser.add_argument("--articles", type=int, default=2000, help="ingest 场景的法条数")
+    parser.add_argument("--cases", type=int, default=200, help="ingest 场景的案例数")
+    parser.add_argument("--ttft", type=float, default=0.8)
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0)
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--rpc-latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", default=None, help="结果输出路径")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,319 @@
+"""
+离线压测替身：一个进程同时提供
+  - OpenAI 兼容接口 /v1/chat/completions (流式 / 非流式)、/v1/embeddings，延迟与出字速率可配置
+  - Supabase (PostgREST) 内存版 /rest/v1/<表>，以及 match_documents / match_memories RPC
+server.py 与 ingest_v2.py 无需改代码，只需把 SUPABASE_URL / SILICONFLOW_BASE_URL 指向本进程。
+
+用法:
+    python scripts/bench_standins.py --port 9100 --ttft 0.8 --tokens-per-sec 30 --seed-docs 2000
+
+Embedding 为确定性的特征哈希向量 (同一文本 → 同一向量，词元重叠越多越相似)，
+RAG / 记忆检索能真实命中，结果可复现。
+"""
+import os
+import sys
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.text_index import tokenize
+
+DIM = 1024
+RISK_JSON = {"合规性": 82, "权益保护": 76, "完整性": 88, "文本规范": 91, "summary": "违约责任条款约定不够明确。"}
+FILLER = "根据《中华人民共和国民法典》相关规定，双方应当遵循诚实信用原则，全面履行合同约定的义务。"
+
+app = FastAPI()
+cfg = argparse.Namespace()
+rng = random.Random(0)
+tables: Dict[str, Dict] = {}
+counters = {"chat": 0, "chat_stream": 0, "embeddings": 0, "embedded_texts": 0, "rpc": 0, "rest": 0, "injected_errors": 0}
+
+
+def fake_embedding(text: str) -> np.ndarray:
+    vec = np.zeros(DIM, dtype=np.float32)
+    for token in tokenize(text):
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % DIM] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def injected_error():
+    if cfg.error_rate and rng.random() < cfg.error_rate:
+        counters["injected_errors"] += 1
+        return JSONResponse({"error": {"message": "rate limited (injected)"}}, status_code=429)
+    return None
+
+
+# ---------------- OpenAI 兼容接口 ----------------
+
+def completion_text(messages: List[Dict], max_tokens: int) -> List[str]:
+    """返回按 Token 切好的输出；风险评分 (要求 JSON) 返回固定评分"""
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    if "JSON" in system:
+        prompt = "".join(m["content"] for m in messages)
+        count = max(1, len(re.findall(r"【片段 \d+】", prompt)))  # 风险评分按条款批量提交
+        clauses = [dict(RISK_JSON, id=i) for i in range(1, count + 1)]
+        return [json.dumps({"clauses": clauses}, ensure_ascii=False)]
+    n = min(cfg.output_tokens, max_tokens or cfg.output_tokens)
+    body = "<h3>分析报告</h3><p>" + (FILLER * (n // len(FILLER) + 1))
+    return [body[i] for i in range(n)]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    error = injected_error()
+    if error: return error
+    tokens = completion_text(body.get("messages", []), body.get("max_tokens") or 0)
+    model, created = body.get("model", "bench"), int(time.time())
+
+    if not body.get("stream"):
+        counters["chat"] += 1
+        await asyncio.sleep(cfg.ttft + len(tokens) / cfg.tokens_per_sec)
+        return {
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+        }
+
+    counters["chat_stream"] += 1
+
+    def event(delta: Dict, finish=None) -> str:
+        chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": created, "model": model,
+                 "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    async def stream():
+        await asyncio.sleep(cfg.ttft)
+        yield event({"role": "assistant", "content": ""})
+        for token in tokens:
+            yield event({"content": token})
+            await asyncio.sleep(1 / cfg.tokens_per_sec)
+        yield event({}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    error = injected_error()
+    if error: return error
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    counters["embeddings"] += 1
+    counters["embedded_texts"] += len(inputs)
+    await asyncio.sleep(cfg.embed_latency + cfg.embed_per_item * len(inputs))
+    return {
+        "object": "list", "model": body.get("model", "bench"),
+        "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(t).tolist()} for i, t in enumerate(inputs)],
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    }
+
+
+# ---------------- Supabase (PostgREST) 内存版 ----------------
+
+def table(name: str) -> Dict:
+    return tables.setdefault(name, {"rows": {}, "vectors": {}, "next_id": 1, "matrix": None})
+
+
+def insert(name: str, row: Dict) -> Dict:
+    t = table(name)
+    row = dict(row, id=t["next_id"])
+    row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+    t["next_id"] += 1
+    emb = row.pop("embedding", None)
+    if emb is not None:
+        t["vectors"][row["id"]] = np.asarray(json.loads(emb) if isinstance(emb, str) else emb, dtype=np.float32)
+        t["matrix"] = None
+    t["rows"][row["id"]] = row
+    return row
+
+
+def render(t: Dict, row: Dict) -> Dict:
+    out = dict(row)
+    vec = t["vectors"].get(row["id"])
+    out["embedding"] = None if vec is None else "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
+    return out
+
+
+def _coerce(value, arg: str):
+    if isinstance(value, bool): return arg == "true"
+    if isinstance(value, int): return int(arg)
+    if isinstance(value, float): return float(arg)
+    return arg
+
+
+def matches(t: Dict, row: Dict, column: str, expr: str) -> bool:
+    negate = expr.startswith("not.")
+    if negate: expr = expr[4:]
+    op, _, arg = expr.partition(".")
+    value = t["vectors"].get(row["id"]) if column == "embedding" else row.get(column)
+    if op == "is":
+        ok = (value is None) if arg == "null" else (value is not None and bool(value) == (arg == "true"))
+    elif value is None:
+        ok = False
+    elif op == "in":
+        ok = value in {_coerce(value, a.strip('"')) for a in arg.strip("()").split(",") if a}
+    else:
+        other = _coerce(value, arg)
+        ok = {"eq": value == other, "neq": value != other, "gt": value > other,
+              "gte": value >= other, "lt": value < other, "lte": value <= other}[op]
+    return ok != negate
+
+
+def query_rows(name: str, params) -> List[Dict]:
+    t = table(name)
+    rows = list(t["rows"].values())
+    for column, expr in params.multi_items():
+        if column in ("select", "order", "limit", "offset", "columns", "on_conflict"): continue
+        rows = [r for r in rows if matches(t, r, column, expr)]
+    for key in reversed((params.get("order") or "").split(",")):
+        if not key: continue
+        column, _, direction = key.partition(".")
+        rows.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=direction.startswith("desc"))
+    offset = int(params.get("offset", 0))
+    limit = params.get("limit")
+    return rows[offset:offset + int(limit)] if limit else rows[offset:]
+
+
+def project(t: Dict, rows: List[Dict], select: str) -> List[Dict]:
+    out = [render(t, r) for r in rows]
+    if not select or select == "*": return out
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: r.get(c) for c in columns} for r in out]
+
+
+async def rest_delay():
+    counters["rest"] += 1
+    await asyncio.sleep(cfg.rpc_latency)
+
+
+@app.get("/rest/v1/{name}")
+async def rest_select(name: str, request: Request):
+    await rest_delay()
+    return project(table(name), query_rows(name, request.query_params), request.query_params.get("select", "*"))
+
+
+@app.post("/rest/v1/{name}")
+async def rest_insert(name: str, request: Request):
+    await rest_delay()
+    body = await request.json()
+    rows = [insert(name, r) for r in (body if isinstance(body, list) else [body])]
+    return JSONResponse(project(table(name), rows, "*"), status_code=201)
+
+
+@app.patch("/rest/v1/{name}")
+async def rest_update(name: str, request: Request):
+    await rest_delay()
+    body = await request.json()
+    rows = query_rows(name, request.query_params)
+    for r in rows:
+        r.update(body)
+    return project(table(name), rows, "*")
+
+
+@app.delete("/rest/v1/{name}")
+async def rest_delete(name: str, request: Request):
+    await rest_delay()
+    t = table(name)
+    rows = query_rows(name, request.query_params)
+    out = project(t, rows, "*")
+    for r in rows:
+        t["rows"].pop(r["id"], None)
+        t["vectors"].pop(r["id"], None)
+    t["matrix"] = None
+    return out
+
+
+def nearest(name: str, query: List[float], threshold: float, k: int, where=None) -> List[Dict]:
+    t = table(name)
+    if t["matrix"] is None:
+        ids = list(t["vectors"])
+        t["matrix"] = (ids, np.vstack([t["vectors"][i] for i in ids]) if ids else np.zeros((0, DIM), np.float32))
+    ids, matrix = t["matrix"]
+    if not ids: return []
+    q = np.asarray(query, dtype=np.float32)
+    q = q / (np.linalg.norm(q) or 1.0)
+    sims = matrix @ q
+    hits = []
+    for i in np.argsort(-sims):
+        if sims[i] < threshold or len(hits) >= k: break
+        row = t["rows"].get(ids[i])
+        if row is None or (where and not where(row)): continue
+        hits.append(dict(row, similarity=float(sims[i])))
+    return hits
+
+
+@app.post("/rest/v1/rpc/{fn}")
+async def rpc(fn: str, request: Request):
+    counters["rpc"] += 1
+    await asyncio.sleep(cfg.rpc_latency)
+    p = await request.json()
+    if fn == "match_documents":
+        return nearest("documents", p["query_embedding"], p["match_threshold"], p["match_count"])
+    if fn == "match_memories":
+        return nearest("agent_memories", p["query_embedding"], p["match_threshold"], p["match_count"],
+                       where=lambda r: r.get("user_id") == p.get("p_user_id"))
+    return JSONResponse({"message": f"function {fn} not found"}, status_code=404)
+
+
+@app.get("/bench/stats")
+async def stats():
+    return {"counters": counters, "tables": {name: len(t["rows"]) for name, t in tables.items()}}
+
+
+@app.post("/bench/reset")
+async def reset():
+    for key in counters: counters[key] = 0
+    return {"status": "ok"}
+
+
+# ---------------- 种子数据 ----------------
+
+TOPICS = ["房屋租赁", "买卖合同", "借款合同", "劳动争议", "交通事故", "离婚财产分割", "知识产权", "建设工程", "保证担保", "侵权责任"]
+
+
+def seed(n_docs: int, n_users: int):
+    for i in range(n_docs):
+        topic = TOPICS[i % len(TOPICS)]
+        content = f"第{i + 1}条 关于{topic}纠纷，{FILLER}当事人就{topic}发生争议的，可以协商解决。"
+        insert("documents", {"title": f"{topic} 参考资料 {i + 1}", "content": content, "user_id": None,
+                             "embedding": fake_embedding(content)})
+    for u in range(n_users):
+        for pref in ("合同中请使用「甲方」「乙方」称谓", "违约金比例不超过合同总额的 20%"):
+            insert("agent_memories", {"user_id": f"bench-user-{u}", "content": pref, "memory_type": "preference",
+                                      "embedding": fake_embedding(pref)})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LawLens 离线压测替身 (OpenAI 兼容 + Supabase 内存版)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.8, help="首 Token 时延 (秒)")
+    parser.add_argument("--tokens-per-sec", type=float, default=30.0, help="流式出字速率")
+    parser.add_argument("--output-tokens", type=int, default=300, help="每次回答的 Token 数")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Embedding 请求固定时延 (秒)")
+    parser.add_argument("--embed-per-item", type=float, default=0.002, help="Embedding 每条文本附加时延 (秒)")
+    parser.add_argument("--rpc-latency", type=float, default=0.02, help="Supabase 请求时延 (秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回 429 的比例 (验证重试)")
+    parser.add_argument("--seed-docs", type=int, default=2000)
+    parser.add_argument("--seed-users", type=int, default=10)
+    cfg = parser.parse_args()
+
+    seed(cfg.seed_docs, cfg.seed_users)
+    print(f"🧪 压测替身已就绪: {cfg.seed_docs} 条文档 | TTFT {cfg.ttft}s | {cfg.tokens_per_sec} Token/s")
+    uvicorn.run(app, host=cfg.host, port=cfg.port, log_level="warning")
@@ -0,0 +1,75 @@
+"""
+构建 / 刷新本地向量索引与 BM25 倒排索引 (供 LAWLENS_RETRIEVER=hybrid|local 使用)
+
+    python scripts/build_index.py              # 全量构建
+    python scripts/build_index.py --refresh    # 增量刷新：复用已有向量，只下载新增行并剔除已删除行
+
+运行中的 server.py 会在 30 秒内自动加载新索引。
+"""
+import os
+import sys
+import argparse
+import time
+from typing import Dict, Iterator
+from dotenv import load_dotenv
+from supabase import create_client, Client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.vector_index import LocalVectorIndex, build_index
+
+load_dotenv()
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+if not all([SUPABASE_URL, SUPABASE_KEY]):
+    print("❌ 错误: 环境变量缺失，请检查 .env 文件！")
+    exit()
+
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+PAGE = 500
+
+def fetch_rows(min_id: int = 0) -> Iterator[Dict]:
+    """ 按 id 键集分页拉取带向量的 documents 行 """
+    last = min_id
+    while True:
+        resp = supabase.table("documents").select("id, title, content, metadata, embedding") \
+            .gt("id", last).not_.is_("embedding", "null").order("id").limit(PAGE).execute()
+        if not resp.data: return
+        yield from resp.data
+        last = resp.data[-1]["id"]
+        print(f"   ⬇️ 已拉取至 id={last}", end="\r")
+
+def fetch_ids() -> set:
+    ids, last = set(), 0
+    while True:
+        resp = supabase.table("documents").select("id").gt("id", last) \
+            .not_.is_("embedding", "null").order("id").limit(5000).execute()
+        if not resp.data: return ids
+        ids.update(r["id"] for r in resp.data)
+        last = resp.data[-1]["id"]
+
+def refresh_rows(index: LocalVectorIndex) -> Iterator[Dict]:
+    alive = fetch_ids()
+    kept = 0
+    for row in index.iter_rows(keep_ids=alive):
+        kept += 1
+        yield row
+    print(f"   ♻️ 复用 {kept} 条，剔除 {len(index) - kept} 条已删除行")
+    yield from fetch_rows(min_id=index.info["max_id"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="构建 LawLens 本地向量索引")
+    parser.add_argument("--out", default=os.getenv("LAWLENS_INDEX_DIR", ".cache/doc_index"))
+    parser.add_argument("--nlist", type=int, default=None, help="IVF 簇数 (默认 sqrt(N))")
+    parser.add_argument("--refresh", action="store_true", help="基于已有索引增量刷新")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.refresh and os.path.exists(os.path.join(args.out, "index.json")):
+        print("🔄 增量刷新本地索引...")
+        rows = refresh_rows(LocalVectorIndex(args.out))
+    else:
+        print("📦 全量构建本地索引...")
+        rows = fetch_rows()
+    info = build_index(rows, args.out, nlist=args.nlist)
+    print(f"\n🎉 完成：{info['count']} 条，{info['nlist']} 个簇，维度 {info['dim']}，耗时 {time.time() - start:.1f}s")
@@ -0,0 +1,62 @@
+"""
+导出本地 Embedding 模型：BAAI/bge-m3 → ONNX → int8 动态量化 (供 LAWLENS_EMBED_BACKEND=local 使用)
+
+    pip install "optimum[onnxruntime]" tokenizers
+    python scripts/export_local_embedder.py                       # 输出到 .cache/bge-m3-int8
+    python scripts/export_local_embedder.py --check "租赁合同解除"   # 导出后与 SiliconFlow 的向量比对余弦相似度
+
+输出目录：model_quantized.onnx (+ 外部权重文件)、tokenizer.json。导出只需一次，之后服务与 ingest 离线运行。
+"""
+import os
+import sys
+import argparse
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def export(model_name: str, out_dir: str):
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"⏳ 正在导出 {model_name} 为 ONNX (fp32)...")
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(tmp)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp)
+        print("⏳ 正在进行 int8 动态量化...")
+        # bge-m3 fp32 权重超过 2GB，需使用外部数据格式
+        quantize_dynamic(os.path.join(tmp, "model.onnx"), os.path.join(out_dir, "model_quantized.onnx"),
+                         weight_type=QuantType.QInt8, use_external_data_format=True)
+        shutil.copy(os.path.join(tmp, "tokenizer.json"), os.path.join(out_dir, "tokenizer.json"))
+    print(f"✅ 已导出到 {out_dir}")
+
+
+def check(out_dir: str, text: str):
+    """与 SiliconFlow 的 bge-m3 比对：同一向量空间时余弦相似度应接近 1"""
+    from dotenv import load_dotenv
+    from openai import OpenAI
+    from engine.local_embedding import OnnxEmbeddingEngine
+
+    load_dotenv()
+    local = OnnxEmbeddingEngine(out_dir).encode([text])[0]
+    client = OpenAI(api_key=os.getenv("SILICONFLOW_API_KEY"),
+                    base_url=os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1"))
+    remote = client.embeddings.create(model="BAAI/bge-m3", input=text).data[0].embedding
+    dot = sum(a * b for a, b in zip(local, remote))
+    norm = sum(b * b for b in remote) ** 0.5
+    print(f"📏 本地 / 远程向量余弦相似度: {dot / norm:.4f} (维度 {len(local)})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导出 int8 量化的 bge-m3 ONNX 模型")
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--out", default=os.getenv("LAWLENS_LOCAL_EMBED_DIR", ".cache/bge-m3-int8"))
+    parser.add_argument("--check", metavar="TEXT", help="导出后与 SiliconFlow 返回的向量比对")
+    parser.add_argument("--skip-export", action="store_true", help="仅比对已导出的模型")
+    args = parser.parse_args()
+
+    if not args.skip_export: export(args.model, args.out)
+    if args.check: check(args.out, args.check)
@@ -1,186 +1,302 @@
 import os
+import sys
+import argparse
 import json
-import time
-import re
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from openai import OpenAI  # 👈 改用 OpenAI 库
-from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.embedding_cache import get_embedding_cache  # 与 server.py 共用缓存实现
+from engine.batch_embedder import BatchEmbedder
+from engine.ingest_pipeline import IngestPipeline
+from engine.ingest_manifest import IngestManifest, chunk_hash
+from engine.chunking import (iter_text_blocks, iter_chunks, iter_clauses, iter_lines,
+                             iter_statute_chunks, iter_case_chunks)
 
 # 1. 加载环境变量
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SILICONFLOW_API_KEY = os.getenv("SILICONFLOW_API_KEY") # 👈 新 Key
+SILICONFLOW_BASE_URL = os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1")  # 压测时指向本地替身
+
+EMBED_BACKEND = os.getenv("LAWLENS_EMBED_BACKEND", "remote")  # local：本地 int8 bge-m3，无需 SiliconFlow Key
 
-if not all([SUPABASE_URL, SUPABASE_KEY, SILICONFLOW_API_KEY]):
+if not all([SUPABASE_URL, SUPABASE_KEY]) or (EMBED_BACKEND != "local" and not SILICONFLOW_API_KEY):
     print("❌ 错误: 环境变量缺失，请检查 .env 文件！")
     exit()
 
 # 2. 初始化客户端
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# 👇 初始化 SiliconFlow 客户端 (兼容 OpenAI 格式)
-client = OpenAI(
-    api_key=SILICONFLOW_API_KEY,
-    base_url="https://api.siliconflow.cn/v1"
-)
+EMBED_MODEL = "BAAI/bge-m3"
+EMBED_BATCH = int(os.getenv("LAWLENS_EMBED_BATCH", "64"))  # 单次请求最多携带的文本条数
+embedding_cache = get_embedding_cache()
+embedder: BatchEmbedder = None  # 在 __main__ 中按 --workers 初始化
 
-print("🚀 客户端初始化完成 (SiliconFlow)。准备开始处理数据...")
+def make_embedder(workers: int) -> BatchEmbedder:
+    if EMBED_BACKEND == "local":
+        # 各 Embedding 工作线程并发调用同一会话 (ONNX Runtime 释放 GIL)，核数按 --workers 均分，避免超订
+        from engine.local_embedding import LocalEmbeddingClient, load_engine
+        return BatchEmbedder(LocalEmbeddingClient.sync(load_engine(workers=workers)), EMBED_MODEL,
+                             cache=embedding_cache, batch_size=EMBED_BATCH, max_batch=EMBED_BATCH)
+    # 👇 初始化 SiliconFlow 客户端 (兼容 OpenAI 格式)
+    # 重试交给 BatchEmbedder 的指数退避，SDK 自身不再重试
+    client = OpenAI(
+        api_key=SILICONFLOW_API_KEY,
+        base_url=SILICONFLOW_BASE_URL,
+        max_retries=0
+    )
+    return BatchEmbedder(client, EMBED_MODEL, cache=embedding_cache, max_batch=EMBED_BATCH)
 
 # ---------------- 工具函数 ----------------
 
-def get_embedding(text: str):
-    """ 调用 SiliconFlow 获取 BGE-M3 向量 (1024维) """
-    for _ in range(3):
-        try:
-            # ✅ 这里使用硅基流动的免费向量模型 BAAI/bge-m3
-            response = client.embeddings.create(
-                model="BAAI/bge-m3", 
-                input=text
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            print(f"   ⚠️ API 波动: {e}，正在重试...")
-            time.sleep(1)
-    print("   ❌ Embedding 失败，跳过此条")
-    return None
-
-def check_if_exists(title_prefix: str) -> bool:
-    try:
-        response = supabase.table("documents").select("id").ilike("title", f"{title_prefix}%").limit(1).execute()
-        return len(response.data) > 0
-    except Exception:
-        return False
-
-def chunk_text(text: str, chunk_size=500, overlap=50) -> List[str]:
-    if not text: return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + chunk_size
-        chunks.append(text[start:end])
-        start += (chunk_size - overlap)
-    return chunks
-
-def batch_insert(records: List[Dict]):
+def embed_records(records: List[Dict]) -> List[Dict]:
+    """ 批量为 records 填充 embedding，失败的条目被丢弃 """
+    vectors = embedder.embed([r["content"] for r in records])
+    out = []
+    for record, vec in zip(records, vectors):
+        if vec is None: continue
+        record["embedding"] = vec
+        out.append(record)
+    return out
+
+def make_record(source: str, title: str, content: str, metadata: Optional[Dict] = None) -> Dict:
+    """ _source / _hash 仅供清单使用，写库前剔除；metadata 为结构化切片的层级信息 """
+    record = {
+        "title": title,
+        "content": content,
+        "user_id": None,
+        "_source": source,
+        "_hash": chunk_hash(title, content),
+    }
+    if metadata is not None: record["metadata"] = metadata
+    return record
+
+def article_title(prefix: str, meta: Dict) -> str:
+    """ 「民法典 第一条」/「民法典 第一条~第三条」，无条号时仅用前缀 """
+    articles = meta.get("articles") or []
+    if not articles: return prefix
+    span = articles[0] if len(articles) == 1 else f"{articles[0]}~{articles[-1]}"
+    return f"{prefix} {span}"
+
+manifest: IngestManifest = None  # 在 __main__ 中按 --manifest 初始化
+scanned_roots: set = set()  # 本次完整遍历过的目录 (不存在 / 中途出错的不登记)
+unreadable: set = set()     # 本次解析失败或内容为空的数据源，绝不清理
+legacy: Dict[str, int] = {}  # --seed-from-db：清单之外已入库的旧切片 {hash: documents.id}
+
+def insert_rows(records: List[Dict]):
+    """ 批量写库并登记清单 (异常交给流水线的写入阶段统一处理) """
     if not records: return
+    rows = [{k: v for k, v in r.items() if not k.startswith("_")} for r in records]
+    resp = supabase.table("documents").insert(rows).execute()
+    manifest.add([(r["_source"], r["_hash"], row["id"]) for r, row in zip(records, resp.data)])
+
+def delete_docs(ids: List[int]):
+    for i in range(0, len(ids), 200):
+        supabase.table("documents").delete().in_("id", ids[i:i + 200]).execute()
+
+def legacy_rows(limit: Optional[int] = None) -> Iterator[Dict]:
+    """ documents 中的知识库行 (user_id 为空)，按 id 键集分页 """
+    last = 0
+    while True:
+        page = min(limit, 1000) if limit else 1000
+        rows = (supabase.table("documents").select("id, title, content").is_("user_id", "null")
+                .gt("id", last).order("id").limit(page).execute().data)
+        yield from rows
+        if limit is not None:
+            limit -= len(rows)
+            if limit <= 0: return
+        if len(rows) < page: return
+        last = rows[-1]["id"]
+
+def prune_source(source: str, stale: Dict[str, int]):
+    """ 删除某数据源中已不存在的切片 (数据库 + 清单) """
+    if not stale: return
     try:
-        supabase.table("documents").insert(records).execute()
+        delete_docs([i for i in stale.values() if i is not None])
+        manifest.remove(source, stale.keys())
+        print(f"\n   🗑️ {source}: 删除 {len(stale)} 个过期切片")
     except Exception as e:
-        print(f"   ⚠️ 数据库写入失败: {e}")
+        print(f"\n   ⚠️ {source}: 删除过期切片失败: {e}")
+
+def incremental(records: Iterator[Dict], prune: bool = True) -> Iterator[Dict]:
+    """
+    按清单过滤：已入库且未变化的切片跳过，同一数据源内重复内容只保留一份。
+    某个数据源 (文件) 成功解析并完整遍历后，清单中未再出现的切片视为已删除并清理；
+    整个文件消失的数据源不在这里处理，见 missing_sources。
+    """
+    source, known, seen = None, {}, set()
+
+    def finish():
+        if source is not None and prune:
+            prune_source(source, {h: i for h, i in known.items() if h not in seen})
+
+    for record in records:
+        if record["_source"] != source:
+            finish()
+            source, known, seen = record["_source"], manifest.known(record["_source"]), set()
+        h = record["_hash"]
+        if h in seen: continue
+        seen.add(h)
+        if h in known: continue
+        legacy_id = legacy.pop(h, None)
+        if legacy_id is not None:  # 旧脚本已写入的相同切片：只登记清单，不重复写库
+            manifest.add([(source, h, legacy_id)])
+            known[h] = legacy_id
+            continue
+        yield record
+    finish()
 
 # ---------------- 逻辑 1: 处理民法典 ----------------
 
-def process_minfadian(file_path: str):
+def process_minfadian(file_path: str, use_mmap: bool = False, budget: Optional[int] = 512) -> Iterator[Dict]:
+    """ budget 为 None 时使用旧的逐条切片，否则按 编/章/节/条/款 结构打包到 Token 预算 """
     print(f"\n📘 [1/3] 处理: 民法典...")
     if not os.path.exists(file_path): return
 
-    if check_if_exists("民法典"):
-        print("   ⏩ 已存在，跳过。")
+    source = os.path.basename(file_path)
+    # 流式读取 + 跨块拆分「第X条」，不再整文件 read()
+    blocks = iter_text_blocks(file_path, use_mmap=use_mmap)
+    if budget is None:
+        for clause, body in iter_clauses(blocks):
+            yield make_record(source, f"民法典 {clause}", f"{clause} {body}")
         return
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        text = f.read()
-
-    pattern = r"(第[零一二三四五六七八九十百千]+条\s+)"
-    parts = re.split(pattern, text)
-    
-    current_clause = ""
-    batch_records = []
-    
-    for i in tqdm(range(0, len(parts)), desc="处理法条"):
-        part = parts[i]
-        if re.match(pattern, part):
-            current_clause = part.strip()
-        else:
-            if current_clause and part.strip():
-                content = f"{current_clause} {part.strip()}"
-                embedding = get_embedding(content)
-                if embedding:
-                    batch_records.append({
-                        "title": f"民法典 {current_clause}", 
-                        "content": content,
-                        "embedding": embedding,
-                        "user_id": None 
-                    })
-                if len(batch_records) >= 10:
-                    batch_insert(batch_records)
-                    batch_records = []
-                current_clause = ""
-    if batch_records: batch_insert(batch_records)
+    for content, meta in iter_statute_chunks(iter_lines(blocks), budget=budget):
+        yield make_record(source, article_title("民法典", meta), content, dict(meta, law="民法典"))
 
 # ---------------- 逻辑 2: 处理 LeCaRD 案例 ----------------
 
-def process_lecard(folder_path: str):
+def process_lecard(folder_path: str, budget: Optional[int] = 512) -> Iterator[Dict]:
     print(f"\n📂 [2/3] 处理: LeCaRD 案例...")
     if not os.path.exists(folder_path): return
 
-    files = []
     for root, _, filenames in os.walk(folder_path):
         for filename in filenames:
-            if filename.endswith('.json'):
-                files.append(os.path.join(root, filename))
-    
-    for file_path in tqdm(files, desc="处理案例"):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            case_name = data.get('ajName', os.path.basename(file_path))
-            
-            if check_if_exists(f"案例: {case_name}"): continue
-
-            content = data.get('qw', '') or (data.get('ajjbqk', '') + "\n" + data.get('pjjg', '')).strip()
-            if not content: continue
-
-            chunks = chunk_text(content)
-            batch_records = []
-            for chunk in chunks:
-                embedding = get_embedding(chunk)
-                if embedding:
-                    batch_records.append({
-                        "title": f"案例: {case_name}",
-                        "content": chunk,
-                        "embedding": embedding,
-                        "user_id": None
-                    })
-            batch_insert(batch_records)
-        except Exception: pass
+            if not filename.endswith('.json'): continue
+            file_path = os.path.join(root, filename)
+            source = os.path.relpath(file_path, os.path.dirname(folder_path))
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                case_name = data.get('ajName', os.path.basename(file_path))
+                content = data.get('qw', '') or (data.get('ajjbqk', '') + "\n" + data.get('pjjg', '')).strip()
+            except Exception as e:
+                print(f"\n   ⚠️ {source}: 解析失败，跳过 (已入库的切片保留): {e}")
+                content = None
+            if not content:
+                unreadable.add(source)
+                continue
+
+            if budget is None:
+                for chunk in iter_chunks([content]):
+                    yield make_record(source, f"案例: {case_name}", chunk)
+                continue
+            for chunk, meta in iter_case_chunks(data, budget=budget):
+                yield make_record(source, f"案例: {case_name}", chunk, dict(meta, case=case_name))
+    scanned_roots.add(folder_path)
 
 # ---------------- 逻辑 3: 处理普通 TXT ----------------
 
-def process_general_txt(data_dir: str):
+def process_general_txt(data_dir: str, use_mmap: bool = False, budget: Optional[int] = 512) -> Iterator[Dict]:
     print(f"\n📄 [3/3] 处理: 其他 TXT...")
     if not os.path.exists(data_dir): return
 
     for filename in os.listdir(data_dir):
         if filename.endswith(".txt") and "minfadian" not in filename:
-            if check_if_exists(f"参考资料: {filename}"): continue
-            
             file_path = os.path.join(data_dir, filename)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-            
-            chunks = chunk_text(text)
-            batch_records = []
-            for chunk in tqdm(chunks, desc=filename, leave=False):
-                embedding = get_embedding(chunk)
-                if embedding:
-                    batch_records.append({
-                        "title": f"参考资料: {filename}",
-                        "content": chunk,
-                        "embedding": embedding,
-                        "user_id": None
-                    })
-                if len(batch_records) >= 10:
-                    batch_insert(batch_records)
-                    batch_records = []
-            if batch_records: batch_insert(batch_records)
+            blocks = iter_text_blocks(file_path, use_mmap=use_mmap)
+            if budget is None:
+                for chunk in iter_chunks(blocks):
+                    yield make_record(filename, f"参考资料: {filename}", chunk)
+                continue
+            # 法规类文本同样按条文结构切片；无结构时退化为段落打包
+            for chunk, meta in iter_statute_chunks(iter_lines(blocks), budget=budget):
+                yield make_record(filename, article_title(f"参考资料: {filename}", meta), chunk, meta)
+    scanned_roots.add(data_dir)
+
+def missing_sources(data_dir: str) -> List[str]:
+    """
+    清单中文件已不存在的数据源 (source 均为相对 data_dir 的路径)。
+    只考虑本次完整遍历过的目录：--data-dir 写错 / 目录不存在时一个都不返回；解析失败的文件不会返回。
+    """
+    case_root = os.path.join(data_dir, "lecard_cases")
+    out = []
+    for source in manifest.sources():
+        if source in unreadable: continue
+        root = case_root if source.split(os.sep)[0] == "lecard_cases" else data_dir
+        if root in scanned_roots and not os.path.exists(os.path.join(data_dir, source)):
+            out.append(source)
+    return out
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LawLens 知识库入库 (解析 → 向量化 → 写库 流水线)")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--workers", type=int, default=4, help="并发 Embedding 工作线程数")
+    parser.add_argument("--insert-size", type=int, default=100, help="每次写库的行数")
+    parser.add_argument("--queue-size", type=int, default=8, help="阶段间队列容量 (单位: 批)")
+    parser.add_argument("--manifest", default=".cache/ingest_manifest.sqlite3", help="增量入库清单路径")
+    parser.add_argument("--mmap", action="store_true", help="使用 mmap 读取大文件")
+    parser.add_argument("--chunker", default="structure", choices=["structure", "fixed"],
+                        help="structure: 按法条/判决书结构切片；fixed: 旧版 500 字定长窗口")
+    parser.add_argument("--budget", type=int, default=512, help="结构化切片的 Token 预算")
+    parser.add_argument("--no-prune", action="store_true", help="不删除已变更文件中消失的切片")
+    first_run = parser.add_mutually_exclusive_group()
+    first_run.add_argument("--seed-from-db", action="store_true",
+                           help="清单为空时：documents 中内容相同的旧切片直接登记进清单，不重复写入")
+    first_run.add_argument("--rebuild", action="store_true",
+                           help="清单为空时：先删除 documents 中全部知识库行 (user_id 为空)，再全量入库")
+    parser.add_argument("--prune-missing", action="store_true",
+                        help="删除整个文件已不存在的数据源 (仅限本次完整遍历的目录)")
+    args = parser.parse_args()
+
+    embedder = make_embedder(args.workers)
+    print(f"🚀 客户端初始化完成 (Embedding: {'本地 bge-m3 int8' if EMBED_BACKEND == 'local' else 'SiliconFlow'})。准备开始处理数据...")
+
+    manifest = IngestManifest(args.manifest)
+    # 清单为空而库中已有知识库数据 (旧版脚本写入)：直接全量入库会让每条切片重复一份，必须显式选择处理方式
+    if manifest.count() == 0 and next(legacy_rows(limit=1), None) is not None:
+        if args.rebuild:
+            ids = [r["id"] for r in legacy_rows()]
+            delete_docs(ids)
+            print(f"   🗑️ --rebuild：已删除 {len(ids)} 条旧知识库数据，开始全量入库")
+        elif args.seed_from_db:
+            legacy = {chunk_hash(r["title"], r["content"]): r["id"] for r in legacy_rows()}
+            print(f"   ℹ️ --seed-from-db：读取 {len(legacy)} 条旧切片，内容相同的将直接登记进清单")
+        else:
+            print("❌ 清单为空，但 documents 中已有知识库数据 (user_id 为空)：直接运行会重复入库。\n"
+                  "   请加 --seed-from-db (复用内容相同的旧切片) 或 --rebuild (删除旧数据后重建)。")
+            sys.exit(1)
+
+    pipeline = IngestPipeline(
+        embed_records, insert_rows,
+        workers=args.workers, batch_size=EMBED_BATCH,
+        insert_size=args.insert_size, queue_size=args.queue_size
+    )
     # 执行处理
-    process_minfadian("data/minfadian.txt")
-    process_lecard("data/lecard_cases")
-    process_general_txt("data")
-    print("\n🎉 全部完成！")
\ No newline at end of file
+    budget = args.budget if args.chunker == "structure" else None
+    sources = [
+        ("民法典", process_minfadian(os.path.join(args.data_dir, "minfadian.txt"), use_mmap=args.mmap, budget=budget)),
+        ("案例", process_lecard(os.path.join(args.data_dir, "lecard_cases"), budget=budget)),
+        ("参考资料", process_general_txt(args.data_dir, use_mmap=args.mmap, budget=budget)),
+    ]
+    for name, records in sources:
+        stats = pipeline.run(incremental(records, prune=not args.no_prune), desc=name)
+        print(f"\n   ✅ {name}: 新增/变更 {stats['parsed']} 条，写入 {stats['written']} 条")
+
+    # 整个文件已被删除的数据源：需显式开启，且只清理磁盘上确实不存在的文件
+    missing = missing_sources(args.data_dir)
+    if args.prune_missing:
+        for source in missing:
+            prune_source(source, manifest.known(source))
+    elif missing:
+        print(f"\n   ℹ️ {len(missing)} 个数据源的文件已不存在，如需从知识库删除请加 --prune-missing")
+    if legacy:
+        print(f"\n   ℹ️ {len(legacy)} 条旧切片与当前切片结果不一致，已保留未动 (如需清理请用 --rebuild 重建)")
+    if unreadable:
+        print(f"\n   ⚠️ {len(unreadable)} 个文件解析失败或内容为空，已保留其原有切片")
+    print(f"\n📈 Embedding 缓存: {embedding_cache.stats()}")
+    print(f"📈 Embedding 请求: {embedder.requests} 次 (重试 {embedder.retries} 次，当前批大小 {embedder.batch_size})")
+    print("\n🎉 全部完成！")
@@ -0,0 +1,119 @@
+"""
+/api/analyze 并发流式压测脚本
+
+用法 (先启动 server.py):
+    python scripts/load_test.py --url http://127.0.0.1:8000 --concurrency 20 --requests 40
+
+对比改造前后：分别在旧版 (同步 OpenAI 客户端) 与新版 (AsyncOpenAI) 上运行同一命令，
+比较 "流/秒" 与 "探针延迟"。旧版中一个慢流会卡住整个事件循环，探针延迟会随之飙升。
+
+每个并发工作协程使用独立的 user_id (否则全部请求按同一 IP 计入同一个令牌桶，大部分被 429 拒绝)。
+每个工作协程发出的请求数超过 LAWLENS_USER_BURST (默认 10) 时仍会触发限流，
+此时启动 server.py 前调高 LAWLENS_USER_BURST / LAWLENS_USER_RATE，见 README。
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+
+def percentile(values, p):
+    if not values: return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def one_stream(http: httpx.AsyncClient, url: str, payload: dict, results: list):
+    """发起一次流式请求，记录首包时间、总耗时与收到的字符数"""
+    start = time.perf_counter()
+    ttfb = None
+    chars = 0
+    ok = True
+    status = "error"
+    try:
+        async with http.stream("POST", f"{url}/api/analyze", json=payload) as resp:
+            async for text in resp.aiter_text():
+                if ttfb is None: ttfb = time.perf_counter() - start
+                chars += len(text)
+            ok = resp.status_code == 200
+            status = resp.status_code
+    except Exception as e:
+        print(f"   ⚠️ 请求失败: {e}")
+        ok = False
+    results.append({
+        "ok": ok,
+        "status": status,
+        "ttfb": ttfb if ttfb is not None else time.perf_counter() - start,
+        "total": time.perf_counter() - start,
+        "chars": chars,
+    })
+
+
+async def probe_loop(http: httpx.AsyncClient, url: str, stop: asyncio.Event, samples: list):
+    """压测期间持续请求一个轻量接口，用于观察事件循环是否被阻塞"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await http.get(f"{url}/api/history")
+            samples.append(time.perf_counter() - start)
+        except Exception:
+            pass
+        await asyncio.sleep(0.1)
+
+
+async def run(args):
+    payload = {
+        "messages": [{"role": "user", "content": args.prompt}],
+        "mode": args.mode,
+        "current_doc": "",
+        "selection": args.prompt if args.mode == "selection_polish" else "",
+    }
+    results, probe_samples = [], []
+    remaining = iter(range(args.requests))
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as http:
+        async def worker():
+            # 每个工作协程模拟一个用户，依次发出请求
+            user_payload = dict(payload, user_id=str(uuid.uuid4()))
+            for _ in remaining:
+                await one_stream(http, args.url, user_payload, results)
+
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_loop(http, args.url, stop, probe_samples))
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    ok = [r for r in results if r["ok"]]
+    ttfbs = [r["ttfb"] for r in ok]
+    totals = [r["total"] for r in ok]
+    print("\n📊 压测结果")
+    print(f"   并发数: {args.concurrency} | 请求数: {args.requests} | 成功: {len(ok)}")
+    failed = Counter(r["status"] for r in results if not r["ok"])
+    if failed:
+        print(f"   失败状态: {dict(failed)}" + (" (429 为准入限流，见 README 的 LAWLENS_USER_* 配置)" if 429 in failed else ""))
+    print(f"   总耗时: {elapsed:.2f}s | 吞吐: {len(ok) / elapsed:.2f} 流/秒 | {sum(r['chars'] for r in ok) / elapsed:.0f} 字符/秒")
+    if ok:
+        print(f"   首包 p50/p95: {percentile(ttfbs, 50):.2f}s / {percentile(ttfbs, 95):.2f}s")
+        print(f"   单流 p50/p95: {percentile(totals, 50):.2f}s / {percentile(totals, 95):.2f}s")
+    if probe_samples:
+        print(f"   探针延迟 均值/最大: {statistics.mean(probe_samples) * 1000:.0f}ms / {max(probe_samples) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LawLens /api/analyze 并发流式压测")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--mode", default="draft", choices=["draft", "polish", "chat_doc", "selection_polish"])
+    parser.add_argument("--prompt", default="帮我起草一份房屋租赁合同，租期一年。")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    asyncio.run(run(parser.parse_args()))
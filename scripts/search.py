@@ -1,7 +1,10 @@
 import os
+import sys
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine.local_embedding import sync_embedding_client
 
 # 1. 加载环境变量
 load_dotenv()
@@ -11,15 +14,15 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 # 2. 连接数据库
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# 3. 加载模型 (这个很快，因为模型刚才已经下载过了)
+# 3. Embedding 客户端：与入库 / server.py 相同的 bge-m3 向量空间 (LAWLENS_EMBED_BACKEND=local 时在本地推理)
 print("⏳ 正在加载 AI 模型...")
-model = SentenceTransformer('shibing624/text2vec-base-chinese')
+embed_client = sync_embedding_client()
 
 def search_law(query_text: str):
     print(f"\n🔍 正在搜索: {query_text}")
     
     # 1. 把问题变成向量
-    query_vector = model.encode(query_text).tolist()
+    query_vector = embed_client.embeddings.create(model="BAAI/bge-m3", input=query_text).data[0].embedding
     
     # 2. 去 Supabase 搜索最相似的条款
     # rpc 是 "Remote Procedure Call" 的缩写，就是调用我们在 SQL 里写的函数
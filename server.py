@@ -1,17 +1,37 @@
 import os
 import uvicorn
-import time
+import asyncio
+import functools
 import json
-import mammoth
-import io
 import re  # ✨ 新增：用于正则清洗数据
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from supabase import create_client, Client
-from openai import OpenAI
-from typing import List, Optional
+from supabase.lib.client_options import ClientOptions
+from openai import AsyncOpenAI
+import httpx
+import openai
+from typing import List, Literal, Optional
+from engine.embedding_cache import get_embedding_cache
+from engine.retrieval import Retriever, create_retriever
+from engine.response_cache import ResponseCache, hash_parts
+from engine.risk_scoring import DIMENSIONS, RiskScorer
+from engine.chunking import estimate_tokens, html_to_text, split_sections, split_to_budget
+from engine.long_doc import DocSectionIndex, map_sections
+from engine.prompt_builder import PromptAssembler, count_tokens
+from engine.metrics import (UPSTREAM_ERRORS, current_trace, record_cancel, record_output, record_stage, record_stream,
+                            render_metrics, span, start_trace)
+from engine.upstream import CircuitBreaker, Upstream, build_http_client
+from engine.admission import AdmissionController, AdmissionRejected
+from engine.model_router import ModelRouter, load_routes
+from engine.doc_convert import ConvertError, UploadConverter
+from engine.version_store import VersionStore
+from engine.memory_writer import MemoryWriter
+from engine.streaming import STREAM_RESUMES, ReplayGap, StreamRegistry, cancel_on_disconnect
 
 # ===========================
 # 1. 配置与初始化
@@ -19,12 +39,45 @@ from typing import List, Optional
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 SILICONFLOW_API_KEY = os.getenv("SILICONFLOW_API_KEY")
+SILICONFLOW_BASE_URL = os.getenv("SILICONFLOW_BASE_URL", "https://api.siliconflow.cn/v1")  # 压测时指向本地替身
 
 # ✨ 模型升级：使用 Qwen 2.5 72B (当前开源最强，相当于 Max)
 MODEL_NAME = "Qwen/Qwen2.5-72B-Instruct"
+EMBED_MODEL = "BAAI/bge-m3"
+# ✨ Embedding 后端：remote = SiliconFlow；local = 本地 CPU 上的 int8 bge-m3 (scripts/export_local_embedder.py 导出)
+EMBED_BACKEND = os.getenv("LAWLENS_EMBED_BACKEND", "remote")
+
+# ✨ 阻塞 IO (Supabase SDK 为同步实现) 统一丢进有界线程池，避免卡死事件循环
+IO_WORKERS = int(os.getenv("LAWLENS_IO_WORKERS", "16"))
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="lawlens-io")
+
+# ✨ 上游治理：连接池 / 分阶段超时 / 幂等调用重试 / 熔断 (慢上游时快速失败，不堆积 socket)
+CONNECT_TIMEOUT = float(os.getenv("LAWLENS_CONNECT_TIMEOUT", "5"))
+POOL_TIMEOUT = float(os.getenv("LAWLENS_POOL_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LAWLENS_LLM_TIMEOUT", "120"))  # 非流式补全 / Embedding 的读超时
+FIRST_TOKEN_TIMEOUT = float(os.getenv("LAWLENS_FIRST_TOKEN_TIMEOUT", "30"))
+STREAM_IDLE_TIMEOUT = float(os.getenv("LAWLENS_STREAM_IDLE_TIMEOUT", "30"))
+DB_TIMEOUT = float(os.getenv("LAWLENS_DB_TIMEOUT", "10"))
+UPSTREAM_RETRIES = int(os.getenv("LAWLENS_UPSTREAM_RETRIES", "3"))
+_breaker = lambda name: CircuitBreaker(name, failure_threshold=int(os.getenv("LAWLENS_BREAKER_THRESHOLD", "5")),
+                                       reset_timeout=float(os.getenv("LAWLENS_BREAKER_RESET", "30")))
+_OPENAI_RETRYABLE = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+llm_upstreams = {}  # 每个模型独立熔断：小模型故障不影响回退到 72B
+
+def llm_upstream(model: str) -> Upstream:
+    if model not in llm_upstreams:
+        llm_upstreams[model] = Upstream(f"llm:{model}", _OPENAI_RETRYABLE, retries=UPSTREAM_RETRIES, breaker=_breaker(model))
+    return llm_upstreams[model]
+
+embed_upstream = Upstream("embedding", _OPENAI_RETRYABLE, retries=UPSTREAM_RETRIES, breaker=_breaker("embedding"))
+db_upstream = Upstream("supabase", (httpx.TransportError,), retries=UPSTREAM_RETRIES, breaker=_breaker("supabase"))
 
 supabase: Optional[Client] = None
-client: Optional[OpenAI] = None
+client: Optional[AsyncOpenAI] = None
+embed_client = None  # 提供 embeddings.create：AsyncOpenAI 或 LocalEmbeddingClient
+retriever: Optional[Retriever] = None
+version_store: Optional[VersionStore] = None
+memory_writer: Optional[MemoryWriter] = None
 
 app = FastAPI()
 app.add_middleware(
@@ -33,24 +86,156 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Stream-Id", "X-Prompt-Tokens"],  # 跨域时前端需读取限流等待时间
 )
 
 @app.on_event("startup")
 def startup_event():
-    global supabase, client
+    global supabase, client, embed_client, retriever, version_store, memory_writer
     if not all([SUPABASE_URL, SUPABASE_KEY, SILICONFLOW_API_KEY]):
         print("❌ 错误：核心环境变量缺失")
     try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-        client = OpenAI(
+        supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT))
+        client = AsyncOpenAI(
             api_key=SILICONFLOW_API_KEY,
-            base_url="https://api.siliconflow.cn/v1",
-            timeout=120.0  # ✨ 修复：延长超时时间至 120秒，防止 Connection error
+            base_url=SILICONFLOW_BASE_URL,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT),
+            max_retries=0,  # 重试由 Upstream 按调用是否幂等决定
+            http_client=build_http_client(
+                max_connections=int(os.getenv("LAWLENS_UPSTREAM_MAX_CONNECTIONS", "100")),
+                max_keepalive=int(os.getenv("LAWLENS_UPSTREAM_KEEPALIVE", "20")),
+                connect_timeout=CONNECT_TIMEOUT, read_timeout=LLM_TIMEOUT, pool_timeout=POOL_TIMEOUT,
+            ),
+        )
+        embed_client = client
+        if EMBED_BACKEND == "local":
+            # 并发查询在短窗口内合批推理；workers × threads 约等于 CPU 核数
+            from engine.local_embedding import LocalEmbeddingClient, load_engine
+            workers = int(os.getenv("LAWLENS_LOCAL_EMBED_WORKERS", "2"))
+            embed_client = LocalEmbeddingClient.batched(
+                load_engine(workers=workers), workers=workers,
+                max_batch=int(os.getenv("LAWLENS_LOCAL_EMBED_BATCH", "32")),
+                max_wait=float(os.getenv("LAWLENS_LOCAL_EMBED_WAIT_MS", "5")) / 1000,
+            )
+        retriever = create_retriever(supabase, run_db)
+        # ✨ 文书版本库：快照 + 增量，历史列表只返回元数据
+        version_store = VersionStore(supabase, run_db, snapshot_every=int(os.getenv("LAWLENS_SNAPSHOT_EVERY", "20")),
+                                     run_blocking=run_blocking)
+        # ✨ 记忆 write-behind：后台攒批 Embedding + 批量写入，按用户合并近似重复并定期压缩
+        memory_writer = MemoryWriter(
+            supabase, run_db, embed_texts,
+            dup_threshold=float(os.getenv("LAWLENS_MEMORY_DUP_THRESHOLD", "0.92")),
+            max_per_user=int(os.getenv("LAWLENS_MEMORY_MAX_PER_USER", "200")),
+            compact_interval=float(os.getenv("LAWLENS_MEMORY_COMPACT_INTERVAL", "3600")),
         )
         print(f"✅ LawLens 智能引擎已启动 (模型: {MODEL_NAME} | 全中文优化版)")
     except Exception as e:
         print(f"❌ 初始化失败: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if memory_writer: await memory_writer.close()  # 先排空记忆队列 (需要 Embedding)，再关闭客户端
+    if client: await client.close()
+    if embed_client is not client: embed_client.close()
+    io_pool.shutdown(wait=False)
+    upload_converter.shutdown()
+
+async def run_blocking(fn, *args, **kwargs):
+    """在有界线程池中执行同步调用 (如 supabase.execute())，不阻塞事件循环"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(fn, *args, **kwargs))
+
+async def run_db(fn, *args, idempotent: bool = True, **kwargs):
+    """Supabase 调用：线程池执行 + 熔断；幂等调用 (查询 / RPC) 失败时抖动重试，写入不重试"""
+    return await db_upstream.call(lambda: run_blocking(fn, *args, **kwargs), retry=idempotent)
+
+embedding_cache = get_embedding_cache()
+
+async def cache_get_many(texts: List[str]) -> List[Optional[List[float]]]:
+    """启用 sqlite 层 (LAWLENS_EMBED_CACHE_DB) 时磁盘读取放到线程池，不阻塞事件循环"""
+    if embedding_cache.has_disk: return await run_blocking(embedding_cache.get_many, texts, EMBED_MODEL)
+    return embedding_cache.get_many(texts, EMBED_MODEL)
+
+async def cache_put_many(texts: List[str], vecs: List[List[float]]):
+    """同上：整批一次写入、一次提交"""
+    if embedding_cache.has_disk: await run_blocking(embedding_cache.put_many, texts, EMBED_MODEL, vecs)
+    else: embedding_cache.put_many(texts, EMBED_MODEL, vecs)
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """批量获取向量 (单次请求多条输入)，命中缓存的不再请求"""
+    vecs = await cache_get_many(texts)
+    missing = [i for i, v in enumerate(vecs) if v is None]
+    for start in range(0, len(missing), 32):
+        idx = missing[start:start + 32]
+        with span("embedding"):
+            resp = await embed_upstream.call(
+                lambda: embed_client.embeddings.create(model=EMBED_MODEL, input=[texts[i] for i in idx]))
+        for i, d in zip(idx, sorted(resp.data, key=lambda d: d.index)):
+            vecs[i] = d.embedding
+        await cache_put_many([texts[i] for i in idx], [vecs[i] for i in idx])
+    return vecs
+
+# ✨ 长文档模式：超过阈值的文书在 polish 中分段并行处理，在 chat_doc 中只检索相关段落
+LONG_DOC_TOKENS = int(os.getenv("LAWLENS_LONG_DOC_TOKENS", "6000"))
+LONG_DOC_SECTION_TOKENS = int(os.getenv("LAWLENS_LONG_DOC_SECTION_TOKENS", "2000"))
+LONG_DOC_CONCURRENCY = int(os.getenv("LAWLENS_LONG_DOC_CONCURRENCY", "4"))
+
+# ✨ Prompt Token 预算 (默认 8000，上限为模型上下文窗口 - 输出预留；0 = 取该上限)，超出部分按优先级截断 / 压缩早期对话
+prompt_assembler = PromptAssembler(
+    MODEL_NAME,
+    max_output_tokens=4000,
+    budget=int(os.getenv("LAWLENS_PROMPT_BUDGET", "8000")),
+    summary_tokens=int(os.getenv("LAWLENS_HISTORY_SUMMARY_TOKENS", "300")),
+)
+
+# ✨ 模型路由：轻量模式走小模型 (LAWLENS_ROUTES 配置)，出错 / 输出不合格回退 MODEL_NAME
+model_router = ModelRouter(MODEL_NAME, load_routes())
+
+# ✨ 上传转换：分块落盘 + 进程池转换 + 按文件哈希缓存
+upload_converter = UploadConverter(
+    workers=int(os.getenv("LAWLENS_CONVERT_WORKERS", "2")),
+    max_bytes=int(os.getenv("LAWLENS_UPLOAD_MAX_MB", "20")) * 1024 * 1024,
+    cache_size=int(os.getenv("LAWLENS_UPLOAD_CACHE_SIZE", "64")),
+)
+
+# ✨ 准入控制：全局 / 每用户并发上限 + 令牌桶限速 + 按用户轮转的公平队列
+admission = AdmissionController(
+    max_inflight=int(os.getenv("LAWLENS_MAX_STREAMS", "32")),
+    per_user=int(os.getenv("LAWLENS_USER_STREAMS", "2")),
+    rate=float(os.getenv("LAWLENS_USER_RATE", "0.5")),
+    burst=float(os.getenv("LAWLENS_USER_BURST", "10")),
+    max_queue=int(os.getenv("LAWLENS_MAX_QUEUE", "200")),
+)
+
+# ✨ SSE 流：输出按时间窗口合并为事件 + 有界回放缓冲，断线后带 Last-Event-ID 续传
+stream_registry = StreamRegistry(
+    max_sessions=int(os.getenv("LAWLENS_MAX_STREAM_SESSIONS", "256")),
+    max_events=int(os.getenv("LAWLENS_REPLAY_EVENTS", "2048")),
+    ttl=float(os.getenv("LAWLENS_REPLAY_TTL", "120")),
+    grace=float(os.getenv("LAWLENS_RESUME_GRACE", "10")),  # 断开后等待重连的秒数，超时取消上游生成
+    batch_chars=int(os.getenv("LAWLENS_SSE_BATCH_CHARS", "512")),
+    flush_interval=float(os.getenv("LAWLENS_SSE_FLUSH_MS", "50")) / 1000,
+)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}  # 禁止反向代理缓冲
+
+# ✨ 响应缓存：体检 / 模板起草等重复请求直接回放 (近似层默认关闭，设置阈值如 0.97 开启)
+_semantic = os.getenv("LAWLENS_SEMANTIC_CACHE_THRESHOLD")
+response_cache = ResponseCache(
+    max_size=int(os.getenv("LAWLENS_RESPONSE_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("LAWLENS_RESPONSE_CACHE_TTL", "3600")),
+    semantic_threshold=float(_semantic) if _semantic else None,
+)
+
+async def embed_text(text: str):
+    """调用 BGE-M3 获取向量 (异步)，先查 Embedding 缓存"""
+    vec = (await cache_get_many([text]))[0]
+    if vec is not None: return vec
+    with span("embedding"):
+        resp = await embed_upstream.call(lambda: embed_client.embeddings.create(model=EMBED_MODEL, input=text))
+    vec = resp.data[0].embedding
+    await cache_put_many([text], [vec])
+    return vec
+
 # ===========================
 # 2. 核心修复：JSON 清洗工具
 # ===========================
@@ -90,13 +275,15 @@ class AnalyzeRequest(BaseModel):
     messages: List[ChatMessage]
     current_doc: str = ""
     selection: Optional[str] = "" 
-    mode: str = "draft" 
+    mode: Literal["draft", "polish", "chat_doc", "selection_polish", "risk_score"] = "draft"  # 也用作指标标签，不接受任意值
     user_id: Optional[str] = None 
+    no_cache: bool = False  # 「重新生成」时跳过响应缓存
 
 class DocumentSave(BaseModel):
     title: str
     content: str
     user_id: Optional[str] = None
+    doc_id: Optional[int] = None  # 已保存过的文书传入，新版本以增量形式追加
 
 class MemoryCreate(BaseModel):
     user_id: str
@@ -108,27 +295,23 @@ class MemoryCreate(BaseModel):
 # ===========================
 class MemoryManager:
     @staticmethod
-    def add_memory(user_id: str, content: str, m_type: str = "preference"):
-        if not client or not supabase: return False
-        try:
-            resp = client.embeddings.create(model="BAAI/bge-m3", input=content)
-            vec = resp.data[0].embedding
-            supabase.table("agent_memories").insert({
-                "user_id": user_id, "content": content, "memory_type": m_type, "embedding": vec
-            }).execute()
-            print(f"🧠 [Memory] 已记住: {content}")
-            return True
-        except Exception: return False
+    async def add_memory(user_id: str, content: str, m_type: str = "preference"):
+        """入队即返回：Embedding / 去重 / 写库由 memory_writer 在后台批量完成"""
+        if not client or not memory_writer: return False
+        queued = memory_writer.submit(user_id, content, m_type)
+        if queued: print(f"🧠 [Memory] 已加入写入队列: {content}")
+        return queued
 
     @staticmethod
-    def retrieve_memories(user_id: str, query: str) -> str:
+    async def retrieve_memories(user_id: str, query: str, vec: Optional[List[float]] = None) -> str:
+        """vec 可由调用方传入 (与 RAG 共用同一查询向量)，避免重复 Embedding"""
         if not client or not supabase or not user_id: return ""
         try:
-            resp = client.embeddings.create(model="BAAI/bge-m3", input=query)
-            vec = resp.data[0].embedding
-            rpc_resp = supabase.rpc("match_memories", {
-                "query_embedding": vec, "match_threshold": 0.5, "match_count": 3, "p_user_id": user_id
-            }).execute()
+            if vec is None: vec = await embed_text(query)
+            with span("memory_rpc"):
+                rpc_resp = await run_db(supabase.rpc("match_memories", {
+                    "query_embedding": vec, "match_threshold": 0.5, "match_count": 3, "p_user_id": user_id
+                }).execute)
             if not rpc_resp.data: return ""
             return "\n".join([f"- {m['content']}" for m in rpc_resp.data])
         except Exception: return ""
@@ -139,140 +322,281 @@ class MemoryManager:
 @app.post("/api/upload")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        content = await file.read()
-        result = mammoth.convert_to_html(io.BytesIO(content))
-        return {"status": "success", "content": result.value}
-    except Exception:
-        return {"status": "error", "msg": "文件解析失败，请确保是 .docx 文件"}
+        content = await upload_converter.convert(file)
+        return {"status": "success", "content": content}
+    except ConvertError as e:
+        return {"status": "error", "msg": str(e)}
+    except Exception as e:
+        print(f"❌ Upload error: {e}")
+        return {"status": "error", "msg": "文件解析失败，请确保是 .docx / .pdf / .txt 文件"}
 
 @app.post("/api/memory")
 async def create_memory(mem: MemoryCreate):
-    success = MemoryManager.add_memory(mem.user_id, mem.content, mem.type)
+    success = await MemoryManager.add_memory(mem.user_id, mem.content, mem.type)
     return {"status": "success" if success else "error"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {"embedding": embedding_cache.stats(), "response": response_cache.stats(), "admission": admission.stats(), "upload": upload_converter.stats(),
+            "routes": model_router.stats(), "streams": stream_registry.stats(),
+            "memory": memory_writer.stats() if memory_writer else None,
+            "local_embedding": embed_client.stats() if embed_client is not None and embed_client is not client else None}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文本格式指标"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/save")
 async def save_document(doc: DocumentSave):
-    if not supabase: return {"status": "error", "msg": "DB未连接"}
+    if not version_store: return {"status": "error", "msg": "DB未连接"}
     try:
         raw_text = doc.content.replace('<', '').replace('>', '')[:20]
         title = doc.title if doc.title and doc.title != "未命名法律文书" else f"{raw_text}..."
-        supabase.table("documents").insert({"title": title, "content": doc.content, "user_id": doc.user_id}).execute()
-        return {"status": "success"}
+        saved = await version_store.save(doc.user_id, title, doc.content, doc.doc_id)
+        return {"status": "success", **saved}
     except Exception as e:
         return {"status": "error", "msg": str(e)}
 
 @app.get("/api/history")
-async def get_history(user_id: Optional[str] = None):
-    if not supabase: return []
+async def get_history(user_id: Optional[str] = None, before: Optional[int] = None, limit: int = 20):
+    """只返回元数据 (id / doc_id / title / size / created_at)；翻页时传入上一页最后一条的 id 作为 before"""
+    if not version_store: return []
     try:
-        query = supabase.table("documents").select("*").order("created_at", desc=True).limit(20)
-        if user_id: query = query.eq("user_id", user_id)
-        else: query = query.is_("user_id", "null")
-        return query.execute().data
+        return await version_store.list(user_id, before, max(1, min(limit, 100)))
     except Exception: return []
 
+@app.get("/api/history/{version_id}")
+async def get_history_item(version_id: int, user_id: Optional[str] = None):
+    """按需加载某个版本的正文"""
+    if not version_store: return {"status": "error", "msg": "DB未连接"}
+    try:
+        item = await version_store.load(version_id, user_id)
+    except Exception as e:
+        return {"status": "error", "msg": str(e)}
+    return item or {"status": "error", "msg": "版本不存在"}
+
 # ===========================
 # 6. 核心 AI 逻辑 (全汉化 + 强壮性修复)
 # ===========================
 
-def get_rag_context(query: str):
-    if not client or not supabase: return ""
+async def _complete(model: str, prompt: str) -> str:
+    with span("llm_complete"):
+        # 评分请求无副作用，可安全重试
+        completion = await llm_upstream(model).call(lambda: client.chat.completions.create(
+            model=model, 
+            messages=[
+                {"role": "system", "content": "你是一个只输出 JSON 格式的 API 接口。"},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.1, 
+        ))
+    return completion.choices[0].message.content
+
+async def complete_json(prompt: str, mode: str = "risk_score", valid=None) -> str:
+    """非流式 JSON 补全：按路由选模型，出错或 valid(原始输出) 不通过时回退默认模型"""
+    input_tokens = count_tokens(prompt, MODEL_NAME)
+    route = model_router.pick(mode, input_tokens)
+    while True:
+        start = time.perf_counter()
+        try:
+            raw = await _complete(route.model, prompt)
+        except Exception:
+            model_router.record(route, None, input_tokens, outcome="error")
+            if route is model_router.default: raise
+            route = model_router.default
+            continue
+        ok = route is model_router.default or valid is None or valid(raw)
+        model_router.record(route, time.perf_counter() - start, input_tokens, count_tokens(raw, MODEL_NAME),
+                            "ok" if ok else "fallback")
+        if ok: return raw
+        route = model_router.default
+
+def valid_risk_json(raw: str) -> bool:
+    data = clean_json_output(raw)
+    items = data.get("clauses") if isinstance(data, dict) else None
+    return isinstance(items, list) and bool(items) and \
+        all(isinstance(i, dict) and all(d in i for d in DIMENSIONS) for i in items)
+
+doc_index = DocSectionIndex(embed_texts)
+
+async def llm_stream(messages: List[dict], temperature: float = 0.4, max_tokens: int = 4000):
+    """流式补全，逐片产出文本 (记录建连 / 首 Token / 输出速率)；小模型在首 Token 前失败或空输出时回退默认模型"""
+    trace = current_trace()
+    mode = trace.mode if trace else "-"
+    input_tokens = sum(count_tokens(m["content"], MODEL_NAME) for m in messages)
+    route = model_router.pick(mode, input_tokens)
+    while True:
+        start = time.perf_counter()
+        first, tokens = None, 0
+        upstream = llm_upstream(route.model)
+        try:
+            with span("llm_connect"):
+                # 仅 429 (请求未被处理) 时重试；其余错误直接报给前端
+                stream = await upstream.call(lambda: client.chat.completions.create(
+                    model=route.model, 
+                    messages=messages,
+                    stream=True, 
+                    temperature=temperature,
+                    max_tokens=max_tokens 
+                ), retry_on=(openai.RateLimitError,))
+            async for chunk in upstream.stream(stream, FIRST_TOKEN_TIMEOUT, STREAM_IDLE_TIMEOUT,
+                                               is_token=lambda c: bool(c.choices and c.choices[0].delta.content)):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first is None: first = time.perf_counter()
+                    tokens += count_tokens(chunk.choices[0].delta.content, MODEL_NAME)
+                    yield chunk.choices[0].delta.content
+        except asyncio.CancelledError:
+            # 客户端断开：upstream.stream 的 finally 已关闭上游连接
+            model_router.record(route, first - start if first else None, input_tokens, tokens, "cancelled")
+            saved = record_cancel(mode, tokens, max_tokens)
+            print(f"🛑 [Stream] 已中止上游生成 ({route.model})：已输出 {tokens} tokens，预计节省 {saved} tokens")
+            raise
+        except Exception:
+            UPSTREAM_ERRORS.inc(stage="llm_stream")
+            model_router.record(route, None, input_tokens, tokens, "error")
+            if first is None and route is not model_router.default:
+                print(f"↩️ [Router] {route.name} ({route.model}) 失败，回退 {MODEL_NAME}")
+                route = model_router.default
+                continue
+            raise
+        finally:
+            end = time.perf_counter()
+            record_stage("llm_stream", end - start)
+            record_stream(mode, first - start if first else None, tokens, end - first if first else 0)
+        if first is None and route is not model_router.default:
+            model_router.record(route, None, input_tokens, 0, "fallback")
+            route = model_router.default
+            continue
+        model_router.record(route, first - start if first else None, input_tokens, tokens)
+        record_output(mode, tokens)
+        return
+
+risk_scorer = RiskScorer(lambda prompt: complete_json(prompt, valid=valid_risk_json), clean_json_output,
+                         concurrency=int(os.getenv("LAWLENS_RISK_CONCURRENCY", "4")))
+
+async def get_rag_context(query: str, vec: Optional[List[float]] = None):
+    if not client or not retriever: return ""
     try:
-        resp = client.embeddings.create(model="BAAI/bge-m3", input=query)
-        vec = resp.data[0].embedding
-        rpc_resp = supabase.rpc("match_documents", {
-            "query_embedding": vec, "match_threshold": 0.45, "match_count": 3 
-        }).execute()
+        if vec is None: vec = await embed_text(query)
+        with span("rag"):
+            docs = await retriever.search(query, vec, k=3, threshold=0.45)
         
-        if not rpc_resp.data: return ""
+        if not docs: return ""
         formatted = ""
-        for i, doc in enumerate(rpc_resp.data):
+        for i, doc in enumerate(docs):
             snippet = doc['content'][:500].replace('\n', ' ')
             formatted += f"【参考资料 {i+1}】\n{snippet}...\n"
         return formatted
     except Exception: return ""
 
+async def retrieve_contexts(mode: str, user_id: Optional[str], query: str):
+    """检索流水线：共享查询向量 → 并发扇出 match_documents / match_memories，返回 (RAG, 记忆, 查询向量)"""
+    need_rag = mode != "selection_polish" and mode != "chat_doc"
+    need_mem = bool(user_id)
+    if not client or not supabase or not (need_rag or need_mem): return "", "", None
+    try:
+        vec = await embed_text(query)
+    except Exception:
+        return "", "", None
+
+    async def empty(): return ""
+    rag_context, memory_context = await asyncio.gather(
+        get_rag_context(query, vec) if need_rag else empty(),
+        MemoryManager.retrieve_memories(user_id, query, vec) if need_mem else empty(),
+    )
+    return rag_context, memory_context, vec
+
+async def replay_stream(chunks: List[str]):
+    """按原分片回放缓存的流式回答"""
+    for chunk in chunks:
+        yield chunk
+        await asyncio.sleep(0)
+
 @app.post("/api/analyze")
-async def analyze(request: AnalyzeRequest):
+async def analyze(request: AnalyzeRequest, http_request: Request):
     """核心 AI 接口"""
+    trace = start_trace(request.mode, request.user_id)
+    # 未登录用户按来源 IP 计入限流
+    user_key = request.user_id or f"ip:{http_request.client.host if http_request.client else '-'}"
+    try:
+        admission.check_rate(user_key)
+    except AdmissionRejected as e:
+        trace.finish(rejected=e.status_code)
+        return JSONResponse({"error": str(e)}, status_code=e.status_code,
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
     
-    # --- P2: 风险评分 (修复体检失败问题) ---
+    # --- P2: 风险评分 (分段增量体检：全文覆盖，仅重评修改过的条款) ---
     if request.mode == "risk_score":
         try:
-            print("📊 [Risk Scan] 正在调用 Qwen 72B 进行体检...")
-            
-            prompt = f"""
-            你是一名资深的法律合规专家。请仔细审查以下法律文书片段，并从四个维度进行评分（0-100分）。
-            
-            【待审文书内容】
-            {request.current_doc[:4000]} 
-            
-            【任务要求】
-            请直接返回一个标准的 JSON 对象，不要包含任何 Markdown 格式（如 ```json），不要包含任何额外的解释文字。
-            
-            JSON 数据结构必须严格如下：
-            {{
-                "total_score": 85,
-                "summary": "这里写一句话的中文简评，指出主要风险或优点。",
-                "dimensions": [
-                    {{ "subject": "合规性", "A": 90, "fullMark": 100 }},
-                    {{ "subject": "权益保护", "A": 75, "fullMark": 100 }},
-                    {{ "subject": "完整性", "A": 85, "fullMark": 100 }},
-                    {{ "subject": "文本规范", "A": 95, "fullMark": 100 }}
-                ]
-            }}
-            """
-            
-            completion = client.chat.completions.create(
-                model=MODEL_NAME, 
-                messages=[
-                    {"role": "system", "content": "你是一个只输出 JSON 格式的 API 接口。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.1, 
-            )
-            
-            raw_content = completion.choices[0].message.content
-            # ✨ 核心修复：使用清洗函数处理返回内容
-            result = clean_json_output(raw_content)
+            cache_key = ResponseCache.make_key(request.mode, MODEL_NAME, request.current_doc)
+            cached = None if request.no_cache else response_cache.get(cache_key)
+            if cached is not None:
+                print("📊 [Risk Scan] 文书未变化，命中缓存")
+                trace.finish(cached=True)
+                return JSONResponse(cached)
+
+            # 分批评分并发的路数计入全局上限；全部命中条款缓存时不占名额
+            result = await risk_scorer.score(request.current_doc,
+                                             acquire=lambda n: admission.slot(user_key, weight=n))
+            sections = result.get("sections", {})
+            print(f"📊 [Risk Scan] 共 {sections.get('total', 0)} 条，重新评分 {sections.get('rescored', 0)} 条 "
+                  f"({sections.get('batches', 0)} 次调用)")
+            if result.get("dimensions"): response_cache.put(cache_key, result)  # 解析失败的兜底结果不缓存
+            trace.finish(cached=False, sections=sections)
             
             return JSONResponse(result)
             
         except Exception as e:
             print(f"❌ Risk scan error: {e}")
-            return JSONResponse({"error": "AI 服务响应异常，请稍后重试"}, status=500)
+            trace.finish(error=str(e))
+            return JSONResponse({"error": "AI 服务响应异常，请稍后重试"}, status_code=500)
 
     # --- 常规流式模式 (全汉化 Prompt) ---
     last_user_msg = request.selection if request.mode == "selection_polish" else request.messages[-1].content
     user_id = request.user_id
     
-    # 1. RAG
-    rag_context = ""
-    found_cases = False
-    if request.mode != "selection_polish" and request.mode != "chat_doc":
-        rag_context = get_rag_context(last_user_msg)
-        if rag_context: found_cases = True
-
-    # 2. 记忆
-    memory_context = ""
-    if user_id:
-        memory_context = MemoryManager.retrieve_memories(user_id, last_user_msg)
-
-    # 3. 构造中文 Prompt
+    # 1+2. 检索阶段：查询向量只计算一次，RAG 与记忆两路 RPC 并发执行
+    rag_context, memory_context, query_vec = await retrieve_contexts(request.mode, user_id, last_user_msg)
+    found_cases = bool(rag_context)
+
+    # 长文档判定：polish 走分段 map-reduce，chat_doc 走文内检索
+    # (一律先转为纯文本再按 Token 计量，不再截取原始 HTML：标签多的文书不会被静默截断)
+    long_doc = False
+    doc_context = request.current_doc
+    if request.mode in ("polish", "chat_doc"):
+        doc_text = html_to_text(request.current_doc)
+        long_doc = estimate_tokens(doc_text) > LONG_DOC_TOKENS
+    if request.mode == "chat_doc":
+        doc_context = doc_text
+        if long_doc:
+            try:
+                if query_vec is None: query_vec = await embed_text(last_user_msg)
+                doc_context = await doc_index.relevant(request.current_doc, query_vec, budget=LONG_DOC_TOKENS)
+            except Exception as e:
+                print(f"⚠️ [Long Doc] 文内检索失败，回退为截取前 {LONG_DOC_TOKENS} Token: {e}")
+                doc_context = next(split_to_budget(doc_text, LONG_DOC_TOKENS))
+    polish_sections = split_sections(doc_text, LONG_DOC_SECTION_TOKENS) \
+        if request.mode == "polish" and long_doc else []
+
+    # 3. 构造中文 Prompt (按 Token 预算装配：系统指令 → 选区 → RAG → 记忆 → 近期对话)
     memory_section = f"【⚠️ 用户偏好记忆】\n请严格遵守：{memory_context}\n" if memory_context else ""
-    rag_section = f"【📚 法律数据库】\n{rag_context}\n" if rag_context else "（使用通用法律知识）"
+    rag_section = f"【📚 法律数据库】\n{rag_context}\n" if rag_context else ""
 
     base_role = "你是由 LawLens 开发的中国顶尖法律 AI 助手。你的回答必须专业、严谨、符合中国法律规范。"
     html_hint = "使用 HTML 标签排版 (<h3>, <b>, <ul>, <blockquote>)，禁止使用 Markdown。"
+    # 长文档 polish 实际按段发送，预算以最长的一段计
+    prompt_doc = max(polish_sections, key=len) if polish_sections else request.current_doc
 
-    system_instruction = ""
-
-    if request.mode == "draft":
-        system_instruction = f"""
+    def build_instruction(parts: dict) -> str:
+        memory = parts.get("memory", "")
+        rag = parts.get("rag") or "（使用通用法律知识）"
+        if request.mode == "draft":
+            return f"""
         {base_role}
         【任务】根据用户需求起草法律文书。
-        {memory_section}
-        {rag_section}
+        {memory}
+        {rag}
         {html_hint}
         【输出结构】
         1. **分析报告** (必须包裹在 <blockquote> 标签中):
@@ -281,13 +605,13 @@ async def analyze(request: AnalyzeRequest):
            - **起草策略**: 说明重点条款的设计思路。
         2. **正式文书**: 完整的合同或函件内容。
         """
-    elif request.mode == "polish":
-        system_instruction = f"""
+        if request.mode == "polish":
+            return f"""
         {base_role}
         【任务】审查并润色法律文书。
-        {memory_section}
-        【待审文档】'''{request.current_doc}'''
-        {rag_section}
+        {memory}
+        【待审文档】'''{prompt_doc}'''
+        {rag}
         {html_hint}
         【输出结构】
         1. **审查意见** (必须包裹在 <blockquote> 标签中):
@@ -295,37 +619,78 @@ async def analyze(request: AnalyzeRequest):
            - **修改依据**: 解释为什么要改。
         2. **修订后全文**: 输出完整文本，用 <b>加粗</b> 标记修改处。
         """
-    elif request.mode == "chat_doc":
-        system_instruction = f"""
+        if request.mode == "chat_doc":
+            return f"""
         {base_role}
         【任务】基于当前文档回答问题。
-        【文档内容】'''{request.current_doc[:10000]}'''
+        【文档内容】'''{doc_context}'''
         【用户问题】"{last_user_msg}"
         【要求】答案必须基于文档，引用原文时请加粗。
         """
-    else: 
-        system_instruction = f"""
+        return f"""
         {base_role}
         【任务】微调选中文本，使其更专业。
-        {memory_section}
-        【原文】"{request.selection}"
+        {memory}
+        【原文】"{parts.get("selection", "")}"
         【指令】"{last_user_msg}"
         【要求】仅输出修改后的文本。
         """
 
-    messages = [{"role": "system", "content": system_instruction}]
     if request.mode != "selection_polish":
         history = [m.dict() for m in request.messages if m.role != "system"]
-        messages.extend(history)
+        sections = [("rag", rag_section), ("memory", memory_section)]
     else:
-        messages.append({"role": "user", "content": last_user_msg})
+        history = [{"role": "user", "content": last_user_msg}]
+        sections = [("selection", request.selection), ("memory", memory_section)]
+    messages, fitted, prompt_usage = prompt_assembler.assemble(build_instruction, sections, history)
+    memory_section, rag_section = fitted.get("memory", ""), fitted.get("rag") or "（使用通用法律知识）"
+    print(f"🧮 [Prompt] {prompt_usage['used']}/{prompt_usage['budget']} tokens | "
+          f"历史保留 {prompt_usage['history_kept']} 条，压缩 {prompt_usage['history_dropped']} 条")
+
+    def polish_section_messages(i: int, section: str) -> List[dict]:
+        instruction = f"""
+        {base_role}
+        【任务】审查并润色一份长篇法律文书的第 {i + 1}/{len(polish_sections)} 部分。
+        {memory_section}
+        【待审片段】'''{section}'''
+        {rag_section}
+        {html_hint}
+        【输出结构】
+        1. **审查意见** (必须包裹在 <blockquote> 标签中，只针对本部分):
+           - **风险提示**: 指出法律漏洞。
+           - **修改依据**: 解释为什么要改。
+        2. **修订后片段**: 输出本部分完整文本，用 <b>加粗</b> 标记修改处。
+        """
+        return [{"role": "system", "content": instruction}] + messages[1:]
+
+    async def polish_section(i: int, section: str):
+        yield f"<h3>第 {i + 1} 部分</h3>"
+        async for piece in llm_stream(polish_section_messages(i, section)):
+            yield piece
+
+    # 响应缓存：精确键覆盖完整 Prompt；近似层限定在相同上下文 / 文档 / 选区 / 此前对话的作用域内
+    # (「再详细一点」之类的追问只在同一段对话中才可能命中)
+    context_hash = hash_parts(rag_context, memory_context)
+    history_hash = hash_parts(json.dumps(history[:-1], ensure_ascii=False))
+    cache_key = ResponseCache.make_key(request.mode, MODEL_NAME, json.dumps(messages, ensure_ascii=False),
+                                       hash_parts(context_hash, request.current_doc))
+    cache_scope = hash_parts(request.mode, MODEL_NAME, context_hash, request.current_doc, request.selection,
+                             history_hash)
+    cached_chunks = None if request.no_cache else response_cache.get(cache_key, query_vec, cache_scope)
 
     async def generate_stream():
+        # 在生成器内排队：客户端提前断开时 finally 一定会归还名额
+        # 长文档分段润色同时发起多路上游流，按扇出宽度计入全局并发上限
+        width = min(LONG_DOC_CONCURRENCY, len(polish_sections)) if polish_sections else 1
+        ticket = None if cached_chunks is not None else admission.enqueue(user_key, weight=width)
         try:
+            queue_pos = ticket.position() if ticket else 0
             # A. 进度条 (全中文)
             if request.mode != "selection_polish":
                 status_rag = f"✅ 已匹配 {rag_context.count('【参考资料')} 个相关案例" if found_cases else "⚠️ 通用法律模式"
                 status_mem = "✅ 命中用户偏好" if memory_context else "无特定偏好"
+                status_long = f"<li>长文档模式：{len(polish_sections)} 段并行审阅</li>" if polish_sections else ""
+                status_queue = f"<li>⏳ 排队中：第 {queue_pos} 位 (当前请求较多，请稍候)</li>" if queue_pos else ""
                 
                 status_html = f"""
                 <div style="background:#f8fafc; padding:12px; border-radius:8px; border:1px solid #e2e8f0; margin-bottom:16px; font-size:13px; color:#475569;">
@@ -337,26 +702,71 @@ async def analyze(request: AnalyzeRequest):
                         <li>正在分析案情：{last_user_msg[:10]}...</li>
                         <li>检索数据库：{status_rag}</li>
                         <li>检索记忆库：{status_mem}</li>
+                        {status_long}
+                        {status_queue}
                     </ul>
                 </div>
                 """
                 yield status_html
-                time.sleep(0.5)
-
-            stream = client.chat.completions.create(
-                model=MODEL_NAME, 
-                messages=messages,
-                stream=True, 
-                temperature=0.4,
-                max_tokens=4000 
-            )
-            for chunk in stream:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
+                if cached_chunks is None: await asyncio.sleep(0.5)
+
+            if ticket:
+                async for pos in ticket.wait():
+                    if pos != queue_pos and request.mode != "selection_polish":
+                        yield f"<p style='font-size:12px; color:#94a3b8; margin:2px 0;'>⏳ 排队中：第 {pos} 位</p>"
+
+            if cached_chunks is not None:
+                async for chunk in replay_stream(cached_chunks):
+                    yield chunk
+                return
+
+            if polish_sections:
+                source = map_sections(polish_sections, polish_section, concurrency=LONG_DOC_CONCURRENCY)
+            else:
+                source = llm_stream(messages)
+            answer = []
+            async for piece in source:
+                answer.append(piece)
+                yield piece
+            # 仅缓存完整生成的回答
+            if answer: response_cache.put(cache_key, answer, query_vec, cache_scope)
         except Exception as e:
+            trace.fields["error"] = str(e)
             yield f"<p style='color:red'>AI 服务响应错误 (超时或中断): {str(e)}</p>"
+        finally:
+            if ticket: ticket.release()
+            trace.finish(cached=cached_chunks is not None, prompt_tokens=prompt_usage["used"])
+
+    # 生成在后台会话中进行，响应只是订阅者：断线后可续传；所有订阅者断开超过宽限期才取消生成
+    # (上游流随之关闭，排队 / 占用的名额在 generate_stream 的 finally 中归还)
+    session = stream_registry.start(generate_stream())
+    return StreamingResponse(cancel_on_disconnect(http_request, stream_registry.attach(session), request.mode),
+                             media_type="text/event-stream",
+                             headers={"X-Prompt-Tokens": str(prompt_usage["used"]), "X-Stream-Id": session.id,
+                                      **SSE_HEADERS})
+
+@app.get("/api/analyze/stream/{stream_id}")
+async def resume_stream(stream_id: str, http_request: Request, last_event_id: int = 0):
+    """断线续传：带 Last-Event-ID (请求头或 ?last_event_id=) 重连，从断点继续接收，不重新生成"""
+    header = http_request.headers.get("last-event-id")
+    last_id = int(header) if header and header.isdigit() else last_event_id
+    session = stream_registry.get(stream_id)
+    if session is None:
+        STREAM_RESUMES.inc(outcome="expired")
+        return JSONResponse({"error": "生成会话已过期，请重新生成"}, status_code=404)
+    try:
+        session.check_resume(last_id)
+    except ReplayGap:
+        STREAM_RESUMES.inc(outcome="gap")
+        return JSONResponse({"error": "断点已超出回放范围，请重新生成"}, status_code=410)
+    STREAM_RESUMES.inc(outcome="ok")
+    return StreamingResponse(cancel_on_disconnect(http_request, stream_registry.attach(session, last_id), "resume"),
+                             media_type="text/event-stream", headers={"X-Stream-Id": session.id, **SSE_HEADERS})
 
-    return StreamingResponse(generate_stream(), media_type="text/event-stream")
+@app.delete("/api/analyze/stream/{stream_id}")
+async def cancel_stream(stream_id: str):
+    """用户主动停止生成：立即取消，不等待重连宽限期"""
+    return {"status": "success" if stream_registry.cancel(stream_id) else "error"}
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,54 @@
+"""
+StreamSession.subscribe：慢订阅者在追赶期间生成结束，不应等到保活超时才收到剩余事件
+
+运行：python -m unittest tests.test_streaming (或 python -m pytest tests)
+"""
+import asyncio
+import time
+import unittest
+
+from engine.streaming import StreamSession
+
+KEEPALIVE = 2.0
+
+
+async def fast_source(count: int, interval: float):
+    for i in range(count):
+        yield f"片段{i}"
+        await asyncio.sleep(interval)
+
+
+class SubscribeTest(unittest.IsolatedAsyncioTestCase):
+    async def collect(self, session: StreamSession, delay: float):
+        frames = []
+        async for frame in session.subscribe(keepalive=KEEPALIVE):
+            frames.append(frame)
+            await asyncio.sleep(delay)  # 慢消费者：每个事件之间挂起，期间生产者继续发布
+        return frames
+
+    async def test_slow_consumer_finishes_without_keepalive_wait(self):
+        session = StreamSession("t", max_events=1000, batch_chars=1, flush_interval=0.01)
+        session.task = asyncio.ensure_future(session.run(fast_source(20, 0.005)))
+        start = time.monotonic()
+        frames = await asyncio.wait_for(self.collect(session, 0.02), KEEPALIVE * 2)
+        elapsed = time.monotonic() - start
+
+        self.assertLess(elapsed, KEEPALIVE / 2)
+        self.assertFalse(any(f.startswith(":") for f in frames))  # 未触发保活
+        self.assertTrue(frames[-1].startswith(f"id: {session.seq}\nevent: done"))
+        self.assertEqual("".join(f"片段{i}" for i in range(20)),
+                         "".join(line[6:] for f in frames if "event:" not in f
+                                 for line in f.splitlines() if line.startswith("data: ")))
+
+    async def test_slow_consumer_gets_gap_after_buffer_slides(self):
+        session = StreamSession("t", max_events=4, batch_chars=1, flush_interval=0.01)
+        session.task = asyncio.ensure_future(session.run(fast_source(20, 0)))
+        frames = await asyncio.wait_for(self.collect(session, 0.02), KEEPALIVE * 2)
+        # 缓冲只保留 4 条，慢订阅者落后时收到 gap 而不是错位的事件
+        self.assertIn("event: gap", frames[-1])
+        ids = [int(f.split("\n")[0][4:]) for f in frames if f.startswith("id: ")]
+        self.assertEqual(ids, list(range(1, len(ids) + 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()